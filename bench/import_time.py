@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+import_time.py
+
+Measure how long a fresh interpreter takes to import pyzotero.zotero, and
+which optional dependencies the import pulls in. From the repository root:
+
+python -m bench.import_time --runs 20
+
+This file is part of Pyzotero.
+
+Pyzotero is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pyzotero is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Pyzotero. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+# modules which should only be imported when they're needed
+DEFERRED = (
+    'requests', 'feedparser', 'pytz', 'mimetypes', 'hashlib', 'uuid')
+
+PROBE = '''
+import sys, time, json
+before = set(sys.modules)
+start = time.time()
+import %s
+elapsed = time.time() - start
+print(json.dumps({
+    "seconds": elapsed,
+    "loaded": sorted(m for m in %r if m in sys.modules and m not in before),
+}))
+'''
+
+
+def measure(module, runs):
+    """
+    Import module in runs fresh interpreters, and return a list of import
+    times, and the deferred modules which were loaded by the import
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    times = []
+    loaded = set()
+    for _ in range(runs):
+        out = subprocess.check_output(
+            [sys.executable, '-c', PROBE % (module, DEFERRED)], cwd=root)
+        result = json.loads(out.decode('utf-8'))
+        times.append(result['seconds'])
+        loaded.update(result['loaded'])
+    return times, sorted(loaded)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--module', default='pyzotero.zotero')
+    args = parser.parse_args(argv)
+    times, loaded = measure(args.module, args.runs)
+    times.sort()
+    print('import %s, %s runs' % (args.module, args.runs))
+    print('min:    %.1f ms' % (times[0] * 1000))
+    print('median: %.1f ms' % (times[len(times) // 2] * 1000))
+    print('deferred modules loaded at import: %s' % (
+        ', '.join(loaded) or 'none'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,374 @@
+# -*- coding: utf-8 -*-
+"""
+run.py
+
+Offline throughput benchmarks for Pyzotero, run against a local stub API
+server (see server.py). From the repository root:
+
+python -m bench.run --size 5000 --latency 0.005
+
+This file is part of Pyzotero.
+
+Pyzotero is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pyzotero is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Pyzotero. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+from pyzotero import zotero
+from pyzotero import metrics
+from pyzotero import buffer
+from pyzotero import render
+from pyzotero import transport
+from pyzotero import cache
+
+from .server import StubServer, SyntheticLibrary
+
+
+def peak_rss():
+    """
+    Return this process's peak resident set size in MiB, if known. This is
+    a high-water mark for the whole process, so each benchmark is run in a
+    process of its own (see isolated())
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    if sys.platform == 'darwin':
+        peak = peak / 1024.0
+    return peak / 1024.0
+
+
+def percentile(values, pct):
+    """ Return the pct-th percentile of a list of numbers
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    pos = int(round(pct / 100.0 * (len(ordered) - 1)))
+    return ordered[pos]
+
+
+class Recorder(object):
+    """ Collect request latencies from a metrics.Metrics listener
+    """
+    def __init__(self):
+        self.latencies = []
+        self.received = 0
+        self.wire = 0
+
+    def __call__(self, event, fields):
+        if event == 'request':
+            self.latencies.append(fields['seconds'])
+            self.received += fields['received']
+            self.wire += fields['wire']
+
+
+def client(library, url, transport=None, encodings=None):
+    """ Return a Zotero instance pointing at a stub server, and a Recorder
+    """
+    recorder = Recorder()
+    registry = metrics.Metrics()
+    registry.subscribe(recorder)
+    zot = zotero.Zotero(
+        library.library_id,
+        library.library_type[:-1],
+        'benchmark',
+        metrics=registry,
+        transport=transport,
+        encodings=encodings)
+    zot.endpoint = url
+    return zot, recorder
+
+
+def bench_everything(zot, args):
+    """ Retrieve every item in the library, 100 at a time
+    """
+    return len(zot.everything(zot.items(limit=100)))
+
+
+def bench_versions(zot, args):
+    """ Retrieve the version of every item in the library
+    """
+    return len(zot.item_versions())
+
+
+def bench_create_items(zot, args):
+    """ Create items in batches of 50
+    """
+    template = zot.item_template('book')
+    created = 0
+    while created < args.create:
+        batch = [dict(template, title='Item %s' % (created + i))
+                 for i in range(min(50, args.create - created))]
+        created += len(zot.create_items(batch)['success'])
+    return created
+
+
+def bench_buffered_edits(zot, args):
+    """ Make several edits to each of the first --edit items, using a
+        WriteBuffer
+    """
+    items = zot.everything(zot.items(limit=100))[:args.edit]
+    with buffer.WriteBuffer(zot) as buf:
+        for item in items:
+            buf.add_tags(item, 'reviewed')
+            buf.add_tags(item, 'benchmark')
+            buf.update(item, extra='Edited')
+    return len(buf.written)
+
+
+def bench_upload(zot, args):
+    """ Create attachments and upload their files
+    """
+    tmp = tempfile.mkdtemp()
+    try:
+        files = []
+        for i in range(args.uploads):
+            path = os.path.join(tmp, 'file%s.pdf' % i)
+            with open(path, 'wb') as f:
+                f.write(os.urandom(args.upload_size))
+            files.append(path)
+        uploaded = 0
+        for pos in range(0, len(files), 50):
+            uploaded += len(
+                zot.attachment_simple(files[pos:pos + 50])['success'])
+        return uploaded
+    finally:
+        shutil.rmtree(tmp)
+
+
+def bench_cold_start(zot, args):
+    """
+    Start Zotero instances one after another, as a fleet of workers would
+    after a deploy, each retrieving item templates, item fields and the
+    first page of top-level items. They share an SQLite cache, unless
+    --private-caches is given
+    """
+    tmp = tempfile.mkdtemp()
+    try:
+        shared = cache.SQLiteCache(os.path.join(tmp, 'cache.db'))
+        for _ in range(args.workers):
+            worker = zotero.Zotero(
+                zot.library_id,
+                zot.library_type[:-1],
+                'benchmark',
+                metrics=zot.metrics,
+                transport=zot.transport,
+                memoize=60,
+                cache=None if args.private_caches else shared)
+            worker.endpoint = zot.endpoint
+            for item_type in ('book', 'journalArticle', 'thesis'):
+                worker.item_template(item_type)
+            worker.item_fields()
+            worker.top(limit=100)
+        return args.workers
+    finally:
+        shutil.rmtree(tmp)
+
+
+def bench_formats(zot, args):
+    """ Retrieve every item as a formatted bibliography entry
+    """
+    return len(zot.everything(zot.items(content='bib', limit=100)))
+
+
+def bench_export(zot, args):
+    """ Export every item as gzipped BibTeX, 100 at a time
+    """
+    tmp = tempfile.mkdtemp()
+    try:
+        return zot.export(
+            'bibtex', os.path.join(tmp, 'export.bib.gz'), compress=True)
+    finally:
+        shutil.rmtree(tmp)
+
+
+def bench_render(zot, args):
+    """ Render --render items, first with a cold cache, then a warm one
+    """
+    keys = zot.item_keys(limit=args.render)
+    renderer = render.Renderer(zot)
+    renderer.render(keys)
+    return len([e for e in renderer.render(keys) if e]) * 2
+
+
+BENCHMARKS = [
+    ('everything', bench_everything),
+    ('versions', bench_versions),
+    ('create_items', bench_create_items),
+    ('buffered_edits', bench_buffered_edits),
+    ('upload', bench_upload),
+    ('cold_start', bench_cold_start),
+    ('formats', bench_formats),
+    ('render', bench_render),
+    ('export', bench_export),
+]
+
+
+def run(name, func, args):
+    """
+    Run a single benchmark against a fresh server and library, and return
+    its results as a dict
+    If args.cassettes is set, the benchmark's requests are recorded to a
+    cassette there, or replayed from it without starting a server if it
+    already exists
+    """
+    library = SyntheticLibrary(args.size, abstract_words=args.abstract_words)
+    sender = transport.HTTP2Transport() if args.http2 else None
+    cassette = None
+    server = None
+    if args.cassettes:
+        cassette = sender = transport.RecordReplayTransport(
+            os.path.join(args.cassettes, '%s-%s.json' % (name, args.size)),
+            transport=sender)
+    if cassette is None or cassette.mode == 'record':
+        server = StubServer(
+            library,
+            latency=args.latency,
+            error_rate=args.error_rate,
+            bandwidth=args.bandwidth).start()
+    try:
+        zot, recorder = client(
+            library, server.url if server else 'http://replay', sender,
+            [] if args.uncompressed else None)
+        start = time.time()
+        count = func(zot, args)
+        elapsed = time.time() - start
+    finally:
+        if server is not None:
+            server.stop()
+        if sender is not None:
+            sender.close()
+    requests = len(recorder.latencies)
+    return {
+        'benchmark': name,
+        'items': count,
+        'requests': requests,
+        'seconds': elapsed,
+        'items_per_sec': count / elapsed,
+        'requests_per_sec': requests / elapsed,
+        'p50_ms': percentile(recorder.latencies, 50) * 1000,
+        'p99_ms': percentile(recorder.latencies, 99) * 1000,
+        'wire_mib': recorder.wire / 1048576.0,
+        'decoded_mib': recorder.received / 1048576.0,
+        'peak_rss_mib': peak_rss(),
+    }
+
+
+def run_named(name, args):
+    """ Run a benchmark by name (see run())
+    """
+    return run(name, dict(BENCHMARKS)[name], args)
+
+
+def isolated(name, args):
+    """
+    Run a benchmark by name in a new process, so that its peak memory use
+    isn't that of an earlier benchmark
+    """
+    import multiprocessing
+    pool = multiprocessing.Pool(processes=1)
+    try:
+        return pool.apply(run_named, (name, args))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def report(results):
+    """ Print results as a table
+    """
+    columns = [
+        ('benchmark', '%-15s'), ('items', '%8d'), ('requests', '%9d'),
+        ('seconds', '%8.2f'), ('items_per_sec', '%14.1f'),
+        ('requests_per_sec', '%17.1f'), ('p50_ms', '%8.2f'),
+        ('p99_ms', '%8.2f'), ('wire_mib', '%9.2f'),
+        ('decoded_mib', '%12.2f'), ('peak_rss_mib', '%13.1f')]
+    print(' '.join(
+        (fmt.replace('d', 's').replace('.2f', 's').replace('.1f', 's'))
+        % name for name, fmt in columns))
+    for result in results:
+        print(' '.join(
+            fmt % (result[name] if result[name] is not None else 0)
+            for name, fmt in columns))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument(
+        'benchmarks', nargs='*', default=[n for n, _ in BENCHMARKS],
+        help='benchmarks to run (default: all)')
+    parser.add_argument('--size', type=int, default=2000,
+                        help='number of items in the synthetic library')
+    parser.add_argument('--abstract-words', type=int, default=60,
+                        help='abstract length of synthetic items, in words')
+    parser.add_argument('--create', type=int, default=500,
+                        help='number of items to create')
+    parser.add_argument('--edit', type=int, default=1000,
+                        help='number of items to edit')
+    parser.add_argument('--render', type=int, default=100,
+                        help='number of items to render')
+    parser.add_argument('--uploads', type=int, default=50,
+                        help='number of attachments to upload')
+    parser.add_argument('--upload-size', type=int, default=64 * 1024,
+                        help='size of each uploaded file, in bytes')
+    parser.add_argument('--workers', type=int, default=16,
+                        help='number of workers to start')
+    parser.add_argument('--private-caches', action='store_true',
+                        help="don't share a cache between workers")
+    parser.add_argument('--latency', type=float, default=0,
+                        help='server latency per request, in seconds')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='fraction of requests answered with HTTP 429')
+    parser.add_argument('--bandwidth', type=int,
+                        help='server bandwidth per response, in bytes/second')
+    parser.add_argument('--uncompressed', action='store_true',
+                        help='ask for uncompressed responses')
+    parser.add_argument('--cassettes',
+                        help='directory of cassettes to record requests to, '
+                        'or replay them from without a server')
+    parser.add_argument('--http2', action='store_true',
+                        help='send requests using transport.HTTP2Transport')
+    parser.add_argument('--json', action='store_true',
+                        help='print results as JSON')
+    args = parser.parse_args(argv)
+    known = dict(BENCHMARKS)
+    for name in args.benchmarks:
+        if name not in known:
+            parser.error('unknown benchmark: %s' % name)
+    results = [isolated(name, args) for name in args.benchmarks]
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        report(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,473 @@
+# -*- coding: utf-8 -*-
+"""
+server.py
+
+A local stand-in for the Zotero API, serving a synthetic library, for
+offline benchmarking. Run it on its own with:
+
+python -m bench.server --size 10000 --port 8080
+
+This file is part of Pyzotero.
+
+Pyzotero is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pyzotero is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Pyzotero. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+from __future__ import unicode_literals
+
+import re
+import json
+import zlib
+import time
+import random
+import argparse
+import threading
+
+try:
+    from urlparse import urlparse, parse_qs
+    from urllib import urlencode
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from urllib.parse import urlparse, parse_qs, urlencode
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+
+from xml.sax.saxutils import escape
+
+
+# Zotero object keys use this alphabet
+KEY_CHARS = '23456789ABCDEFGHIJKLMNPQRSTUVWXYZ'
+
+WORDS = (
+    'analysis archive biology catalogue cell climate corpus data detective '
+    'digital economic evidence fiction film geography history holmes '
+    'language library literature method microscopy network novel plasma '
+    'protein review science social study survey theory urban yarn').split()
+
+ITEM_TYPES = ('book', 'journalArticle', 'bookSection', 'webpage', 'thesis')
+
+
+def make_key(number):
+    """ Return a deterministic 8-character object key for a number
+    """
+    chars = []
+    for _ in range(8):
+        number, rem = divmod(number, len(KEY_CHARS))
+        chars.append(KEY_CHARS[rem])
+    return ''.join(reversed(chars))
+
+
+class SyntheticLibrary(object):
+    """
+    A generated library of items, which is deterministic for a given size
+    and seed. abstract_words controls the size of each item
+    """
+    def __init__(self, size=1000, library_id='1', library_type='users',
+                 abstract_words=60, seed=0):
+        self.library_id = library_id
+        self.library_type = library_type
+        self.abstract_words = abstract_words
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.items = []
+        self.index = {}
+        self.version = 0
+        self.counter = 0
+        for _ in range(size):
+            self.add(self.generate())
+
+    def words(self, count):
+        """ Return a string of random words
+        """
+        return ' '.join(self.random.choice(WORDS) for _ in range(count))
+
+    def generate(self):
+        """ Return a new item's data
+        """
+        return {
+            'itemType': self.random.choice(ITEM_TYPES),
+            'title': self.words(6).capitalize(),
+            'creators': [{
+                'creatorType': 'author',
+                'firstName': self.words(1).capitalize(),
+                'lastName': self.words(1).capitalize()}],
+            'abstractNote': self.words(self.abstract_words),
+            'date': '%s' % self.random.randint(1900, 2020),
+            'tags': [{'tag': t} for t in
+                     set(self.words(3).split())],
+            'collections': [],
+            'relations': {},
+        }
+
+    def add(self, data):
+        """ Add an item, returning its key
+        """
+        with self.lock:
+            key = make_key(self.counter)
+            self.counter += 1
+            self.version += 1
+            data = dict(data, key=key, version=self.version)
+            data.pop('filename', None)
+            self.index[key] = {
+                'key': key,
+                'version': self.version,
+                'library': {
+                    'type': self.library_type[:-1],
+                    'id': self.library_id,
+                    'name': 'Synthetic library'},
+                'meta': {
+                    'creatorSummary': data.get('creators') and
+                    data['creators'][0].get('lastName', '') or '',
+                    'numChildren': 0},
+                'data': data,
+            }
+            self.items.insert(0, self.index[key])
+        return key
+
+    def update(self, data):
+        """
+        Apply a partial update to an existing item, returning its new
+        version, or None if the item has changed since data['version']
+        """
+        with self.lock:
+            item = self.index[data['key']]
+            if data.get('version', item['version']) != item['version']:
+                return None
+            self.version += 1
+            item['data'].update(data)
+            item['data']['version'] = item['version'] = self.version
+            return self.version
+
+    def bibtex(self, item):
+        """ Return a BibTeX entry for an item
+        """
+        data = item['data']
+        return '@book{%s,\n\ttitle = {%s},\n\tauthor = {%s},\n' \
+            '\tyear = {%s},\n\tabstract = {%s}\n}\n' % (
+                item['key'], data.get('title', ''),
+                ' and '.join(c['lastName'] for c in data.get('creators', [])),
+                data.get('date', ''), data.get('abstractNote', ''))
+
+    def csl(self, item):
+        """ Return a CSL JSON object for an item
+        """
+        data = item['data']
+        return {
+            'id': item['key'],
+            'type': 'book',
+            'title': data.get('title', ''),
+            'author': [{'family': c['lastName'], 'given': c['firstName']}
+                       for c in data.get('creators', [])],
+            'issued': {'date-parts': [[data.get('date', '')]]},
+            'abstract': data.get('abstractNote', ''),
+        }
+
+    def bib(self, item):
+        """ Return an XHTML bibliography entry for an item
+        """
+        data = item['data']
+        text = '%s. %s. %s.' % (
+            data['creators'][0]['lastName'] if data.get('creators') else '',
+            data.get('title', ''),
+            data.get('date', ''))
+        return '<div class="csl-entry">%s</div>' % escape(text)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Serves the subset of the API used by the benchmarks:
+    paged item listings as JSON, keys, versions, BibTeX, CSL JSON or Atom
+    (and HEAD requests for them, which may be conditional), item creation
+    and updates, item templates and fields, and the file upload flow
+    """
+    protocol_version = 'HTTP/1.1'
+    # send headers and body without waiting for ACKs
+    disable_nagle_algorithm = True
+
+    routes = [
+        ('GET', re.compile(r'^/(users|groups)/[^/]+/items(/top)?$'), 'items'),
+        ('POST', re.compile(r'^/(users|groups)/[^/]+/items$'), 'create'),
+        ('POST', re.compile(
+            r'^/(users|groups)/[^/]+/items/(?P<key>\w+)/file$'), 'file_auth'),
+        ('POST', re.compile(r'^/upload/(?P<key>\w+)$'), 'upload'),
+        ('GET', re.compile(r'^/items/new$'), 'template'),
+        ('GET', re.compile(r'^/itemFields$'), 'fields'),
+    ]
+
+    def log_message(self, *args):
+        """ Stay quiet
+        """
+        pass
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_HEAD(self):
+        self.dispatch('HEAD')
+
+    def dispatch(self, method):
+        """ Inject latency and errors, then route the request
+        """
+        server = self.server
+        server.count_request()
+        length = int(self.headers.get('Content-Length') or 0)
+        self.body = self.rfile.read(length) if length else b''
+        if server.latency:
+            time.sleep(server.latency)
+        if server.error_rate and server.random.random() < server.error_rate:
+            return self.respond(429, b'Too many requests', 'text/plain')
+        parsed = urlparse(self.path)
+        self.params = dict(
+            (k, v[0]) for k, v in parse_qs(parsed.query).items())
+        for verb, pattern, handler in self.routes:
+            match = pattern.match(parsed.path)
+            if match and (
+                    verb == method or (verb, method) == ('GET', 'HEAD')):
+                return getattr(self, handler)(parsed.path, match)
+        self.respond(404, b'Not found', 'text/plain')
+
+    def respond(self, status, body, content_type, headers=None):
+        """
+        Send a complete response, gzip-compressed if the client accepts it
+        and the body is large enough to benefit, and at most the server's
+        bandwidth
+        """
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        if self.command == 'HEAD' or status == 304:
+            body = b''
+        headers = dict(headers or {})
+        accepted = self.headers.get('Accept-Encoding', '')
+        if len(body) > 1024 and 'gzip' in accepted:
+            compressor = zlib.compressobj(
+                6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            body = compressor.compress(body) + compressor.flush()
+            headers['Content-Encoding'] = 'gzip'
+        if self.server.bandwidth:
+            time.sleep(len(body) / float(self.server.bandwidth))
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', '%s' % len(body))
+        self.send_header(
+            'Last-Modified-Version', '%s' % self.server.library.version)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def items(self, path, match):
+        """ A page of items, with Link and Total-Results headers
+        """
+        library = self.server.library
+        since = self.headers.get('If-Modified-Since-Version')
+        if since and int(since) >= library.version:
+            return self.respond(304, b'', 'text/plain')
+        start = int(self.params.get('start', 0))
+        fmt = self.params.get('format', 'json')
+        with library.lock:
+            items = library.items
+            if 'itemKey' in self.params:
+                items = [library.index[k] for k in
+                         self.params['itemKey'].split(',')
+                         if k in library.index]
+            if 'since' in self.params:
+                since = int(self.params['since'])
+                items = [i for i in items if i['version'] > since]
+            total = len(items)
+            if fmt in ('keys', 'versions') and 'limit' not in self.params:
+                # keys and versions aren't paged by default
+                limit = max(total, 1)
+            else:
+                limit = min(int(self.params.get('limit', 25)), 100)
+            page = items[start:start + limit]
+        headers = {'Total-Results': '%s' % total}
+        links = []
+        if start + limit < total:
+            links.append(('next', start + limit))
+            links.append(
+                ('last', max(total - limit, 0) // limit * limit))
+        links.append(('self', start))
+        headers['Link'] = ', '.join(
+            '<%s%s?%s>; rel="%s"' % (
+                self.server.url, path,
+                urlencode(dict(self.params, start=offset, limit=limit)), rel)
+            for rel, offset in links)
+        if fmt == 'keys':
+            body = '\n'.join(i['key'] for i in page) + '\n'
+            return self.respond(200, body, 'text/plain', headers)
+        if fmt == 'versions':
+            body = json.dumps(dict((i['key'], i['version']) for i in page))
+            return self.respond(200, body, 'application/json', headers)
+        if fmt == 'bibtex':
+            body = '\n'.join(library.bibtex(i) for i in page)
+            return self.respond(200, body, 'application/x-bibtex', headers)
+        if fmt == 'csljson':
+            body = json.dumps({'items': [library.csl(i) for i in page]})
+            return self.respond(
+                200, body, 'application/vnd.citationstyles.csl+json',
+                headers)
+        if fmt == 'atom':
+            entries = ''.join(
+                '<entry><id>%s</id><title>%s</title>'
+                '<content type="xhtml">%s</content></entry>' % (
+                    i['key'], i['key'], library.bib(i))
+                for i in page)
+            body = (
+                '<?xml version="1.0"?>'
+                '<feed xmlns="http://www.w3.org/2005/Atom">'
+                '<title>Synthetic</title>%s</feed>' % entries)
+            return self.respond(200, body, 'application/atom+xml', headers)
+        if 'bib' in self.params.get('include', '').split(','):
+            page = [dict(i, bib=library.bib(i)) for i in page]
+        return self.respond(
+            200, json.dumps(page), 'application/json', headers)
+
+    def create(self, path, match):
+        """ Create or update up to 50 items
+        """
+        payload = json.loads(self.body.decode('utf-8'))
+        if len(payload) > 50:
+            return self.respond(413, b'Too many items', 'text/plain')
+        library = self.server.library
+        success, successful, failed = {}, {}, {}
+        for idx, data in enumerate(payload):
+            pos = '%s' % idx
+            if data.get('key') in library.index:
+                version = library.update(data)
+                if version is None:
+                    failed[pos] = {
+                        'key': data['key'], 'code': 412,
+                        'message': 'Item has been modified'}
+                    continue
+                key = data['key']
+            else:
+                key = library.add(data)
+                version = library.version
+            success[pos] = key
+            successful[pos] = {'key': key, 'version': version}
+        return self.respond(200, json.dumps({
+            'success': success, 'successful': successful, 'unchanged': {},
+            'failed': failed}),
+            'application/json')
+
+    def file_auth(self, path, match):
+        """ Authorise an upload, or register a completed one
+        """
+        params = dict(
+            (k, v[0]) for k, v in parse_qs(self.body.decode('utf-8')).items())
+        if 'upload' in params:
+            return self.respond(204, b'', 'text/plain')
+        return self.respond(200, json.dumps({
+            'url': '%s/upload/%s' % (self.server.url, match.group('key')),
+            'contentType': 'application/octet-stream',
+            'prefix': '',
+            'suffix': '',
+            'uploadKey': 'u%s' % match.group('key'),
+        }), 'application/json')
+
+    def upload(self, path, match):
+        """ Accept an uploaded file
+        """
+        self.server.uploaded += len(self.body)
+        return self.respond(201, b'', 'text/plain')
+
+    def template(self, path, match):
+        """ An item template
+        """
+        data = self.server.library.generate()
+        data['itemType'] = self.params.get('itemType', 'book')
+        if data['itemType'] == 'attachment':
+            data = {
+                'itemType': 'attachment',
+                'linkMode': self.params.get('linkMode', 'imported_file'),
+                'title': '', 'contentType': '', 'charset': '',
+                'filename': '', 'tags': [], 'relations': {}}
+        return self.respond(200, json.dumps(data), 'application/json')
+
+    def fields(self, path, match):
+        """ All item fields
+        """
+        fields = [{'field': f, 'localized': f} for f in (
+            'title', 'abstractNote', 'date', 'contentType', 'filename')]
+        return self.respond(200, json.dumps(fields), 'application/json')
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    """
+    A threaded stub API server, serving a SyntheticLibrary
+    latency: seconds to wait before answering each request
+    error_rate: fraction of requests to answer with HTTP 429
+    bandwidth: bytes per second to send each response at
+    """
+    daemon_threads = True
+
+    def __init__(self, library, host='127.0.0.1', port=0, latency=0,
+                 error_rate=0, seed=0, bandwidth=None):
+        HTTPServer.__init__(self, (host, port), StubHandler)
+        self.library = library
+        self.latency = latency
+        self.error_rate = error_rate
+        self.bandwidth = bandwidth
+        self.random = random.Random(seed)
+        self.url = 'http://%s:%s' % self.server_address[:2]
+        self.requests = 0
+        self.uploaded = 0
+        self._counter_lock = threading.Lock()
+        self._thread = None
+
+    def count_request(self):
+        """ Count a request, from any handler thread
+        """
+        with self._counter_lock:
+            self.requests += 1
+
+    def start(self):
+        """ Serve requests from a background thread
+        """
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """ Stop serving, and release the socket
+        """
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--size', type=int, default=1000)
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--bandwidth', type=int)
+    args = parser.parse_args()
+    server = StubServer(
+        SyntheticLibrary(args.size),
+        port=args.port,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        bandwidth=args.bandwidth)
+    print('Serving %s items at %s' % (args.size, server.url))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
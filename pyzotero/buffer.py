@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+buffer.py
+
+This file is part of Pyzotero.
+
+Pyzotero is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pyzotero is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Pyzotero. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+from __future__ import unicode_literals
+
+import copy
+import time
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
+
+from . import zotero_errors as ze
+
+
+# the API accepts at most this many objects per write request
+BATCH_SIZE = 50
+
+# fields which identify an item, rather than describing it
+IDENTITY = frozenset(['key', 'version'])
+
+
+def apply(data, ops):
+    """
+    Apply a list of (operation, argument) mutations to a copy of an item's
+    data dict, and return the copy
+    """
+    data = copy.deepcopy(data)
+    for op, arg in ops:
+        if op == 'set':
+            data.update(copy.deepcopy(arg))
+        elif op == 'add_tags':
+            tags = data.setdefault('tags', [])
+            present = set(t['tag'] for t in tags)
+            for tag in arg:
+                if tag not in present:
+                    tags.append({'tag': tag})
+                    present.add(tag)
+        elif op == 'remove_tags':
+            data['tags'] = [
+                t for t in data.get('tags', []) if t['tag'] not in arg]
+        elif op == 'rename_tags':
+            tags = []
+            present = set()
+            for tag in data.get('tags', []):
+                name = arg.get(tag['tag'], tag['tag'])
+                if name is not None and name not in present:
+                    tags.append(dict(tag, tag=name))
+                    present.add(name)
+            data['tags'] = tags
+        elif op == 'add_collection':
+            collections = data.setdefault('collections', [])
+            if arg not in collections:
+                collections.append(arg)
+        elif op == 'remove_collection':
+            data['collections'] = [
+                c for c in data.get('collections', []) if c != arg]
+    return data
+
+
+def changes(old, new):
+    """ Return the fields of new which differ from old
+    """
+    return dict(
+        (k, v) for k, v in new.items()
+        if k not in IDENTITY and old.get(k) != v)
+
+
+class WriteBuffer(object):
+    """
+    Accumulate item mutations, and write them in batches
+
+    Mutations to the same item are coalesced, and only changed fields are
+    sent. Pending items are written up to BATCH_SIZE at a time: when a
+    mutation for a new item arrives while a full batch is pending, when the
+    oldest pending mutation is more than max_age seconds old (checked
+    whenever a mutation is added), or when flush() is called. Items whose
+    versions have changed on the server are retrieved again, and their
+    mutations reapplied, up to retries times; after that, PreConditionFailed
+    is raised, once the rest of their batch has been written. If errors is
+    'skip', they're recorded in failed instead
+
+    Can be used as a context manager, which flushes on exit
+    """
+    def __init__(self, zot, max_items=BATCH_SIZE, max_age=None, retries=3,
+                 errors='raise'):
+        self.zot = zot
+        self.max_items = min(max_items, BATCH_SIZE)
+        self.max_age = max_age
+        self.retries = retries
+        self.errors = errors
+        # item key -> [item as last known, list of mutations]
+        self.pending = OrderedDict()
+        self.oldest = None
+        # item key -> item as written by this buffer
+        self.written = {}
+        # item key -> API failure details, for failures other than 412
+        # (and for 412s too, if errors is 'skip')
+        self.failed = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+
+    def __len__(self):
+        return len(self.pending)
+
+    def _queue(self, item, op, arg):
+        """ Add a mutation for an item, and write if a threshold is met
+        """
+        key = item['key']
+        if key not in self.pending:
+            if len(self.pending) >= self.max_items:
+                # a full batch is waiting, and won't receive more mutations
+                self._write(list(self.pending)[:self.max_items])
+            base = self.written.get(key)
+            if base is None or base['version'] < item['version']:
+                base = copy.deepcopy(item)
+            self.pending[key] = [base, []]
+            if self.oldest is None:
+                self.oldest = time.time()
+        self.pending[key][1].append((op, arg))
+        if self.max_age is not None and \
+                time.time() - self.oldest >= self.max_age:
+            self.flush()
+
+    def update(self, item, **fields):
+        """ Set one or more fields of an item
+        """
+        self._queue(item, 'set', fields)
+
+    def update_item(self, item):
+        """ Replace an item's fields with those of the passed item dict
+        """
+        self._queue(item, 'set', dict(
+            (k, v) for k, v in item['data'].items() if k not in IDENTITY))
+
+    def add_tags(self, item, *tags):
+        """ Add one or more tags to an item
+        """
+        self._queue(item, 'add_tags', ['%s' % t for t in tags])
+
+    def remove_tags(self, item, *tags):
+        """ Remove one or more tags from an item
+        """
+        self._queue(item, 'remove_tags', set('%s' % t for t in tags))
+
+    def rename_tags(self, item, renames):
+        """
+        Rename an item's tags, using a dict of old name -> new name. Tags
+        renamed to None are removed, and tags renamed to a tag the item
+        already has are merged with it. Tag types are kept
+        """
+        self._queue(item, 'rename_tags', dict(
+            ('%s' % old, None if new is None else '%s' % new)
+            for old, new in renames.items()))
+
+    def addto_collection(self, collection, item):
+        """ Add an item to a collection
+        """
+        self._queue(item, 'add_collection', collection.upper())
+
+    def deletefrom_collection(self, collection, item):
+        """ Remove an item from a collection
+        """
+        self._queue(item, 'remove_collection', collection.upper())
+
+    def mark_current(self, item):
+        """
+        Record an item which doesn't need writing in written, as if this
+        buffer had written it, unless a later version of it has been
+        """
+        known = self.written.get(item['key'])
+        if known is None or known['version'] < item['version']:
+            self.written[item['key']] = copy.deepcopy(item)
+
+    def flush(self):
+        """ Write all pending mutations
+        """
+        while self.pending:
+            self._write(list(self.pending)[:self.max_items])
+        self.oldest = None
+
+    def _write(self, keys):
+        """
+        Write the pending mutations of up to BATCH_SIZE items, retrieving
+        and retrying items whose versions have changed
+        """
+        entries = OrderedDict((k, self.pending.pop(k)) for k in keys)
+        if not self.pending:
+            self.oldest = None
+        for attempt in range(self.retries + 1):
+            payload = []
+            sent = []
+            for key, (base, ops) in list(entries.items()):
+                changed = changes(base['data'], apply(base['data'], ops))
+                if changed:
+                    changed.update(key=key, version=base['version'])
+                    payload.append(changed)
+                    sent.append(key)
+                else:
+                    # nothing to write
+                    del entries[key]
+            if not payload:
+                return
+            resp = self.zot.update_items(payload)
+            conflicts = []
+            for idx, key in enumerate(sent):
+                pos = '%s' % idx
+                base, ops = entries.pop(key)
+                if pos in resp.get('failed', {}):
+                    failure = resp['failed'][pos]
+                    if failure.get('code') == 412:
+                        entries[key] = [base, ops]
+                        conflicts.append(key)
+                    else:
+                        self.failed[key] = failure
+                    continue
+                written = resp.get('successful', {}).get(pos)
+                if written is None or 'version' not in written:
+                    # we don't know its new version
+                    self.written.pop(key, None)
+                    continue
+                self.written[key] = {
+                    'key': key,
+                    'version': written['version'],
+                    'data': dict(
+                        apply(base['data'], ops),
+                        version=written['version'])}
+            if not conflicts:
+                return
+            if attempt == self.retries:
+                break
+            # retrieve the current versions, and reapply our mutations
+            for current in self.zot.items(
+                    itemKey=','.join(conflicts), limit=len(conflicts)):
+                entries[current['key']][0] = current
+        message = "Items were modified while being updated: %s" % ', '.join(
+            entries)
+        if self.errors == 'skip':
+            for key in entries:
+                self.failed[key] = {'code': 412, 'message': message}
+            return
+        error = ze.PreConditionFailed(message)
+        # the keys of the items which couldn't be written
+        error.keys = list(entries)
+        raise error
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+"""
+cache.py
+
+This file is part of Pyzotero.
+
+Pyzotero is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pyzotero is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Pyzotero. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+from __future__ import unicode_literals
+
+import os
+import time
+import threading
+
+
+class Cache(object):
+    """
+    A cache of templates, schema, item counts and API results, shared by
+    the Zotero instances (and Renderers) it's passed to. Keys are strings
+
+    Values read from a cache must not be modified: copy them first. Caches
+    which are shared between processes store values using pickle, so they
+    should only be shared with processes you trust
+    """
+    def get(self, key):
+        """ Return the value for a key, or None if it isn't cached
+        """
+        raise NotImplementedError
+
+    def set(self, key, value):
+        """ Cache a value
+        """
+        raise NotImplementedError
+
+    def delete(self, key):
+        """ Remove a key, if it's cached
+        """
+        raise NotImplementedError
+
+    def clear(self):
+        """ Remove every key
+        """
+        raise NotImplementedError
+
+    def get_many(self, keys):
+        """ Return a dict of cached values, for those keys which are cached
+        """
+        found = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                found[key] = value
+        return found
+
+    def set_many(self, values):
+        """ Cache a dict of values
+        """
+        for key, value in values.items():
+            self.set(key, value)
+
+
+class MemoryCache(Cache):
+    """
+    A cache private to a single process. Values are stored as they are,
+    and expire ttl seconds after they're set, if ttl is given.
+    Each Zotero instance uses its own MemoryCache, unless it's passed a cache
+    """
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # key -> (expiry time or None, value)
+        self.values = {}
+
+    def get(self, key):
+        entry = self.values.get(key)
+        if entry is None:
+            return None
+        if entry[0] is not None and entry[0] < time.time():
+            self.delete(key)
+            return None
+        return entry[1]
+
+    def set(self, key, value):
+        expires = time.time() + self.ttl if self.ttl else None
+        with self.lock:
+            self.values[key] = (expires, value)
+
+    def delete(self, key):
+        with self.lock:
+            self.values.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.values = {}
+
+
+class SQLiteCache(Cache):
+    """
+    A cache stored in an SQLite database file, which can be shared by every
+    process on a host (e.g. a fleet of web or task queue workers), so that
+    values retrieved by one are reused by all of them. The database uses
+    write-ahead logging, so reads don't wait for writes, and is read using
+    memory-mapped I/O. Values expire ttl seconds after they're set, if ttl
+    is given
+    """
+    # read up to this many bytes of the database using mmap
+    mmap_size = 256 * 1024 * 1024
+
+    def __init__(self, path, ttl=None, timeout=30):
+        self.path = path
+        self.ttl = ttl
+        self.timeout = timeout
+        # connections can't be shared by threads, or inherited by forked
+        # processes, so each thread of each process has its own
+        self.local = threading.local()
+        self._connect().execute(
+            'CREATE TABLE IF NOT EXISTS cache '
+            '(key TEXT PRIMARY KEY, value BLOB, expires REAL)')
+
+    def _connect(self):
+        """ Return this thread's connection, opening it if necessary
+        """
+        pid = os.getpid()
+        if getattr(self.local, 'pid', None) != pid:
+            import sqlite3
+            conn = sqlite3.connect(
+                self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA mmap_size=%d' % self.mmap_size)
+            self.local.conn = conn
+            self.local.pid = pid
+        return self.local.conn
+
+    def _expires(self):
+        return time.time() + self.ttl if self.ttl else None
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys):
+        import pickle
+        keys = list(keys)
+        conn = self._connect()
+        now = time.time()
+        found = {}
+        # stay below SQLite's limit on the number of query parameters
+        for pos in range(0, len(keys), 500):
+            chunk = keys[pos:pos + 500]
+            rows = conn.execute(
+                'SELECT key, value, expires FROM cache WHERE key IN (%s)'
+                % ','.join('?' * len(chunk)), chunk)
+            for key, value, expires in rows:
+                if expires is None or expires >= now:
+                    found[key] = pickle.loads(bytes(value))
+        return found
+
+    def set(self, key, value):
+        self.set_many({key: value})
+
+    def set_many(self, values):
+        import pickle
+        import sqlite3
+        expires = self._expires()
+        conn = self._connect()
+        rows = [
+            (key, sqlite3.Binary(pickle.dumps(value, 2)), expires)
+            for key, value in values.items()]
+        conn.execute('BEGIN')
+        try:
+            conn.executemany(
+                'INSERT OR REPLACE INTO cache (key, value, expires) '
+                'VALUES (?, ?, ?)', rows)
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def delete(self, key):
+        self._connect().execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def clear(self):
+        self._connect().execute('DELETE FROM cache')
+
+    def purge(self):
+        """ Remove expired values
+        """
+        self._connect().execute(
+            'DELETE FROM cache WHERE expires < ?', (time.time(),))
+
+
+class RedisCache(Cache):
+    """
+    A cache stored in a Redis (or compatible) key-value store, e.g. one
+    running on the same host as a fleet of workers. Accepts a redis.Redis
+    client, or a URL to connect to. Keys are prefixed with prefix, and
+    values expire ttl seconds after they're set, if ttl is given.
+    Requires the redis package
+    """
+    def __init__(self, client=None, url='redis://localhost:6379/0',
+                 prefix='pyzotero:', ttl=None):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise ImportError('RedisCache requires redis: pip install redis')
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys):
+        import pickle
+        keys = list(keys)
+        if not keys:
+            return {}
+        values = self.client.mget([self.prefix + k for k in keys])
+        return dict(
+            (key, pickle.loads(value))
+            for key, value in zip(keys, values) if value is not None)
+
+    def set(self, key, value):
+        self.set_many({key: value})
+
+    def set_many(self, values):
+        import pickle
+        pipe = self.client.pipeline()
+        for key, value in values.items():
+            pipe.set(self.prefix + key, pickle.dumps(value, 2), ex=self.ttl)
+        pipe.execute()
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def clear(self):
+        for key in self.client.scan_iter(match=self.prefix + '*'):
+            self.client.delete(key)
+
+
+class Namespace(object):
+    """
+    A dict-like view of the keys in a cache which begin with a prefix
+    """
+    def __init__(self, cache, prefix):
+        self.cache = cache
+        self.prefix = prefix
+
+    def get(self, key, default=None):
+        value = self.cache.get(self.prefix + key)
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        value = self.cache.get(self.prefix + key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.cache.set(self.prefix + key, value)
+
+    def __delitem__(self, key):
+        self.cache.delete(self.prefix + key)
+
+    def __contains__(self, key):
+        return self.cache.get(self.prefix + key) is not None
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+collection_tree.py
+
+This file is part of Pyzotero.
+
+Pyzotero is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pyzotero is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Pyzotero. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+from __future__ import unicode_literals
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
+
+from . import zotero_errors as ze
+from .buffer import WriteBuffer, BATCH_SIZE
+from .graph import LibraryGraph
+from .zotero import batches
+
+
+def fetch_collections(zot, workers=4, limit=100, **kwargs):
+    """
+    Retrieve every collection in a library, as a list of collection dicts
+
+    The first page tells us how many collections there are; the remaining
+    pages of up to limit collections are retrieved using up to workers
+    concurrent requests. Any other keyword arguments are passed as search
+    parameters
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    url = zot._url('/{t}/{u}/collections')
+
+    def fetch(start):
+        """ retrieve a page of collections """
+        params = dict(kwargs, format='json', limit=limit, start=start)
+        return zot._request(
+            'GET', url, params=params, headers=zot.default_headers())
+    first = fetch(0)
+    total = int(first.headers.get('Total-Results', 0))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pages = [first] + list(pool.map(fetch, range(limit, total, limit)))
+    return [c for page in pages for c in zot._decode_json(page)]
+
+
+def fetch_tree(zot, workers=4):
+    """
+    Return a LibraryGraph of a library's whole collection tree, retrieved
+    using fetch_collections()
+    """
+    return LibraryGraph(collections=fetch_collections(zot, workers=workers))
+
+
+def levels(graph, collection):
+    """
+    Return the keys of a collection and all the collections below it, as a
+    list of levels: the collection itself, its subcollections, theirs, etc.
+    """
+    key = graph._collection_key(collection)
+    found = []
+    level = [key]
+    while level:
+        found.append(level)
+        level = sorted(
+            sub for k in level for sub in graph._subcollections.get(k, ()))
+    return found
+
+
+def _key(collection):
+    """ Return the key of a collection dict, or of a key """
+    if isinstance(collection, dict):
+        return collection['key']
+    return collection.upper()
+
+
+def _check(graph, keys):
+    """ Raise ResourceNotFound unless a graph contains all the collections
+    """
+    for key in keys:
+        if key not in graph.collections:
+            raise ze.ResourceNotFound("Collection %s doesn't exist" % key)
+
+
+def _failure(failure, message):
+    """ Raise an error for a failure in a multi-object write response
+    """
+    if failure.get('code') == 412:
+        raise ze.PreConditionFailed('%s: %s' % (
+            message, failure.get('message', '')))
+    raise ze.HTTPError('%s: %s' % (message, failure.get('message', '')))
+
+
+def move_collection(zot, collection, parent=None, graph=None):
+    """
+    Move one or more collections, with everything below them, into another
+    collection, or to the top level if parent is None
+
+    A collection's subcollections and items belong to it, so moving a whole
+    subtree only changes the moved collections' parentCollection: up to 50
+    collections are moved per request, however large their subtrees are.
+    Collections can only be moved within a library
+
+    collection is a collection key or dict, or a list of them. Pass a
+    LibraryGraph of the library's collections as graph to avoid retrieving
+    the collection tree; it's updated with the moved collections
+    """
+    if graph is None:
+        graph = fetch_tree(zot)
+    if not isinstance(collection, (list, tuple)):
+        collection = [collection]
+    keys = [_key(c) for c in collection]
+    _check(graph, keys)
+    if parent is not None:
+        parent = _key(parent)
+        _check(graph, [parent])
+        for key in keys:
+            if key == parent or key in graph.ancestors(parent):
+                raise ze.UnsupportedParams(
+                    "Collection %s can't be moved into itself" % key)
+    for pos in range(0, len(keys), BATCH_SIZE):
+        batch = keys[pos:pos + BATCH_SIZE]
+        resp = zot.update_collections([
+            {'key': k, 'version': graph.collections[k]['version'],
+             'parentCollection': parent or False} for k in batch])
+        for idx, key in enumerate(batch):
+            failure = resp.get('failed', {}).get('%s' % idx)
+            if failure is not None:
+                _failure(failure, "Collection %s couldn't be moved" % key)
+            current = graph.collections[key]
+            version = resp.get('successful', {}).get(
+                '%s' % idx, {}).get('version', current['version'])
+            graph.update_collections(dict(
+                current, version=version, data=dict(
+                    current['data'], version=version,
+                    parentCollection=parent or False)))
+    return True
+
+
+def collection_members(zot, keys, workers=4):
+    """
+    Return the items in each of a list of collections, as a dict mapping
+    each collection key to a list of item keys, and the items themselves,
+    as a dict keyed by item key
+
+    Keys are retrieved using one format=keys request per collection, and
+    items in batches of 50 per request, using up to workers concurrent
+    requests
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    def fetch_keys(key):
+        """ retrieve the keys of a collection's items """
+        req = zot._request(
+            'GET', zot._url('/{t}/{u}/collections/{c}/items', c=key),
+            params={'format': 'keys'}, headers=zot.default_headers())
+        return req.text.split()
+
+    def fetch_items(batch):
+        """ retrieve a batch of items """
+        req = zot._request(
+            'GET', zot._url('/{t}/{u}/items'),
+            params={'itemKey': ','.join(batch), 'format': 'json',
+                    'limit': len(batch)},
+            headers=zot.default_headers())
+        return zot._decode_json(req)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        members = dict(zip(keys, pool.map(fetch_keys, keys)))
+        wanted = sorted(set(k for ks in members.values() for k in ks))
+        items = dict(
+            (item['key'], item)
+            for page in pool.map(fetch_items, list(batches(wanted, ',')))
+            for item in page)
+    return members, items
+
+
+def copy_collection(zot, collection, parent=None, name=None, graph=None,
+                    items=True, workers=4, retries=3):
+    """
+    Copy a collection, with everything below it, into another collection,
+    or to the top level if parent is None. name, if passed, renames the
+    copy of the collection itself
+
+    The copied collections are created a level at a time, 50 per request.
+    If items is True, the copies are then added to the items in the
+    original collections, writing each item once, however many of the
+    copies it's added to, in batches of 50 items per request. Collections
+    can only be copied within a library
+
+    Pass a LibraryGraph of the library's collections as graph to avoid
+    retrieving the collection tree; it's updated with the new collections.
+    Returns a dict: 'collections', an OrderedDict mapping each original
+    collection key to its copy's key, 'items', the number of items written,
+    and 'failed', a dict of API failures keyed by collection or item key,
+    including items still being modified by someone else after retries
+    attempts. Collections below one which couldn't be created aren't
+    copied
+    """
+    if graph is None:
+        graph = fetch_tree(zot)
+    root = _key(collection)
+    _check(graph, [root])
+    if parent is not None:
+        parent = _key(parent)
+        _check(graph, [parent])
+    result = {'collections': OrderedDict(), 'items': 0, 'failed': {}}
+    copies = result['collections']
+    for level in levels(graph, root):
+        for pos in range(0, len(level), BATCH_SIZE):
+            batch = []
+            payload = []
+            for key in level[pos:pos + BATCH_SIZE]:
+                data = graph.collections[key]['data']
+                if key == root:
+                    target = parent or False
+                    title = name or data['name']
+                elif data.get('parentCollection') in copies:
+                    target = copies[data['parentCollection']]
+                    title = data['name']
+                else:
+                    continue
+                batch.append(key)
+                payload.append({'name': title, 'parentCollection': target})
+            if not payload:
+                continue
+            resp = zot.create_collections(payload)
+            for idx, key in enumerate(batch):
+                written = resp.get('successful', {}).get('%s' % idx)
+                if written is None:
+                    result['failed'][key] = resp.get('failed', {}).get(
+                        '%s' % idx, {})
+                    continue
+                copies[key] = written['key']
+                if 'data' in written:
+                    graph.update_collections(written)
+    if not items or not copies:
+        return result
+    members, found = collection_members(zot, list(copies), workers=workers)
+    added = {}
+    for key, copy in copies.items():
+        for item in members[key]:
+            added.setdefault(item, []).append(copy)
+    buf = WriteBuffer(zot, retries=retries, errors='skip')
+    for item in sorted(added):
+        if item not in found:
+            # deleted since its collection's keys were retrieved
+            continue
+        for copy in added[item]:
+            buf.addto_collection(copy, found[item])
+    buf.flush()
+    result['items'] = len(buf.written)
+    result['failed'].update(buf.failed)
+    return result
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+conflicts.py
+
+This file is part of Pyzotero.
+
+Pyzotero is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pyzotero is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Pyzotero. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+from __future__ import unicode_literals
+
+import copy
+import time
+import random
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
+
+from . import zotero_errors as ze
+
+
+# fields which identify an object, and are never merged
+IDENTITY = frozenset(['key', 'version'])
+
+
+def tag_id(tag):
+    """ Tags are identified by their name and type
+    """
+    return (tag.get('tag'), tag.get('type', 0))
+
+
+# list fields which are merged as sets, and how to identify their members
+SET_FIELDS = {
+    'tags': tag_id,
+    'collections': lambda collection: collection,
+}
+
+
+def merge_sets(base, ours, theirs, ident):
+    """
+    Three-way merge of two lists, treating them as sets: members added by
+    either side are kept, and members removed by either side are dropped
+    Members keep the order they have in theirs, followed by those we added
+    """
+    ours = ours or []
+    theirs = theirs or []
+    ours_ids = set(ident(m) for m in ours)
+    theirs_ids = set(ident(m) for m in theirs)
+    if base is None:
+        removed = set()
+    else:
+        base_ids = set(ident(m) for m in base)
+        removed = (base_ids - ours_ids) | (base_ids - theirs_ids)
+    merged = []
+    seen = set()
+    for member in theirs + ours:
+        member_id = ident(member)
+        if member_id in removed or member_id in seen:
+            continue
+        seen.add(member_id)
+        merged.append(member)
+    return merged
+
+
+class Resolver(object):
+    """
+    Resolves write conflicts (HTTP 412 responses), by retrieving the
+    object's current version, merging our changes into it, and retrying
+    after an increasing, randomised delay
+
+    Changes are merged field by field, using the version of the object we
+    retrieved (if it was retrieved by the same Zotero instance) as the common
+    ancestor. Fields changed only by us or only by the other writer keep
+    that change. Tags and collections changed by both are merged as sets.
+    Other fields changed by both are resolved by policy: 'ours', 'theirs',
+    'raise', or a callable accepting (field, base, ours, theirs) and
+    returning the merged value. policies maps field names to policies
+    which override the default
+
+    Deleted objects which have been modified by another writer are deleted
+    anyway if delete is 'delete', and the error is raised if it's 'raise'
+    """
+    def __init__(self, policy='ours', policies=None, delete='delete',
+                 retries=5, delay=0.1, max_objects=10000):
+        self.policy = policy
+        self.policies = policies or {}
+        self.delete = delete
+        self.retries = retries
+        self.delay = delay
+        self.max_objects = max_objects
+        # object key -> (version, data), least recently seen first
+        self.seen = OrderedDict()
+
+    def observe(self, retrieved):
+        """
+        Remember the versions of retrieved objects, to use as common
+        ancestors when merging. Accepts an object dict, or a list of them
+        """
+        if isinstance(retrieved, dict):
+            retrieved = [retrieved]
+        if not isinstance(retrieved, list):
+            return
+        for obj in retrieved:
+            if not isinstance(obj, dict) or \
+                    'data' not in obj or 'version' not in obj:
+                continue
+            self.remember(obj['key'], obj['version'], obj['data'])
+
+    def remember(self, key, version, data):
+        """ Remember a version of an object
+        """
+        self.seen.pop(key, None)
+        self.seen[key] = (version, copy.deepcopy(data))
+        while len(self.seen) > self.max_objects:
+            self.seen.popitem(last=False)
+
+    def base(self, key, version):
+        """
+        Return the data of an object at a version, or None if it isn't known
+        """
+        seen = self.seen.get(key)
+        if seen is not None and seen[0] == version:
+            return seen[1]
+        return None
+
+    def resolve(self, field, base, ours, theirs):
+        """ Return the value of a field which both sides have changed
+        """
+        if field in SET_FIELDS:
+            return merge_sets(base, ours, theirs, SET_FIELDS[field])
+        policy = self.policies.get(field, self.policy)
+        if policy == 'ours':
+            return ours
+        if policy == 'theirs':
+            return theirs
+        if policy == 'raise':
+            raise ze.PreConditionFailed(
+                "Field '%s' was modified by another writer" % field)
+        return policy(field, base, ours, theirs)
+
+    def merge(self, base, ours, theirs):
+        """
+        Three-way merge of object data dicts. base may be None, if the
+        common ancestor isn't known, in which case every difference is
+        treated as a change made by both sides
+        """
+        merged = dict(theirs)
+        for field in ours:
+            if field in IDENTITY:
+                continue
+            ours_value = ours[field]
+            theirs_value = theirs.get(field)
+            if ours_value == theirs_value:
+                continue
+            base_value = base.get(field) if base is not None else None
+            if base is not None and ours_value == base_value:
+                # only they changed it
+                continue
+            if base is not None and theirs_value == base_value:
+                # only we changed it
+                merged[field] = ours_value
+                continue
+            merged[field] = self.resolve(
+                field, base_value, ours_value, theirs_value)
+        return merged
+
+    def wait(self, attempt):
+        """ Sleep for a random time, which increases with each attempt
+        """
+        time.sleep(random.uniform(0, self.delay * 2 ** attempt))
+
+    def run(self, write, state, refresh):
+        """
+        Call write(state), and if it fails with a 412 response, call
+        refresh(state) to get the state for the next attempt
+        Returns the result of the successful write
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                return write(state)
+            except ze.PreConditionFailed:
+                if attempt == self.retries:
+                    raise
+            self.wait(attempt)
+            state = refresh(state)
@@ -0,0 +1,455 @@
+# -*- coding: utf-8 -*-
+"""
+duplicates.py
+
+This file is part of Pyzotero.
+
+Pyzotero is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pyzotero is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Pyzotero. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+from __future__ import unicode_literals
+
+import re
+import zlib
+from collections import namedtuple
+
+from . import zotero_errors as ze
+from .buffer import WriteBuffer
+from .search import tokenise
+
+
+# item types which can't be duplicates of other items
+IGNORED_TYPES = frozenset(['note', 'attachment', 'annotation'])
+
+# fields which are never copied from a duplicate to the item it's merged
+# into, because they identify the item, or are merged separately
+MANAGED = frozenset([
+    'key', 'version', 'itemType', 'parentItem', 'dateAdded',
+    'dateModified', 'tags', 'collections', 'relations'])
+
+_doi = re.compile(r'10\.\d{4,9}/\S+')
+_isbn = re.compile(r'\b(?:97[89])?\d{9}[\dX]\b')
+_year = re.compile(r'\b(\d{4})\b')
+
+# the compact description of an item which duplicates are found with
+Features = namedtuple('Features', [
+    'key', 'item_type', 'title', 'year', 'surname', 'doi', 'isbns',
+    'added'])
+
+
+def normalise_doi(value):
+    """ Return the lower-cased DOI in a string (e.g. a DOI URL), or None
+    """
+    found = _doi.search(value or '')
+    return found.group(0).lower().rstrip('.') if found else None
+
+
+def normalise_isbns(value):
+    """
+    Return the ISBNs in a string, e.g. '0-19-852663-6 ; 978...', as a tuple
+    of ISBN-13s, so that ISBN-10 and ISBN-13 forms of an ISBN are equal
+    """
+    isbns = []
+    for isbn in _isbn.findall((value or '').replace('-', '').upper()):
+        if len(isbn) == 10:
+            isbn = '978' + isbn[:9]
+            check = sum(
+                int(d) * (3 if pos % 2 else 1) for pos, d in enumerate(isbn))
+            isbn += '%s' % ((10 - check % 10) % 10)
+        if isbn not in isbns:
+            isbns.append(isbn)
+    return tuple(isbns)
+
+
+def shingles(title, size=3):
+    """ Return the set of character shingles of a normalised title
+    """
+    padded = ' %s ' % title
+    return set(
+        padded[pos:pos + size] for pos in range(len(padded) - size + 1))
+
+
+def features(item):
+    """
+    Return the Features of an item dict (or item data dict), or None for
+    items which can't be duplicates, such as notes and attachments
+    """
+    data = item.get('data', item)
+    if data.get('itemType') in IGNORED_TYPES or data.get('parentItem'):
+        return None
+    year = _year.search(
+        item.get('meta', {}).get('parsedDate') or data.get('date') or '')
+    surname = None
+    for creator in data.get('creators', []):
+        name = creator.get('lastName') or creator.get('name')
+        if name:
+            tokens = tokenise(name)
+            surname = tokens[-1] if tokens else None
+            break
+    return Features(
+        data['key'],
+        data.get('itemType'),
+        ' '.join(tokenise(data.get('title'))),
+        year and year.group(1) or None,
+        surname,
+        normalise_doi(data.get('DOI') or data.get('extra')),
+        normalise_isbns(data.get('ISBN')),
+        data.get('dateAdded') or '')
+
+
+def blocking_keys(feat, sketch=3):
+    """
+    Return the blocking keys of an item's Features: items are only compared
+    with items which share at least one of them. Titles contribute the
+    sketch smallest hashes of their longer words (a MinHash sketch) with
+    the year, so titles which differ by a word or two still share a key
+    """
+    keys = []
+    if feat.doi:
+        keys.append(('doi', feat.doi))
+    for isbn in feat.isbns:
+        keys.append(('isbn', isbn))
+    if feat.title:
+        words = set(w for w in feat.title.split() if len(w) > 3)
+        if not words:
+            keys.append(('title', feat.year, feat.title))
+        hashes = sorted(
+            zlib.crc32(w.encode('utf-8')) & 0xffffffff for w in words)
+        for value in hashes[:sketch]:
+            keys.append(('title', feat.year, value))
+    if feat.surname:
+        keys.append(('creator', feat.surname, feat.year))
+    return keys
+
+
+def is_duplicate(a, b, threshold=0.8, shingled=None):
+    """
+    Are two items, described by their Features, duplicates? Items of
+    different types, or with different DOIs, years or first-author surnames
+    aren't. Items with the same DOI are, as are items with similar titles
+    (less similar, if they share an ISBN). shingled is an optional dict
+    of title shingles, to reuse between comparisons
+    """
+    if a.item_type != b.item_type:
+        return False
+    if a.doi and b.doi:
+        return a.doi == b.doi
+    if a.year and b.year and a.year != b.year:
+        return False
+    if a.surname and b.surname and a.surname != b.surname:
+        return False
+    if not a.title or not b.title:
+        return False
+    if set(a.isbns) & set(b.isbns):
+        threshold = threshold / 2
+    if a.title == b.title:
+        return True
+    if shingled is None:
+        shingled = {}
+    for title in (a.title, b.title):
+        if title not in shingled:
+            shingled[title] = shingles(title)
+    first, second = shingled[a.title], shingled[b.title]
+    return len(first & second) >= threshold * len(first | second)
+
+
+def matches(blocks, features, threshold=0.8):
+    """
+    Compare the items in each of a list of blocks of item keys, using a
+    dict of their Features, and return pairs of duplicate keys
+    """
+    found = []
+    for block in blocks:
+        shingled = {}
+        block = [features[k] for k in block]
+        for pos, a in enumerate(block):
+            for b in block[pos + 1:]:
+                if is_duplicate(a, b, threshold, shingled):
+                    found.append((a.key, b.key))
+    return found
+
+
+# Features and threshold used by worker processes, set by _share(), so that
+# they're sent to each worker once, rather than with every task
+_shared = None
+
+
+def _share(features, threshold):
+    global _shared
+    _shared = (features, threshold)
+
+
+def _shared_matches(blocks):
+    return matches(blocks, *_shared)
+
+
+class UnionFind(object):
+    """ Disjoint sets of keys, merged by union()
+    """
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, key):
+        parent = self.parent.setdefault(key, key)
+        if parent == key:
+            return key
+        # halve the path to the root, so later finds are quicker
+        root = key
+        while self.parent[root] != root:
+            self.parent[root] = self.parent[self.parent[root]]
+            root = self.parent[root]
+        return root
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a != b:
+            self.parent[max(a, b)] = min(a, b)
+        return a != b
+
+    def groups(self):
+        """ Return the sets which contain more than one key
+        """
+        found = {}
+        for key in self.parent:
+            found.setdefault(self.find(key), []).append(key)
+        return [g for g in found.values() if len(g) > 1]
+
+
+class DuplicateFinder(object):
+    """
+    Finds duplicate items in a library, without comparing every item with
+    every other item
+
+    Each item is reduced to a compact set of Features (normalised title,
+    year, first author's surname, DOI and ISBNs), and to blocking keys
+    derived from them. Only items which share a blocking key are compared,
+    so finding duplicates takes roughly linear time, and comparisons can be
+    spread over several processes. Items can be added in pages, as they're
+    retrieved, and the finder kept current using sync()
+
+    Blocks of more than max_block items which share only a title hash or a
+    surname and year are too unspecific to be worth comparing, and are
+    skipped
+    """
+    def __init__(self, items=None, threshold=0.8, max_block=500):
+        self.threshold = threshold
+        self.max_block = max_block
+        # item key -> Features
+        self.features = {}
+        # item key -> blocking keys
+        self.keys = {}
+        self.version = 0
+        if items:
+            self.add(items)
+
+    def __len__(self):
+        return len(self.features)
+
+    def __contains__(self, key):
+        return key in self.features
+
+    @classmethod
+    def from_library(cls, zot, **kwargs):
+        """
+        Build a finder from every top-level item in a library. Accepts a
+        Zotero instance, and optional search/request parameters
+        """
+        finder = cls()
+        finder.sync(zot, **kwargs)
+        return finder
+
+    def add(self, items):
+        """
+        Add items, replacing any existing entries. Accepts an item dict, or
+        any iterable of item dicts, which is consumed one item at a time
+        """
+        if isinstance(items, dict):
+            items = [items]
+        for item in items:
+            feat = features(item)
+            if feat is not None:
+                self.features[feat.key] = feat
+                self.keys[feat.key] = blocking_keys(feat)
+            else:
+                self.remove(item.get('key'))
+            self.version = max(self.version, item.get('version', 0))
+
+    def remove(self, keys):
+        """ Remove one or more items, using their keys
+        """
+        if not isinstance(keys, (list, tuple, set)):
+            keys = [keys]
+        for key in keys:
+            self.features.pop(key, None)
+            self.keys.pop(key, None)
+
+    def sync(self, zot, **kwargs):
+        """
+        Bring the finder up to date with a library, by retrieving top-level
+        items which have changed since the most recent version it has seen,
+        a page at a time, and removing items which have been deleted since
+        then
+        """
+        since = self.version
+        if since:
+            kwargs['since'] = since
+            deleted = zot.deleted(since=since)
+            self.remove(deleted.get('items', []))
+        self.add(zot.top(**kwargs))
+        while zot.links.get('next'):
+            self.add(zot.follow())
+        self.version = max(
+            since,
+            int(zot.request.headers.get('last-modified-version', 0)))
+
+    def blocks(self):
+        """
+        Return lists of the keys of items which share a blocking key, and
+        are to be compared. Blocks with identical members are only returned
+        once
+        """
+        blocks = {}
+        for item, keys in self.keys.items():
+            for key in keys:
+                blocks.setdefault(key, []).append(item)
+        seen = set()
+        found = []
+        for key, block in blocks.items():
+            if len(block) < 2:
+                continue
+            if len(block) > self.max_block and key[0] in ('title', 'creator'):
+                continue
+            members = frozenset(block)
+            if members in seen:
+                continue
+            seen.add(members)
+            found.append(block)
+        return found
+
+    def clusters(self, processes=None, chunk=10000):
+        """
+        Return groups of duplicate item keys, each a list beginning with
+        the item the others should be merged into: the oldest, as in
+        Zotero's own duplicate merging
+
+        If processes is more than 1, blocks are compared using that many
+        worker processes, in chunks of about chunk comparisons. This only
+        pays off when there are many comparisons to make, i.e. when there
+        are large blocks of similar items
+        """
+        blocks = self.blocks()
+        tasks = []
+        task, size = [], 0
+        for block in blocks:
+            task.append(block)
+            size += len(block) * (len(block) - 1) // 2
+            if size >= chunk:
+                tasks.append(task)
+                task, size = [], 0
+        if task:
+            tasks.append(task)
+        sets = UnionFind()
+        if processes and processes > 1 and len(tasks) > 1:
+            import multiprocessing
+            pool = multiprocessing.Pool(
+                processes, _share, (self.features, self.threshold))
+            try:
+                for pairs in pool.imap_unordered(_shared_matches, tasks):
+                    for a, b in pairs:
+                        sets.union(a, b)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for task in tasks:
+                for a, b in matches(task, self.features, self.threshold):
+                    sets.union(a, b)
+        clusters = [
+            sorted(group, key=lambda k: (self.features[k].added, k))
+            for group in sets.groups()]
+        return sorted(clusters)
+
+    def merge(self, zot, clusters, retries=3):
+        """
+        Merge each cluster of duplicates (as returned by clusters()) into
+        its first item, as Zotero does: empty fields are filled in from the
+        duplicates, their tags, collections and child items are added to
+        it, and it records the duplicates it replaces. The duplicates are
+        then deleted
+
+        Writes are batched using a WriteBuffer, and duplicates are only
+        deleted if every write succeeds
+        Returns a dict of 'merged' (the keys of items written) and 'deleted'
+        (the keys of duplicates deleted)
+        """
+        keys = [k for cluster in clusters for k in cluster]
+        items = {}
+        for pos in range(0, len(keys), 50):
+            batch = keys[pos:pos + 50]
+            for item in zot.items(itemKey=','.join(batch), limit=len(batch)):
+                items[item['key']] = item
+        clusters = [
+            [k for k in cluster if k in items] for cluster in clusters]
+        clusters = [c for c in clusters if len(c) > 1]
+        duplicates = [k for cluster in clusters for k in cluster[1:]]
+        children = zot.children_many([items[k] for k in duplicates])
+        uri = 'http://zotero.org/%s/%s/items/%%s' % (
+            zot.library_type, zot.library_id)
+        buf = WriteBuffer(zot, retries=retries)
+        for cluster in clusters:
+            master = items[cluster[0]]
+            others = [items[k] for k in cluster[1:]]
+            buf.update(master, **merged_fields(master, others, uri))
+            tags = [t['tag'] for o in others for t in o['data']['tags']]
+            if tags:
+                buf.add_tags(master, *tags)
+            for other in others:
+                for collection in other['data'].get('collections', []):
+                    buf.addto_collection(collection, master)
+                for child in children[other['key']]:
+                    buf.update(child, parentItem=master['key'])
+        buf.flush()
+        if buf.failed:
+            raise ze.HTTPError(
+                "Items couldn't be merged: %s" % ', '.join(sorted(buf.failed)))
+        zot.delete_items(duplicates)
+        self.remove(duplicates)
+        return {
+            'merged': [c[0] for c in clusters],
+            'deleted': duplicates}
+
+
+def merged_fields(master, others, uri):
+    """
+    Return the fields of master which change when others are merged into
+    it: fields which are empty in master, taken from the first of others in
+    which they aren't, and relations recording the items it replaces
+    """
+    data = master['data']
+    fields = {}
+    for other in others:
+        for field, value in other['data'].items():
+            if field in MANAGED or field in fields or data.get(field):
+                continue
+            if value:
+                fields[field] = value
+    relations = dict(data.get('relations') or {})
+    replaces = relations.get('dc:replaces', [])
+    if not isinstance(replaces, list):
+        replaces = [replaces]
+    relations['dc:replaces'] = replaces + [
+        uri % o['key'] for o in others if uri % o['key'] not in replaces]
+    fields['relations'] = relations
+    return fields
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""
+graph.py
+
+This file is part of Pyzotero.
+
+Pyzotero is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pyzotero is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Pyzotero. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+from __future__ import unicode_literals
+
+from . import zotero_errors as ze
+
+
+def _parent_collection(collection):
+    """ Return a collection's parent key, or None if it's top-level
+    """
+    return collection.get('data', collection).get('parentCollection') or None
+
+
+class LibraryGraph(object):
+    """
+    An in-memory graph of a library's collection tree, parent / child items,
+    collection membership and tags, which answers the equivalent of
+    collections_sub(), children(), collection_items() and item_tags()
+    without further API calls
+    """
+    def __init__(self, collections=None, items=None):
+        self.collections = {}
+        self.items = {}
+        # parent collection key (None for top-level) -> subcollection keys
+        self._subcollections = {None: set()}
+        # parent item key -> child item keys
+        self._children = {}
+        # collection key -> item keys
+        self._members = {}
+        # tag -> item keys
+        self._tagged = {}
+        # collection key -> list of ancestor keys, nearest first
+        self._ancestors = {}
+        self.version = 0
+        if collections:
+            self.update_collections(collections)
+        if items:
+            self.update_items(items)
+
+    @classmethod
+    def from_library(cls, zot):
+        """
+        Build a graph of an entire library, using one paged retrieval of
+        all collections, and one of all items
+        """
+        graph = cls()
+        graph.sync(zot)
+        return graph
+
+    def sync(self, zot):
+        """
+        Bring the graph up to date with a library, by retrieving collections
+        and items which have changed since the most recent version the graph
+        has seen, and removing those which have been deleted since then
+        """
+        kwargs = {}
+        since = self.version
+        if since:
+            kwargs['since'] = since
+            deleted = zot.deleted(since=since)
+            self.remove_items(deleted.get('items', []))
+            self.remove_collections(deleted.get('collections', []))
+        self.update_collections(zot.everything(zot.collections(**kwargs)))
+        self.update_items(zot.everything(zot.items(**kwargs)))
+        self.version = max(
+            since,
+            int(zot.request.headers.get('last-modified-version', 0)))
+
+    # The following methods maintain the graph
+    def update_collections(self, collections):
+        """
+        Add collections to the graph, replacing any existing entries
+        Accepts a list of collection dicts, or a single collection dict
+        """
+        if isinstance(collections, dict):
+            collections = [collections]
+        for collection in collections:
+            key = collection['key']
+            if key in self.collections:
+                self._subcollections.get(
+                    _parent_collection(self.collections[key]),
+                    set()).discard(key)
+            self.collections[key] = collection
+            self._subcollections.setdefault(
+                _parent_collection(collection), set()).add(key)
+            self._subcollections.setdefault(key, set())
+            self._members.setdefault(key, set())
+            self.version = max(self.version, collection.get('version', 0))
+        # moving a collection changes the ancestry of its whole subtree
+        self._ancestors = {}
+
+    def remove_collections(self, keys):
+        """
+        Remove one or more collections from the graph, using their keys
+        Item membership of removed collections is discarded
+        """
+        if not isinstance(keys, (list, tuple, set)):
+            keys = [keys]
+        for key in keys:
+            collection = self.collections.pop(key, None)
+            if collection is None:
+                continue
+            self._subcollections.get(
+                _parent_collection(collection), set()).discard(key)
+            self._subcollections.pop(key, None)
+            self._members.pop(key, None)
+        self._ancestors = {}
+
+    def update_items(self, items):
+        """
+        Add items to the graph, replacing any existing entries
+        Accepts a list of item dicts, or a single item dict
+        """
+        if isinstance(items, dict):
+            items = [items]
+        for item in items:
+            key = item['key']
+            if key in self.items:
+                self._unlink(key)
+            data = item['data']
+            self.items[key] = item
+            if data.get('parentItem'):
+                self._children.setdefault(data['parentItem'], set()).add(key)
+            for coll in data.get('collections', []):
+                self._members.setdefault(coll, set()).add(key)
+            for tag in data.get('tags', []):
+                self._tagged.setdefault(tag['tag'], set()).add(key)
+            self.version = max(self.version, item.get('version', 0))
+
+    def remove_items(self, keys):
+        """ Remove one or more items from the graph, using their keys
+        """
+        if not isinstance(keys, (list, tuple, set)):
+            keys = [keys]
+        for key in keys:
+            if key in self.items:
+                self._unlink(key)
+                del self.items[key]
+
+    def _unlink(self, key):
+        """ Remove an item's edges from the indexes
+        """
+        data = self.items[key]['data']
+        parent = data.get('parentItem')
+        if parent and parent in self._children:
+            self._children[parent].discard(key)
+        for coll in data.get('collections', []):
+            if coll in self._members:
+                self._members[coll].discard(key)
+        for tag in data.get('tags', []):
+            tagged = self._tagged.get(tag['tag'])
+            if tagged is not None:
+                tagged.discard(key)
+                if not tagged:
+                    del self._tagged[tag['tag']]
+
+    # The following methods query the graph
+    def _collection_key(self, collection):
+        """ Normalise and check a collection key
+        """
+        key = collection.upper()
+        if key not in self.collections:
+            raise ze.ResourceNotFound(
+                "Collection %s isn't present in the graph" % collection)
+        return key
+
+    def top_collections(self):
+        """ Return top-level collections
+        """
+        return [self.collections[k] for k in self._subcollections[None]]
+
+    def collections_sub(self, collection):
+        """ Return the subcollections of a specific collection
+        """
+        key = self._collection_key(collection)
+        return [self.collections[k] for k in self._subcollections[key]]
+
+    def ancestors(self, collection):
+        """
+        Return the keys of a collection's ancestors, nearest first
+        Results are cached until the collection tree changes. If the
+        parents form a cycle (which the API shouldn't allow), it's followed
+        only until it reaches a collection which has been seen already
+        """
+        key = self._collection_key(collection)
+        if key not in self._ancestors:
+            found = []
+            seen = set([key])
+            parent = _parent_collection(self.collections[key])
+            while parent in self.collections and parent not in seen:
+                found.append(parent)
+                seen.add(parent)
+                parent = _parent_collection(self.collections[parent])
+            self._ancestors[key] = found
+        return list(self._ancestors[key])
+
+    def descendants(self, collection):
+        """ Return the keys of all collections below a specific collection
+        """
+        found = []
+        pending = [self._collection_key(collection)]
+        seen = set(pending)
+        while pending:
+            subs = [s for s in self._subcollections.get(pending.pop(), ())
+                    if s not in seen]
+            seen.update(subs)
+            found.extend(subs)
+            pending.extend(subs)
+        return found
+
+    def children(self, item):
+        """ Return a specific item's child items
+        """
+        return [self.items[k] for k in self._children.get(item.upper(), ())]
+
+    def collection_items(self, collection, recursive=False):
+        """
+        Return a specific collection's items, optionally including the items
+        of all its subcollections
+        """
+        key = self._collection_key(collection)
+        keys = set(self._members[key])
+        if recursive:
+            for sub in self.descendants(key):
+                keys.update(self._members[sub])
+        return [self.items[k] for k in keys]
+
+    def tag_items(self, tag):
+        """ Return the items which have a specific tag
+        """
+        return [self.items[k] for k in self._tagged.get(tag, ())]
+
+    def item_tags(self, item):
+        """ Return the tags of a specific item
+        """
+        try:
+            return [t['tag'] for t in
+                    self.items[item.upper()]['data'].get('tags', [])]
+        except KeyError:
+            raise ze.ResourceNotFound(
+                "Item %s isn't present in the graph" % item)
+
+    def tags(self):
+        """ Return every tag in use by the items in the graph
+        """
+        return list(self._tagged)
+
+    def num_collectionitems(self, collection):
+        """ Return the number of items in a specific collection
+        """
+        return len(self._members[self._collection_key(collection)])
+
+    def num_tagitems(self, tag):
+        """ Return the number of items which have a specific tag
+        """
+        return len(self._tagged.get(tag, ()))
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+ingest.py
+
+This file is part of Pyzotero.
+
+Pyzotero is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pyzotero is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Pyzotero. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+from __future__ import unicode_literals
+
+import json
+import hashlib
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
+
+from . import zotero_errors as ze
+from .buffer import WriteBuffer, BATCH_SIZE, changes
+from .duplicates import normalise_doi, normalise_isbns
+
+
+# the characters Zotero object keys are made of
+KEY_CHARS = '23456789ABCDEFGHIJKLMNPQRSTUVWXYZ'
+
+
+def external_id(data):
+    """
+    The default external ID of an item data dict: its DOI, or its first
+    ISBN. Raises ParamNotPassed for items with neither
+    """
+    doi = normalise_doi(data.get('DOI') or data.get('extra'))
+    if doi:
+        return 'doi:%s' % doi
+    isbns = normalise_isbns(data.get('ISBN'))
+    if isbns:
+        return 'isbn:%s' % isbns[0]
+    raise ze.ParamNotPassed(
+        "Item has no DOI or ISBN, so an external ID must be given: %s" %
+        data.get('title', ''))
+
+
+def digest(data):
+    """ Return a digest of an item data dict, to detect changes
+    """
+    return hashlib.sha1(
+        json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def item_key(library, ident):
+    """
+    Derive a Zotero item key from an external ID, so that a record is
+    always created with the same key in a library
+    """
+    value = int(hashlib.sha1(
+        ('%s:%s' % (library, ident)).encode('utf-8')).hexdigest(), 16)
+    key = ''
+    for _ in range(8):
+        value, pos = divmod(value, len(KEY_CHARS))
+        key += KEY_CHARS[pos]
+    return key
+
+
+def write_token(entries):
+    """
+    Derive a write token from a batch of (external ID, digest) pairs, so
+    that retrying the same batch uses the same token
+    """
+    return hashlib.sha1(
+        '\n'.join('%s %s' % e for e in entries).encode('utf-8')
+    ).hexdigest()[:32]
+
+
+class Ingester(object):
+    """
+    Idempotent ingestion of records from an external source, keyed by an
+    external ID (by default a DOI or ISBN; pass ident to use your own)
+
+    A local SQLite index maps each external ID to the Zotero key and version
+    of the item it was written to, and a digest and copy of the data
+    written. Records which haven't changed since they were last ingested
+    aren't written at all, changed records only send their changed fields,
+    and new records are created in batches, using keys and write tokens
+    derived from their external IDs. If an ingest is interrupted and run
+    again, items which were created but not yet indexed are found using
+    their keys, rather than created twice
+    """
+    def __init__(self, zot, path=':memory:', ident=None, retries=3):
+        import sqlite3
+        self.zot = zot
+        self.ident = ident or external_id
+        self.retries = retries
+        self.library = '%s/%s' % (zot.library_type, zot.library_id)
+        self.conn = sqlite3.connect(path, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS records '
+            '(id TEXT PRIMARY KEY, key TEXT, version INTEGER, '
+            'digest TEXT, data TEXT)')
+
+    def close(self):
+        self.conn.close()
+
+    def lookup(self, idents):
+        """
+        Return the indexed (key, version, digest, data) of each of a list
+        of external IDs, keyed by ID
+        """
+        found = {}
+        for pos in range(0, len(idents), 500):
+            chunk = idents[pos:pos + 500]
+            rows = self.conn.execute(
+                'SELECT id, key, version, digest, data FROM records '
+                'WHERE id IN (%s)' % ','.join('?' * len(chunk)), chunk)
+            for ident, key, version, dig, data in rows:
+                found[ident] = (key, version, dig, data)
+        return found
+
+    def _store(self, rows):
+        """ Index (id, key, version, digest, data) rows
+        """
+        if not rows:
+            return
+        self.conn.execute('BEGIN')
+        try:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO records '
+                '(id, key, version, digest, data) VALUES (?, ?, ?, ?, ?)',
+                [(i, k, v, d, json.dumps(data)) for i, k, v, d, data in rows])
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+        self.conn.execute('COMMIT')
+
+    def ingest(self, records, chunk=500):
+        """
+        Write an iterable of item data dicts (e.g. filled-in templates) to
+        the library, creating items for new records and updating those
+        which have changed since they were last ingested. Records are read
+        and looked up chunk at a time
+
+        Returns a dict of 'created', 'updated' and 'unchanged' counts, and
+        'failed', a dict of API failures keyed by external ID
+        """
+        result = {'created': 0, 'updated': 0, 'unchanged': 0, 'failed': {}}
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) == chunk:
+                self._ingest(batch, result)
+                batch = []
+        if batch:
+            self._ingest(batch, result)
+        return result
+
+    def _ingest(self, records, result):
+        """ Ingest a chunk of records
+        """
+        incoming = OrderedDict()
+        for record in records:
+            data = dict(
+                (k, v) for k, v in record.items()
+                if k not in ('key', 'version'))
+            incoming[self.ident(record)] = (data, digest(data))
+        indexed = self.lookup(list(incoming))
+        new = []
+        buf = WriteBuffer(self.zot, retries=self.retries, errors='skip')
+        pending = {}
+        rows = []
+        for ident, (data, dig) in incoming.items():
+            if ident not in indexed:
+                new.append(ident)
+                continue
+            key, version, old_digest, old_data = indexed[ident]
+            if dig == old_digest:
+                result['unchanged'] += 1
+                continue
+            base = {'key': key, 'version': version, 'data': dict(
+                json.loads(old_data), key=key, version=version)}
+            changed = changes(base['data'], data)
+            if changed:
+                buf.update(base, **changed)
+                pending[key] = (ident, dig, data)
+            else:
+                # e.g. fields removed from the record, which aren't removed
+                # from the item
+                rows.append((ident, key, version, dig, data))
+                result['unchanged'] += 1
+        self._store(rows)
+        buf.flush()
+        self._written(buf, pending, result, 'updated')
+        for pos in range(0, len(new), BATCH_SIZE):
+            self._create(
+                [(i,) + incoming[i] for i in new[pos:pos + BATCH_SIZE]],
+                result)
+
+    def _written(self, buf, pending, result, counter):
+        """ Index the items a WriteBuffer has written, and count them
+        """
+        rows = []
+        for key, (ident, dig, data) in pending.items():
+            if key in buf.failed:
+                result['failed'][ident] = buf.failed[key]
+                continue
+            written = buf.written.get(key)
+            if written is not None:
+                rows.append((ident, key, written['version'], dig, data))
+                result[counter] += 1
+        self._store(rows)
+
+    def _create(self, batch, result):
+        """
+        Create a batch of (external ID, data, digest) records, with keys
+        and a write token derived from them
+        """
+        keys = dict(
+            (ident, item_key(self.library, ident)) for ident, _, _ in batch)
+        payload = [dict(data, key=keys[ident]) for ident, data, _ in batch]
+        token = write_token((ident, dig) for ident, _, dig in batch)
+        try:
+            resp = self.zot.create_items(
+                payload, write_token=token, preserve_keys=True)
+        except ze.PreConditionFailed:
+            # this batch has already been written, by an ingest which
+            # didn't finish
+            resp = {'successful': {}, 'failed': dict(
+                ('%s' % pos, {'code': 412}) for pos in range(len(batch)))}
+        rows = []
+        retry = []
+        for pos, (ident, data, dig) in enumerate(batch):
+            written = resp.get('successful', {}).get('%s' % pos)
+            if written is not None:
+                rows.append(
+                    (ident, keys[ident], written['version'], dig, data))
+                result['created'] += 1
+                continue
+            failure = resp.get('failed', {}).get('%s' % pos, {})
+            if failure.get('code') in (409, 412):
+                # the item may already exist
+                retry.append((ident, data, dig))
+            else:
+                result['failed'][ident] = failure
+        self._store(rows)
+        if retry:
+            self._reconcile(retry, keys, result)
+
+    def _reconcile(self, batch, keys, result):
+        """
+        Index records whose items already exist with their derived keys,
+        updating those whose data differs
+        """
+        wanted = [keys[ident] for ident, _, _ in batch]
+        existing = dict(
+            (item['key'], item) for item in self.zot.items(
+                itemKey=','.join(wanted), limit=len(wanted)))
+        buf = WriteBuffer(self.zot, retries=self.retries, errors='skip')
+        pending = {}
+        for ident, data, dig in batch:
+            item = existing.get(keys[ident])
+            if item is None:
+                result['failed'][ident] = {
+                    'code': 412, 'message': "Item couldn't be created"}
+                continue
+            changed = changes(item['data'], data)
+            if changed:
+                buf.update(item, **changed)
+            else:
+                buf.mark_current(item)
+            pending[item['key']] = (ident, dig, data)
+        buf.flush()
+        self._written(buf, pending, result, 'created')
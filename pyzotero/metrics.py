@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+"""
+metrics.py
+
+This file is part of Pyzotero.
+
+Pyzotero is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pyzotero is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Pyzotero. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+from __future__ import unicode_literals
+
+import re
+import bisect
+import threading
+
+try:
+    from urllib import unquote
+    from urlparse import urlparse
+except ImportError:
+    from urllib.parse import unquote
+    from urllib.parse import urlparse
+
+
+# latency histogram bucket upper bounds, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_library = re.compile(r'^/(users|groups)/[^/]+')
+_object_key = re.compile(r'/(items|collections|searches)/[A-Z0-9]{8}(?=/|$)')
+_tag = re.compile(r'/tags/[^/]+')
+_api_key = re.compile(r'^/keys/[^/]+')
+
+
+def endpoint(url):
+    """
+    Reduce a request URL to an endpoint label, by replacing the library
+    prefix, object keys, tag names and API keys with placeholders:
+    https://api.zotero.org/users/123/items/ABCD2345/children?limit=5
+    becomes /{t}/{u}/items/{key}/children
+    Requests to other hosts (e.g. file uploads) are labelled by host
+    """
+    parsed = urlparse(url)
+    if parsed.netloc and not parsed.netloc.endswith('api.zotero.org'):
+        return parsed.netloc
+    path = unquote(parsed.path)
+    path = _library.sub('/{t}/{u}', path)
+    path = _object_key.sub(r'/\1/{key}', path)
+    path = _tag.sub('/tags/{tag}', path)
+    return _api_key.sub('/keys/{k}', path)
+
+
+def _series(name, labels):
+    """ Format a metric name and a sorted tuple of label pairs for Prometheus
+    """
+    if not labels:
+        return name
+    return '%s{%s}' % (
+        name, ','.join('%s="%s"' % (k, v) for k, v in labels))
+
+
+class Histogram(object):
+    """ A cumulative histogram with fixed bucket bounds
+    """
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """ Record a single observation
+        """
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """ Return (upper bound, cumulative count) pairs, ending with +Inf
+        """
+        total = 0
+        out = []
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            out.append((bound, total))
+        return out
+
+    def as_dict(self):
+        """ Return the histogram as a dict
+        """
+        return {
+            'buckets': dict(('%s' % b, c) for b, c in self.cumulative()),
+            'sum': self.sum,
+            'count': self.count,
+        }
+
+
+class Metrics(object):
+    """
+    A thread-safe registry of request metrics, which can be shared by any
+    number of Zotero instances:
+    zot = zotero.Zotero(library_id, library_type, api_key, metrics=Metrics())
+
+    Zotero instances report events to the registry, which aggregates them
+    into latency histograms and counters, and passes them on to any
+    listeners added using subscribe()
+    """
+    # name -> (type, help text)
+    families = {
+        'request_duration_seconds': (
+            'histogram', 'API request latency, by method and endpoint'),
+        'parse_duration_seconds': (
+            'histogram', 'Time taken to parse API responses, by endpoint'),
+        'requests_total': (
+            'counter', 'API requests, by method, endpoint and status code'),
+        'request_bytes_total': (
+            'counter', 'Request body bytes sent, by method and endpoint'),
+        'response_bytes_total': (
+            'counter', 'Response body bytes received, by method and endpoint'),
+        'response_wire_bytes_total': (
+            'counter', 'Response body bytes received before decompression, '
+            'by method, endpoint and content encoding'),
+        'cache_total': (
+            'counter', 'Client-side cache lookups, by cache and result'),
+        'retries_total': (
+            'counter', 'Requests retried, by status code'),
+        'backoff_seconds_total': (
+            'counter', 'Time spent sleeping before retries'),
+    }
+
+    def __init__(self, buckets=BUCKETS, prefix='pyzotero_'):
+        self.buckets = buckets
+        self.prefix = prefix
+        self.listeners = []
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """ Discard all recorded values
+        """
+        with self._lock:
+            # name -> {sorted label tuple: Histogram or number}
+            self.values = dict((name, {}) for name in self.families)
+
+    def subscribe(self, listener):
+        """
+        Add a callable which will be called with an event name and a dict
+        of event fields, each time an event is recorded
+        Events are 'request', 'parse', 'cache' and 'retry'
+        """
+        self.listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        """ Remove a previously-added listener
+        """
+        self.listeners.remove(listener)
+
+    def _observe(self, name, labels, value):
+        """ Add an observation to a histogram
+        """
+        labels = tuple(sorted(labels.items()))
+        series = self.values[name]
+        if labels not in series:
+            series[labels] = Histogram(self.buckets)
+        series[labels].observe(value)
+
+    def _increment(self, name, labels, value=1):
+        """ Increment a counter
+        """
+        labels = tuple(sorted(labels.items()))
+        series = self.values[name]
+        series[labels] = series.get(labels, 0) + value
+
+    def _emit(self, event, fields):
+        """ Pass an event to listeners
+        """
+        for listener in self.listeners:
+            listener(event, fields)
+
+    def request(self, method, url, status, seconds, sent=0, received=0,
+                wire=None, encoding='identity'):
+        """ Record a completed HTTP request
+        received is the size of the decoded response body, and wire the
+        size it had on the wire, using the given content encoding
+        """
+        if wire is None:
+            wire = received
+        labels = {'method': method, 'endpoint': endpoint(url)}
+        with self._lock:
+            self._observe('request_duration_seconds', labels, seconds)
+            self._increment('request_bytes_total', labels, sent)
+            self._increment('response_bytes_total', labels, received)
+            self._increment(
+                'response_wire_bytes_total',
+                dict(labels, encoding=encoding), wire)
+            labels['status'] = status
+            self._increment('requests_total', labels)
+        self._emit('request', dict(
+            labels, url=url, seconds=seconds, sent=sent, received=received,
+            wire=wire, encoding=encoding))
+
+    def parse(self, url, seconds):
+        """ Record the time taken to parse a response
+        """
+        labels = {'endpoint': endpoint(url)}
+        with self._lock:
+            self._observe('parse_duration_seconds', labels, seconds)
+        self._emit('parse', dict(labels, url=url, seconds=seconds))
+
+    def cache(self, name, hit):
+        """ Record a client-side cache lookup
+        """
+        labels = {'cache': name, 'result': hit and 'hit' or 'miss'}
+        with self._lock:
+            self._increment('cache_total', labels)
+        self._emit('cache', labels)
+
+    def retry(self, url, status, delay):
+        """ Record a retried request, and the time slept beforehand
+        """
+        with self._lock:
+            self._increment('retries_total', {'status': status})
+            self._increment('backoff_seconds_total', {}, delay)
+        self._emit('retry', {
+            'endpoint': endpoint(url), 'url': url,
+            'status': status, 'delay': delay})
+
+    def to_dict(self):
+        """
+        Return all recorded values as a dict of metric name -> list of
+        {'labels': dict, 'value': number or histogram dict}
+        """
+        out = {}
+        with self._lock:
+            for name, series in self.values.items():
+                out[name] = [{
+                    'labels': dict(labels),
+                    'value': isinstance(value, Histogram) and
+                    value.as_dict() or value}
+                    for labels, value in sorted(series.items())]
+        return out
+
+    def prometheus(self):
+        """ Return all recorded values in the Prometheus text format
+        """
+        lines = []
+        with self._lock:
+            for name in sorted(self.families):
+                kind, helptext = self.families[name]
+                full = self.prefix + name
+                lines.append('# HELP %s %s' % (full, helptext))
+                lines.append('# TYPE %s %s' % (full, kind))
+                for labels, value in sorted(self.values[name].items()):
+                    if kind == 'counter':
+                        lines.append('%s %s' % (
+                            _series(full, labels), value))
+                        continue
+                    for bound, count in value.cumulative():
+                        lines.append('%s %s' % (
+                            _series(
+                                full + '_bucket', labels + (('le', bound),)),
+                            count))
+                    lines.append('%s %s' % (
+                        _series(full + '_sum', labels), value.sum))
+                    lines.append('%s %s' % (
+                        _series(full + '_count', labels), value.count))
+        return '\n'.join(lines) + '\n'
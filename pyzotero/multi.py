@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+multi.py
+
+This file is part of Pyzotero.
+
+Pyzotero is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pyzotero is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Pyzotero. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+from __future__ import unicode_literals
+
+import threading
+
+try:
+    from Queue import Queue, Full
+except ImportError:
+    from queue import Queue, Full
+
+from concurrent.futures import ThreadPoolExecutor
+
+from . import zotero
+from .transport import RequestsTransport
+
+
+# sentinel placed on the results queue when a library has been read
+_DONE = object()
+
+
+class _Failure(object):
+    """ Wraps an error raised while reading a library
+    """
+    def __init__(self, error):
+        self.error = error
+
+
+class MultiLibrary(object):
+    """
+    Run read API calls across many user and group libraries at once,
+    using a shared connection pool
+
+    Accepts an API key, and optionally a list of library dicts
+    ({'type': 'user' or 'group', 'id': ..., 'name': ...}). If no libraries
+    are given, every library the key can read is discovered using
+    key_info() and groups(). Any extra keyword arguments (e.g. metrics, or
+    a transport.HTTP2Transport to share one connection between libraries)
+    are passed to each library's Zotero instance
+    """
+    def __init__(self, api_key, libraries=None, max_workers=8, session=None,
+                 **kwargs):
+        self.api_key = api_key
+        self.max_workers = max_workers
+        if session is None and 'transport' not in kwargs:
+            # one connection pool, large enough for every worker
+            kwargs['transport'] = RequestsTransport(pool_size=max_workers)
+        self.session = session
+        self.zot_kwargs = kwargs
+        self._libraries = libraries
+        self.errors = []
+
+    def client(self, library):
+        """ Return a Zotero instance for a library dict
+        """
+        return zotero.Zotero(
+            library['id'],
+            library['type'],
+            self.api_key,
+            session=self.session,
+            **self.zot_kwargs)
+
+    @property
+    def libraries(self):
+        """ The libraries to read, discovering them if necessary
+        """
+        if self._libraries is None:
+            self._libraries = self.discover()
+        return self._libraries
+
+    def discover(self):
+        """
+        Return a list of library dicts for every library the API key has
+        read access to
+        """
+        # key_info() doesn't use the library ID, but Zotero instances need one
+        info = zotero.Zotero(
+            'unknown', 'user', self.api_key,
+            session=self.session, **self.zot_kwargs).key_info()
+        user_id = info['userID']
+        access = info.get('access', {})
+        libraries = []
+        if access.get('user', {}).get('library'):
+            libraries.append({
+                'type': 'user',
+                'id': user_id,
+                'name': info.get('username', '')})
+        groups = access.get('groups', {})
+        if groups:
+            user = self.client({'type': 'user', 'id': user_id})
+            readable = set('%s' % g for g, perms in groups.items()
+                           if perms.get('library'))
+            for group in user.everything(user.groups()):
+                if 'all' in readable or '%s' % group['id'] in readable:
+                    libraries.append({
+                        'type': 'group',
+                        'id': group['id'],
+                        'name': group['data']['name']})
+        return libraries
+
+    def _read(self, library, method, args, kwargs, everything, results,
+              stop):
+        """
+        Worker: call a read method for a single library, and put each page
+        of results on the results queue, followed by _DONE. Stops early if
+        the stop event is set
+        """
+        def put(result):
+            """ queue a result, unless the consumer has stopped """
+            while not stop.is_set():
+                try:
+                    results.put((library, result), timeout=0.1)
+                    return True
+                except Full:
+                    pass
+            return False
+        try:
+            if stop.is_set():
+                return
+            zot = self.client(library)
+            page = getattr(zot, method)(*args, **kwargs)
+            if not put(page):
+                return
+            while everything and zot.links and zot.links.get('next'):
+                if stop.is_set() or not put(zot.follow()):
+                    return
+        except Exception as err:
+            # the consumer decides whether to raise or record the error
+            put(_Failure(err))
+        finally:
+            put(_DONE)
+
+    def map(self, method, *args, **kwargs):
+        """
+        Call a read method (e.g. 'items', 'tags', 'num_items') with the
+        given arguments for every library concurrently, yielding
+        (library, result) pairs as results arrive. If everything=True is
+        passed, every page of results is retrieved, and each page is
+        yielded as soon as it arrives
+        If errors='skip' is passed, libraries whose calls fail are skipped,
+        and their errors recorded in self.errors; otherwise, the first
+        error is raised
+
+        At most max_workers * 2 results wait to be consumed: workers pause
+        until they're taken. If the consumer stops early (by closing the
+        generator, or because an error is raised), libraries which haven't
+        been started are cancelled, and running workers stop after their
+        current request
+        """
+        everything = kwargs.pop('everything', False)
+        skip = kwargs.pop('errors', 'raise') == 'skip'
+        self.errors = []
+        libraries = self.libraries
+        results = Queue(maxsize=self.max_workers * 2)
+        stop = threading.Event()
+        pool = ThreadPoolExecutor(max_workers=self.max_workers)
+        futures = [
+            pool.submit(
+                self._read, library, method, args, dict(kwargs),
+                everything, results, stop)
+            for library in libraries]
+        try:
+            pending = len(libraries)
+            while pending:
+                library, result = results.get()
+                if result is _DONE:
+                    pending -= 1
+                elif isinstance(result, _Failure):
+                    if not skip:
+                        raise result.error
+                    self.errors.append((library, result.error))
+                else:
+                    yield library, result
+        finally:
+            stop.set()
+            for future in futures:
+                future.cancel()
+            pool.shutdown(wait=True)
+
+    def _records(self, method, **kwargs):
+        """ Flatten paged list results from map() into (library, record)
+        """
+        for library, page in self.map(method, **kwargs):
+            for record in page:
+                yield library, record
+
+    def items(self, **kwargs):
+        """ Yield (library, item) pairs for items in every library
+        """
+        return self._records('items', **kwargs)
+
+    def top(self, **kwargs):
+        """ Yield (library, item) pairs for top-level items in every library
+        """
+        return self._records('top', **kwargs)
+
+    def collections(self, **kwargs):
+        """ Yield (library, collection) pairs for every library
+        """
+        return self._records('collections', **kwargs)
+
+    def tags(self, **kwargs):
+        """ Yield (library, tag) pairs for every library
+        """
+        return self._records('tags', **kwargs)
+
+    def num_items(self):
+        """ Return a dict of (library type, library ID) -> top-level items
+        """
+        return dict(
+            ((library['type'], library['id']), count)
+            for library, count in self.map('num_items'))
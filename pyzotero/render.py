@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+render.py
+
+This file is part of Pyzotero.
+
+Pyzotero is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pyzotero is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Pyzotero. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+from __future__ import unicode_literals
+
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from . import zotero
+
+
+class Renderer(object):
+    """
+    Render formatted bibliography entries or citations for many items at
+    once, caching them
+
+    Rendered entries are cached by (item key, item version, style, locale),
+    so an entry is reused until its item changes. The versions of every
+    item in the library are retrieved once, and then kept up to date using
+    requests for items modified and deleted since (made at most once every
+    max_age seconds). Entries which aren't cached are retrieved using
+    format=json&include=bib (or citation), 50 items per request, with up
+    to max_workers concurrent requests
+
+    Entries are cached in cache, a cache.Cache instance (by default, the
+    Zotero instance's cache), so they can be shared with other processes
+    """
+    def __init__(self, zot, style='chicago-note-bibliography', locale='en-US',
+                 include='bib', max_workers=4, max_age=0, cache=None):
+        self.zot = zot
+        self.style = style
+        self.locale = locale
+        self.include = include
+        self.max_workers = max_workers
+        self.max_age = max_age
+        # item key -> version, for every item in the library
+        self.versions = None
+        self.version = None
+        self.checked = 0
+        self.cache = zot.cache if cache is None else cache
+
+    def refresh(self):
+        """
+        Bring the item versions up to date, if they're more than max_age
+        seconds old, dropping items which have been deleted
+        """
+        now = time.time()
+        if self.versions is not None and now - self.checked < self.max_age:
+            return
+        if self.versions is None:
+            self.versions = self.zot.item_versions()
+        else:
+            deleted = self.zot.deleted(since=self.version)
+            for key in deleted.get('items', []):
+                if key in self.versions:
+                    self.cache.delete(
+                        self._cache_key(key, self.versions.pop(key)))
+            changed = self.zot.item_versions(since=self.version)
+            for key, version in changed.items():
+                # entries for the previous version won't be used again
+                self.cache.delete(
+                    self._cache_key(key, self.versions.get(key)))
+                self.versions[key] = version
+        self.version = int(
+            self.zot.request.headers.get('Last-Modified-Version', 0))
+        self.checked = now
+
+    def _cache_key(self, key, version):
+        """ Rendered entries depend on these values
+        """
+        return 'render:%s/%s:%s:%s:%s:%s:%s' % (
+            self.zot.library_type, self.zot.library_id, key, version,
+            self.style, self.locale, self.include)
+
+    def _fetch(self, keys):
+        """
+        Retrieve rendered entries for up to 50 items, returning a list of
+        (key, version, entry) tuples. Doesn't touch the Zotero instance's
+        request state, so it can be called from several threads at once
+        """
+        zot = self.zot
+        req = zot._request(
+            'GET',
+            zot._url('/{t}/{u}/items'),
+            params={
+                'itemKey': ','.join(keys),
+                'format': 'json',
+                'include': self.include,
+                'style': self.style,
+                'locale': self.locale,
+                'limit': len(keys)},
+            headers=zot.default_headers())
+        return [(i['key'], i['version'], i.get(self.include))
+                for i in req.json()]
+
+    def render(self, keys):
+        """
+        Return a list of rendered entries for a list of item keys, in the
+        same order. Items which don't exist are rendered as None
+        """
+        self.refresh()
+        keys = [k.upper() for k in keys]
+        cache_keys = dict(
+            (key, self._cache_key(key, self.versions[key]))
+            for key in keys if key in self.versions)
+        cached = self.cache.get_many(set(cache_keys.values()))
+        entries = {}
+        missing = []
+        for key in keys:
+            if key in entries or key not in cache_keys:
+                continue
+            entries[key] = cached.get(cache_keys[key])
+            if entries[key] is None:
+                missing.append(key)
+        if missing:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                for fetched in pool.map(
+                        self._fetch,
+                        list(zotero.batches(missing, ','))):
+                    rendered = {}
+                    for key, version, entry in fetched:
+                        self.versions[key] = max(
+                            version, self.versions.get(key, 0))
+                        rendered[self._cache_key(key, version)] = entry
+                        entries[key] = entry
+                    self.cache.set_many(rendered)
+        return [entries.get(key) for key in keys]
+
+    def bibliography(self, keys):
+        """
+        Return rendered bibliography entries for a list of item keys as a
+        single string, skipping items which don't exist
+        """
+        return '\n'.join(e for e in self.render(keys) if e is not None)
@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+"""
+search.py
+
+This file is part of Pyzotero.
+
+Pyzotero is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pyzotero is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Pyzotero. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+from __future__ import unicode_literals
+
+import re
+import math
+import bisect
+import unicodedata
+
+from . import zotero_errors as ze
+
+
+# weights applied to term frequencies, by field
+FIELD_WEIGHTS = {
+    'title': 3.0,
+    'creators': 2.0,
+    'year': 1.5,
+    'tags': 1.5,
+    'abstract': 1.0,
+    'note': 1.0,
+}
+
+# fields searched by each of the API's qmode values
+QMODES = {
+    'titleCreatorYear': frozenset(['title', 'creators', 'year']),
+    'everything': frozenset(FIELD_WEIGHTS),
+}
+
+_word = re.compile(r'\w+', re.UNICODE)
+_markup = re.compile(r'<[^>]+>')
+_year = re.compile(r'\b(\d{4})\b')
+
+
+def tokenise(text):
+    """ Split text into lower-case, accent-stripped word tokens
+    """
+    if not text:
+        return []
+    decomposed = unicodedata.normalize('NFKD', '%s' % text)
+    stripped = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return _word.findall(stripped.lower())
+
+
+def _split_alternatives(value):
+    """ Split an API filter value such as 'book || -note' into its parts
+    """
+    return [v.strip() for v in value.split('||') if v.strip()]
+
+
+def matches_filter(values, condition):
+    """
+    Check a set of values against API filter syntax, e.g. the 'tag' and
+    'itemType' parameters:
+    'foo' matches if 'foo' is present
+    '-foo' matches if 'foo' is absent
+    'foo || bar' matches if either alternative matches
+    A list of conditions must all match (boolean AND)
+    """
+    if condition is None:
+        return True
+    if isinstance(condition, (list, tuple)):
+        return all(matches_filter(values, c) for c in condition)
+    for alternative in _split_alternatives(condition):
+        if alternative.startswith('-'):
+            if alternative[1:] not in values:
+                return True
+        elif alternative in values:
+            return True
+    return False
+
+
+def item_fields(item):
+    """
+    Extract the searchable text of an item dict, keyed by field name
+    """
+    data = item.get('data', item)
+    creators = []
+    for creator in data.get('creators', []):
+        creators.extend([
+            creator.get('name', ''),
+            creator.get('firstName', ''),
+            creator.get('lastName', '')])
+    year = _year.search(
+        item.get('meta', {}).get('parsedDate') or data.get('date') or '')
+    return {
+        'title': data.get('title', ''),
+        'creators': ' '.join(c for c in creators if c),
+        'year': year and year.group(1) or '',
+        'tags': ' '.join(t['tag'] for t in data.get('tags', [])),
+        'abstract': data.get('abstractNote', ''),
+        'note': _markup.sub(' ', data.get('note', '')),
+    }
+
+
+class SearchIndex(object):
+    """
+    A local inverted index over Zotero items, for ranked full-text and
+    field searches which don't require an API call.
+
+    Build it from the output of any read API call which returns items, and
+    keep it current using update() / remove(), or sync()
+    """
+    def __init__(self, items=None):
+        # token -> {item key: {field: term frequency}}
+        self.postings = {}
+        # item key -> set of tokens, so items can be removed cheaply
+        self.forward = {}
+        # item key -> item dict
+        self.items = {}
+        # item key -> (itemType, set of tags), for filtering
+        self.facets = {}
+        self.version = 0
+        self._vocabulary = None
+        if items:
+            self.update(items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, key):
+        return key in self.items
+
+    @classmethod
+    def from_library(cls, zot, **kwargs):
+        """
+        Build an index from every item in a library. Accepts a Zotero
+        instance, and optional search/request parameters
+        """
+        index = cls()
+        index.sync(zot, **kwargs)
+        return index
+
+    def update(self, items):
+        """
+        Add items to the index, replacing any existing entries
+        Accepts a list of item dicts, or a single item dict
+        """
+        if isinstance(items, dict):
+            items = [items]
+        for item in items:
+            key = item['key']
+            if key in self.items:
+                self._unindex(key)
+            fields = item_fields(item)
+            tokens = set()
+            for field, text in fields.items():
+                for tok in tokenise(text):
+                    tokens.add(tok)
+                    freqs = self.postings.setdefault(tok, {}).setdefault(
+                        key, {})
+                    freqs[field] = freqs.get(field, 0) + 1
+            data = item.get('data', item)
+            self.forward[key] = tokens
+            self.items[key] = item
+            self.facets[key] = (
+                data.get('itemType'),
+                set(t['tag'] for t in data.get('tags', [])))
+            self.version = max(self.version, item.get('version', 0))
+        self._vocabulary = None
+
+    def remove(self, keys):
+        """ Remove one or more items from the index, using their keys
+        """
+        if not isinstance(keys, (list, tuple, set)):
+            keys = [keys]
+        for key in keys:
+            if key in self.items:
+                self._unindex(key)
+        self._vocabulary = None
+
+    def _unindex(self, key):
+        """ Remove a single key's postings, and its stored data
+        """
+        for tok in self.forward.pop(key):
+            posting = self.postings[tok]
+            del posting[key]
+            if not posting:
+                del self.postings[tok]
+        del self.items[key]
+        del self.facets[key]
+
+    def sync(self, zot, **kwargs):
+        """
+        Bring the index up to date with a library, by retrieving items
+        which have changed since the most recent version the index has seen,
+        and removing items which have been deleted since then
+        """
+        since = self.version
+        if since:
+            kwargs['since'] = since
+            deleted = zot.deleted(since=since)
+            self.remove(deleted.get('items', []))
+        self.update(zot.everything(zot.items(**kwargs)))
+        self.version = max(
+            since,
+            int(zot.request.headers.get('last-modified-version', 0)))
+
+    def _expand(self, token):
+        """ Return all indexed tokens beginning with token
+        """
+        if self._vocabulary is None:
+            self._vocabulary = sorted(self.postings)
+        vocab = self._vocabulary
+        matched = []
+        pos = bisect.bisect_left(vocab, token)
+        while pos < len(vocab) and vocab[pos].startswith(token):
+            matched.append(vocab[pos])
+            pos += 1
+        return matched
+
+    def _score(self, tokens, fields, prefix):
+        """
+        Return a dict of item key -> score for items matching all tokens,
+        using TF-IDF weighted by field. The final token is treated as a
+        prefix if prefix is True
+        """
+        total = float(len(self.items)) or 1.0
+        scores = None
+        for pos, tok in enumerate(tokens):
+            if prefix and pos == len(tokens) - 1:
+                candidates = self._expand(tok)
+            else:
+                candidates = [tok] if tok in self.postings else []
+            matched = {}
+            for cand in candidates:
+                posting = self.postings[cand]
+                idf = math.log(1.0 + total / len(posting))
+                for key, freqs in posting.items():
+                    weight = sum(
+                        FIELD_WEIGHTS[f] * (1.0 + math.log(n))
+                        for f, n in freqs.items() if f in fields)
+                    if weight:
+                        matched[key] = matched.get(key, 0.0) + weight * idf
+            # every query token must match, so intersect as we go
+            if scores is None:
+                scores = matched
+            else:
+                scores = dict(
+                    (k, s + matched[k]) for k, s in scores.items()
+                    if k in matched)
+            if not scores:
+                return {}
+        return scores or {}
+
+    def search(self, q=None, qmode='titleCreatorYear', itemType=None,
+               tag=None, limit=None, start=0, prefix=True):
+        """
+        Search the index, returning a list of matching item dicts, most
+        relevant first. If no query is given, all items matching the
+        itemType and tag filters are returned, most recently modified first
+
+        Accepts:
+        q: a search string, all of whose words must match
+        qmode: 'titleCreatorYear' (default) or 'everything'
+        itemType, tag: filters, using the same syntax as the API
+        limit, start: paging
+        prefix: treat the final word of q as a prefix (search-as-you-type)
+        """
+        try:
+            fields = QMODES[qmode]
+        except KeyError:
+            raise ze.UnsupportedParams(
+                "qmode must be one of: %s" % ', '.join(sorted(QMODES)))
+        tokens = tokenise(q)
+        if tokens:
+            scores = self._score(tokens, fields, prefix)
+            keys = sorted(scores, key=lambda k: (-scores[k], k))
+        else:
+            keys = sorted(
+                self.items,
+                key=lambda k: self.items[k].get('data', {}).get(
+                    'dateModified', ''),
+                reverse=True)
+        if itemType is not None or tag is not None:
+            keys = [
+                k for k in keys
+                if matches_filter(set([self.facets[k][0]]), itemType)
+                and matches_filter(self.facets[k][1], tag)]
+        if limit is not None:
+            keys = keys[start:start + limit]
+        elif start:
+            keys = keys[start:]
+        return [self.items[k] for k in keys]
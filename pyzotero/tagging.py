@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+tagging.py
+
+This file is part of Pyzotero.
+
+Pyzotero is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pyzotero is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Pyzotero. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+from __future__ import unicode_literals
+
+from .buffer import WriteBuffer, BATCH_SIZE
+from .zotero import batches
+
+
+def fetch_tags(zot, workers=4, limit=100, **kwargs):
+    """
+    Retrieve every tag in a library, with its metadata, as a list of
+    {'tag': name, 'type': type, 'numItems': n} dicts. Unlike tags(), which
+    returns only tag names, this keeps the number of items each tag is
+    applied to, and its type (0 for tags added by users, 1 for tags added
+    automatically). A tag with both types is listed once for each
+
+    The first page tells us how many tags there are; the remaining pages of
+    up to limit tags are retrieved using up to workers concurrent requests.
+    Any other keyword arguments are passed as search parameters
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    url = zot._url('/{t}/{u}/tags')
+
+    def fetch(start):
+        """ retrieve a page of tags """
+        params = dict(kwargs, format='json', limit=limit, start=start)
+        return zot._request(
+            'GET', url, params=params, headers=zot.default_headers())
+    first = fetch(0)
+    total = int(first.headers.get('Total-Results', 0))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pages = [first] + list(pool.map(fetch, range(limit, total, limit)))
+    return [
+        {'tag': t['tag'], 'type': t.get('meta', {}).get('type', 0),
+         'numItems': t.get('meta', {}).get('numItems', 0)}
+        for page in pages for t in page.json()]
+
+
+class TagIndex(object):
+    """
+    An in-memory index of the tags applied to a library's items, for tag
+    analytics and bulk tag changes without retrieving items tag by tag
+
+    Only the tags and version of each item are kept. Build it from the
+    output of any read API call which returns items, and keep it current
+    using update() / remove(), or sync()
+
+    Renames, merges and deletions are planned against the index, and
+    applied by rewriting each affected item once, in batches of up to 50
+    items per request, however many of its tags change
+    """
+    def __init__(self, items=None):
+        # item key -> {'key', 'version', 'data': {'key', 'version', 'tags'}}
+        self.items = {}
+        # tag -> set of item keys
+        self.tagged = {}
+        self.version = 0
+        if items:
+            self.update(items)
+
+    def __len__(self):
+        return len(self.tagged)
+
+    def __contains__(self, tag):
+        return tag in self.tagged
+
+    @classmethod
+    def from_library(cls, zot, **kwargs):
+        """
+        Build an index of every item in a library. Accepts a Zotero
+        instance, and optional search/request parameters
+        """
+        index = cls()
+        index.sync(zot, **kwargs)
+        return index
+
+    def update(self, items):
+        """
+        Add items to the index, replacing any existing entries
+        Accepts a list of item dicts, or a single item dict
+        """
+        if isinstance(items, dict):
+            items = [items]
+        for item in items:
+            key = item['key']
+            if key in self.items:
+                self._unindex(key)
+            data = item.get('data', item)
+            tags = [dict(t) for t in data.get('tags', [])]
+            self.items[key] = {
+                'key': key, 'version': item['version'],
+                'data': {'key': key, 'version': item['version'],
+                         'tags': tags}}
+            for tag in tags:
+                self.tagged.setdefault(tag['tag'], set()).add(key)
+            self.version = max(self.version, item['version'])
+
+    def remove(self, keys):
+        """ Remove one or more items from the index, using their keys
+        """
+        if not isinstance(keys, (list, tuple, set)):
+            keys = [keys]
+        for key in keys:
+            if key in self.items:
+                self._unindex(key)
+                del self.items[key]
+
+    def _unindex(self, key):
+        """ Remove an item's tags from the tag -> item index
+        """
+        for tag in self.items[key]['data']['tags']:
+            tagged = self.tagged.get(tag['tag'])
+            if tagged is not None:
+                tagged.discard(key)
+                if not tagged:
+                    del self.tagged[tag['tag']]
+
+    def sync(self, zot, **kwargs):
+        """
+        Bring the index up to date with a library, by retrieving items
+        which have changed since the most recent version the index has seen,
+        a page at a time, and removing items and tags which have been deleted
+        since then
+        """
+        since = self.version
+        if since:
+            kwargs['since'] = since
+            deleted = zot.deleted(since=since)
+            self.remove(deleted.get('items', []))
+            self._forget(deleted.get('tags', []))
+        self.update(zot.items(**kwargs))
+        while zot.links.get('next'):
+            self.update(zot.follow())
+        self.version = max(
+            since,
+            int(zot.request.headers.get('last-modified-version', 0)))
+
+    def _forget(self, tags):
+        """ Remove tags which have been deleted from the library
+        """
+        for tag in tags:
+            for key in self.tagged.pop(tag, ()):
+                data = self.items[key]['data']
+                data['tags'] = [t for t in data['tags'] if t['tag'] != tag]
+
+    # The following methods answer questions about tags
+    def items_with(self, tag):
+        """ Return the keys of the items a tag is applied to
+        """
+        return sorted(self.tagged.get(tag, ()))
+
+    def counts(self, tag_type=None):
+        """
+        Return a dict of the number of items each tag is applied to,
+        optionally only counting tags of one type
+        """
+        if tag_type is None:
+            return dict((t, len(k)) for t, k in self.tagged.items())
+        counts = {}
+        for item in self.items.values():
+            for tag in item['data']['tags']:
+                if tag.get('type', 0) == tag_type:
+                    counts[tag['tag']] = counts.get(tag['tag'], 0) + 1
+        return counts
+
+    def similar(self):
+        """
+        Return groups of tags which differ only in case, surrounding
+        whitespace, or punctuation, most used first: candidates for merge()
+        """
+        from .search import tokenise
+        groups = {}
+        for tag in self.tagged:
+            normalised = ' '.join(tokenise(tag))
+            if normalised:
+                groups.setdefault(normalised, []).append(tag)
+        return sorted(
+            sorted(g, key=lambda t: (-len(self.tagged[t]), t))
+            for g in groups.values() if len(g) > 1)
+
+    # The following methods change tags on the server
+    def rename(self, zot, old, new, progress=None):
+        """ Rename a tag, merging it with new if that already exists
+        """
+        return self.apply(zot, renames={old: new}, progress=progress)
+
+    def merge(self, zot, tags, into, progress=None):
+        """ Replace several tags with one, e.g. spelling variants of a tag
+        """
+        return self.apply(
+            zot, renames=dict((t, into) for t in tags if t != into),
+            progress=progress)
+
+    def delete(self, zot, tags, progress=None):
+        """ Remove tags from every item they're applied to
+        """
+        return self.apply(zot, deletes=tags, progress=progress)
+
+    def apply(self, zot, renames=None, deletes=(), retries=3,
+              progress=None):
+        """
+        Apply many renames (a dict of old name -> new name) and deletions
+        at once, e.g. to clean up a tag vocabulary
+
+        Items with renamed tags are rewritten once each, in batches of 50;
+        items which can't be written (including items still being modified
+        by someone else after retries attempts) are recorded, and skipped.
+        Deleted tags are then deleted from the whole library at once, 50
+        tags per request. progress, if passed, is called with the current
+        state after every batch
+        Returns the final state: a dict of the number of 'items' to be
+        written and 'written', the number of 'tags' to be deleted and
+        'deleted', and 'failed', a dict of API failures keyed by item key
+        """
+        renames = dict(
+            (old, new) for old, new in (renames or {}).items()
+            if old != new and old in self.tagged)
+        deletes = [
+            t for t in deletes if t in self.tagged and t not in renames]
+        affected = sorted(set(
+            k for tag in renames for k in self.tagged[tag]))
+        state = {'items': len(affected), 'written': 0,
+                 'tags': len(deletes), 'deleted': 0, 'failed': {}}
+        buf = WriteBuffer(zot, retries=retries, errors='skip')
+        for pos in range(0, len(affected), BATCH_SIZE):
+            batch = affected[pos:pos + BATCH_SIZE]
+            for key in batch:
+                buf.rename_tags(self.items[key], renames)
+            buf.flush()
+            for key in batch:
+                if key in buf.failed:
+                    state['failed'][key] = buf.failed.pop(key)
+                elif key in buf.written:
+                    self.update(buf.written.pop(key))
+                    state['written'] += 1
+            if progress is not None:
+                progress(state)
+        version = None
+        for batch in batches(deletes, ' || '):
+            for result in zot.delete_tags(batch, version=version):
+                version = result['version']
+                self._forget(result['keys'])
+                state['deleted'] += len(result['keys'])
+            if progress is not None:
+                progress(state)
+        return state
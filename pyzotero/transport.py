@@ -0,0 +1,480 @@
+# -*- coding: utf-8 -*-
+"""
+transport.py
+
+This file is part of Pyzotero.
+
+Pyzotero is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pyzotero is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Pyzotero. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+from __future__ import unicode_literals
+
+import os
+import re
+import json
+import base64
+import threading
+from collections import deque
+
+try:
+    from urllib import urlencode
+    from urlparse import urlparse, urlunparse, parse_qsl
+except ImportError:
+    from urllib.parse import urlencode, urlparse, urlunparse, parse_qsl
+
+from . import zotero_errors as ze
+
+
+# content codings which responses can be compressed with, in order of
+# preference, and the modules which transports use to decode them
+CODINGS = (
+    ('zstd', ('zstandard',)),
+    ('br', ('brotli', 'brotlicffi')),
+    ('gzip', ()),
+    ('deflate', ()),
+)
+
+_available = None
+
+
+def available_encodings():
+    """
+    Return the content codings which responses received using requests
+    can be decoded from, in order of preference. gzip and deflate are
+    always available, and br and zstd are available if brotli (or
+    brotlicffi) and zstandard are installed, and the installed urllib3
+    decodes them (urllib3 2.0 or later is needed for zstd)
+    """
+    global _available
+    if _available is None:
+        _available = [
+            coding for coding, modules in CODINGS
+            if not modules or (
+                any(importable(m) for m in modules) and
+                urllib3_decodes(coding))]
+    return list(_available)
+
+
+def urllib3_decodes(coding):
+    """
+    Does urllib3, which requests uses, decode responses with a content
+    coding? It advertises the codings it can decode
+    """
+    try:
+        from urllib3.util.request import ACCEPT_ENCODING
+    except ImportError:
+        from requests.packages.urllib3.util.request import ACCEPT_ENCODING
+    return coding in [c.strip() for c in ACCEPT_ENCODING.split(',')]
+
+
+def httpx_encodings():
+    """
+    Return the content codings which responses received using httpx can
+    be decoded from, in order of preference. httpx only registers decoders
+    for br and zstd if their modules are installed (and zstd needs httpx
+    0.27 or later)
+    """
+    try:
+        from httpx._decoders import SUPPORTED_DECODERS
+    except ImportError:
+        SUPPORTED_DECODERS = ('gzip', 'deflate')
+    return [coding for coding, _ in CODINGS if coding in SUPPORTED_DECODERS]
+
+
+def importable(module):
+    """ Can a module be imported?
+    """
+    try:
+        __import__(module)
+    except ImportError:
+        return False
+    return True
+
+
+def accept_encoding(codings=None, available=None):
+    """
+    Return an Accept-Encoding header value asking for a list of content
+    codings, most preferred first. available is the list of codings which
+    can be decoded (by default, by requests: see available_encodings()).
+    codings defaults to every available coding, and an empty list asks
+    for uncompressed responses
+    Raises UnsupportedParams for codings which can't be decoded
+    """
+    if available is None:
+        available = available_encodings()
+    if codings is None:
+        codings = available
+    unsupported = [c for c in codings if c not in available]
+    if unsupported:
+        raise ze.UnsupportedParams(
+            "Can't decode %s responses. Available encodings: %s" % (
+                ', '.join(unsupported), ', '.join(available)))
+    if not codings:
+        return 'identity'
+    return ', '.join(
+        coding if pos == 0 else '%s;q=%.1f' % (coding, 1 - pos / 10.0)
+        for pos, coding in enumerate(codings))
+
+
+def wire_bytes(resp):
+    """
+    Return the number of response body bytes received over the network,
+    i.e. before decompression
+    """
+    wire = getattr(resp, 'wire_bytes', None)
+    if wire is None:
+        try:
+            # urllib3 counts the bytes it reads, before decoding them
+            wire = resp.raw.tell()
+        except (AttributeError, IOError):
+            wire = len(resp.content)
+    return wire
+
+
+class Transport(object):
+    """
+    Sends HTTP requests for a Zotero instance
+
+    send() accepts a method, a URL, and optionally params (a dict of query
+    parameters), data (a request body: bytes, text, or a dict of form
+    fields), headers and a timeout, and returns a response with the same
+    attributes as a requests.Response: status_code, headers (case
+    insensitive), url, content, text, json(), links, iter_content(), and
+    request (with method, url and body attributes)
+
+    Compressed responses are decoded by the transport, which should
+    decode them as they're read, and set the response's wire_bytes
+    attribute to the number of compressed bytes received, if it can't be
+    found using response.raw.tell()
+    """
+    def send(self, method, url, params=None, data=None, headers=None,
+             timeout=None):
+        raise NotImplementedError
+
+    def encodings(self):
+        """
+        Return the content codings which the transport can decode
+        responses from, in order of preference. By default, those which
+        requests can decode: transports which don't use requests should
+        override this
+        """
+        return available_encodings()
+
+    def close(self):
+        """ Release any resources held by the transport
+        """
+        pass
+
+
+class RequestsTransport(Transport):
+    """
+    The default transport, which uses a requests.Session. The session is
+    created when the first request is sent, unless one is passed.
+    If pool_size is passed, the session's connection pool can hold that
+    many connections to each host
+    """
+    def __init__(self, session=None, pool_size=None):
+        self.session = session
+        self.pool_size = pool_size
+        self.lock = threading.Lock()
+
+    def _session(self):
+        """ Return the session, creating it if necessary
+        """
+        if self.session is None:
+            with self.lock:
+                if self.session is None:
+                    import requests
+                    session = requests.Session()
+                    if self.pool_size:
+                        adapter = requests.adapters.HTTPAdapter(
+                            pool_connections=self.pool_size,
+                            pool_maxsize=self.pool_size)
+                        session.mount('https://', adapter)
+                        session.mount('http://', adapter)
+                    self.session = session
+        return self.session
+
+    def send(self, method, url, params=None, data=None, headers=None,
+             timeout=None):
+        return self._session().request(
+            method, url, params=params, data=data, headers=headers,
+            timeout=timeout)
+
+    def close(self):
+        if self.session is not None:
+            self.session.close()
+
+
+class HTTP2Transport(Transport):
+    """
+    Sends requests using an httpx.Client with HTTP/2 enabled, so that
+    concurrent requests to the API share a single connection, with
+    compressed headers, instead of opening a connection each.
+    max_connections limits the number of connections to each host.
+    Requires httpx, with its http2 extra (pip install pyzotero[http2])
+    """
+    def __init__(self, client=None, max_connections=None):
+        if client is None:
+            try:
+                import httpx
+            except ImportError:
+                raise ImportError(
+                    'HTTP2Transport requires httpx: '
+                    'pip install "httpx[http2]"')
+            client = httpx.Client(
+                http2=True,
+                limits=httpx.Limits(max_connections=max_connections))
+        self.client = client
+
+    def send(self, method, url, params=None, data=None, headers=None,
+             timeout=None):
+        if data is None or isinstance(data, dict):
+            body = {'data': data}
+        else:
+            body = {'content': data}
+        resp = self.client.request(
+            method, url, params=params, headers=headers, timeout=timeout,
+            **body)
+        return Response(
+            resp.status_code, resp.headers, resp.content, '%s' % resp.url,
+            Request(
+                method, '%s' % resp.request.url, headers,
+                resp.request.content),
+            wire_bytes=resp.num_bytes_downloaded)
+
+    def encodings(self):
+        return httpx_encodings()
+
+    def close(self):
+        self.client.close()
+
+
+class Headers(dict):
+    """ A dict of HTTP headers, with case-insensitive names
+    """
+    def __init__(self, headers=None):
+        dict.__init__(self)
+        for name, value in (headers or {}).items():
+            self[name] = value
+
+    def __setitem__(self, name, value):
+        dict.__setitem__(self, name.lower(), value)
+
+    def __getitem__(self, name):
+        return dict.__getitem__(self, name.lower())
+
+    def __contains__(self, name):
+        return dict.__contains__(self, name.lower())
+
+    def get(self, name, default=None):
+        return dict.get(self, name.lower(), default)
+
+
+class Request(object):
+    """ The request a Response answers
+    """
+    def __init__(self, method, url, headers=None, body=None):
+        self.method = method
+        self.url = url
+        self.headers = Headers(headers)
+        self.body = body
+
+
+# a single link in a Link header: <url>; rel="next"
+LINK = re.compile(r'<([^>]*)>\s*;\s*rel="?([^",;]+)"?')
+
+
+class Response(object):
+    """
+    A complete HTTP response, with the parts of the requests.Response
+    interface which Pyzotero uses
+    """
+    def __init__(self, status_code, headers, content, url, request=None,
+                 wire_bytes=None):
+        self.status_code = status_code
+        self.headers = Headers(headers)
+        self.content = content
+        self.url = url
+        self.request = request
+        if wire_bytes is None:
+            wire_bytes = len(content)
+        self.wire_bytes = wire_bytes
+
+    @property
+    def encoding(self):
+        """ The charset of the response, from its Content-Type
+        """
+        match = re.search(
+            r'charset=([\w-]+)', self.headers.get('Content-Type', ''))
+        return match.group(1) if match else 'utf-8'
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding, 'replace')
+
+    def json(self):
+        return json.loads(self.text)
+
+    @property
+    def links(self):
+        """ Parsed Link header, keyed by rel
+        """
+        return dict(
+            (rel, {'url': url, 'rel': rel}) for url, rel in
+            LINK.findall(self.headers.get('Link', '')))
+
+    def iter_content(self, chunk_size=65536):
+        for pos in range(0, len(self.content), chunk_size):
+            yield self.content[pos:pos + chunk_size]
+
+
+def full_url(url, params=None):
+    """
+    Return a URL with params added to its query, with query parameters in
+    a consistent order, for matching requests
+    """
+    parsed = urlparse(url)
+    query = parse_qsl(parsed.query, keep_blank_values=True)
+    query.extend((params or {}).items())
+    return urlunparse(parsed._replace(query=urlencode(sorted(
+        ('%s' % k, '%s' % v) for k, v in query))))
+
+
+def request_key(request, match_body=False):
+    """
+    Recorded requests are matched on method, path and query, and optionally
+    body, but not on scheme or host, so that a cassette recorded against one
+    server can be replayed for another
+    """
+    parsed = urlparse(request['url'])
+    return (
+        request['method'], parsed.path, parsed.query,
+        request['body'] if match_body else None)
+
+
+def encode_body(data):
+    """ Return a request body as text, for storing and matching
+    """
+    if data is None:
+        return None
+    if isinstance(data, dict):
+        return urlencode(sorted(data.items()))
+    if isinstance(data, bytes):
+        try:
+            return data.decode('utf-8')
+        except UnicodeDecodeError:
+            return base64.b64encode(data).decode('ascii')
+    return data
+
+
+class RecordReplayTransport(Transport):
+    """
+    Records requests and responses to a cassette file, or replays them
+    from it without using the network
+
+    mode is 'record' (send requests using transport, the default
+    RequestsTransport if it isn't passed, and save them when close() or
+    save() is called), 'replay' (answer requests from the cassette,
+    raising zotero_errors.UnrecordedRequest for requests which weren't
+    recorded), or 'once' (replay if the cassette exists, otherwise record)
+
+    Requests are matched on method, path and query parameters, and also on
+    their bodies if match_body is True. Requests which match are answered
+    in the order they were recorded
+    """
+    def __init__(self, path, mode='once', transport=None, match_body=False):
+        if mode == 'once':
+            mode = 'replay' if os.path.exists(path) else 'record'
+        self.path = path
+        self.mode = mode
+        self.transport = transport
+        self.match_body = match_body
+        self.lock = threading.Lock()
+        self.interactions = []
+        # request key -> recorded responses, in order
+        self.recorded = {}
+        if mode == 'replay':
+            with open(path, 'r') as f:
+                for interaction in json.load(f)['interactions']:
+                    self.recorded.setdefault(
+                        request_key(interaction['request'], match_body),
+                        deque()).append(interaction['response'])
+
+    def send(self, method, url, params=None, data=None, headers=None,
+             timeout=None):
+        request = {
+            'method': method.upper(),
+            'url': full_url(url, params),
+            'body': encode_body(data)}
+        if self.mode == 'replay':
+            with self.lock:
+                responses = self.recorded.get(
+                    request_key(request, self.match_body))
+                if not responses:
+                    raise ze.UnrecordedRequest(
+                        'No recorded response for %s %s' % (
+                            request['method'], request['url']))
+                recorded = responses.popleft()
+            body = recorded['body']
+            if recorded.get('encoding') == 'base64':
+                content = base64.b64decode(body)
+            else:
+                content = body.encode('utf-8')
+            return Response(
+                recorded['status'], recorded['headers'], content,
+                request['url'],
+                Request(method, request['url'], headers, data),
+                wire_bytes=recorded.get('wire'))
+        if self.transport is None:
+            self.transport = RequestsTransport()
+        resp = self.transport.send(
+            method, url, params=params, data=data, headers=headers,
+            timeout=timeout)
+        recorded = {
+            'status': resp.status_code,
+            # the recorded body has already been decoded, so its length
+            # differs, but the size it had on the wire is kept
+            'headers': dict(
+                (k, v) for k, v in resp.headers.items()
+                if k.lower() != 'content-length'),
+            'wire': wire_bytes(resp)}
+        try:
+            recorded['body'] = resp.content.decode('utf-8')
+        except UnicodeDecodeError:
+            recorded['body'] = base64.b64encode(resp.content).decode('ascii')
+            recorded['encoding'] = 'base64'
+        with self.lock:
+            self.interactions.append(
+                {'request': request, 'response': recorded})
+        return resp
+
+    def encodings(self):
+        if self.transport is None:
+            return available_encodings()
+        return self.transport.encodings()
+
+    def save(self):
+        """ Write recorded interactions to the cassette
+        """
+        with self.lock:
+            with open(self.path, 'w') as f:
+                json.dump({'interactions': self.interactions}, f, indent=1)
+
+    def close(self):
+        if self.mode == 'record':
+            self.save()
+        if self.transport is not None:
+            self.transport.close()
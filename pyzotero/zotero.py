@@ -32,26 +32,20 @@ __api_version__ = '3'
 # Python 3 compatibility faffing
 try:
     from urllib import urlencode
-    from urllib import quote
+    from urllib import quote, quote_plus
     from urlparse import urlparse
 except ImportError:
     from urllib.parse import urlencode
     from urllib.parse import urlparse
-    from urllib.parse import quote
+    from urllib.parse import quote, quote_plus
 
-import requests
-import socket
-import feedparser
 import json
 import copy
-import uuid
 import time
 import os
-import hashlib
 import datetime
+import string
 import re
-import pytz
-import mimetypes
 
 try:
     from collections import OrderedDict
@@ -59,11 +53,17 @@ except ImportError:
     from ordereddict import OrderedDict
 
 from . import zotero_errors as ze
+from .transport import RequestsTransport, accept_encoding, wire_bytes
+from .cache import MemoryCache, Namespace
 
 
 # Avoid hanging the application if there's no server response
 timeout = 30
-socket.setdefaulttimeout(timeout)
+
+# requests is imported by the first request, and feedparser, pytz,
+# mimetypes, hashlib and uuid by the few methods which need them, so
+# that importing this module stays fast
+_feedparser = None
 
 
 def ib64_patched(self, attrsD, contentparams):
@@ -85,27 +85,164 @@ def ib64_patched(self, attrsD, contentparams):
 def token():
     """ Return a unique 32-char write-token
     """
+    import uuid
     return str(uuid.uuid4().hex)
 
 
-
-# Override feedparser's buggy isBase64 method until they fix it
-feedparser._FeedParserMixin._isBase64 = ib64_patched
+def load_feedparser():
+    """
+    Import feedparser the first time Atom content needs to be parsed, and
+    override its buggy isBase64 method until they fix it
+    """
+    global _feedparser
+    if _feedparser is None:
+        import feedparser
+        try:
+            # feedparser 5.x
+            feedparser._FeedParserMixin._isBase64 = ib64_patched
+        except AttributeError:
+            # feedparser 6.x
+            from feedparser.mixin import _FeedParserMixin
+            _FeedParserMixin._is_base64 = ib64_patched
+        _feedparser = feedparser
+    return _feedparser
 
 
 def cleanwrap(func):
     """ Wrapper for Zotero._cleanup
     """
-    def enc(self, *args):
+    def enc(self, *args, **kwargs):
         """ Send each item to _cleanup() """
-        return (func(self, item) for item in args)
+        return (func(self, item, **kwargs) for item in args)
     return enc
 
 
+# read methods whose results are never memoized: they aren't scoped to the
+# library, or they return file contents
+NOT_MEMOIZED = frozenset(['key_info', 'groups', 'file'])
+
+
+# response content types, and the formats they're processed as
+FORMATS = {
+    'application/atom+xml': 'atom',
+    'application/json': 'json',
+    'text/plain': 'plain',
+}
+
+# the start of each record in text export formats, to count exported items
+RECORD_STARTS = {
+    'bibtex': re.compile(br'^@\w+\{', re.M),
+    'biblatex': re.compile(br'^@\w+\{', re.M),
+    'ris': re.compile(br'^TY  - ', re.M),
+    'refer': re.compile(br'^%0 ', re.M),
+}
+
+
+def compile_route(template, library_type, library_id):
+    """
+    Precompile an endpoint path template, such as '/{t}/{u}/items/{i}'
+    {t} and {u} are filled in with the library type and ID, and literal
+    text is quoted, once. Returns a (format string, field names) tuple,
+    which route() fills in with the values of any other fields
+    """
+    parts = []
+    fields = []
+    for literal, field, _, _ in string.Formatter().parse(template):
+        parts.append(quote(literal).replace('%', '%%'))
+        if field in ('t', 'u'):
+            parts.append(quote(
+                '%s' % (library_type if field == 't' else library_id)
+            ).replace('%', '%%'))
+        elif field is not None:
+            parts.append('%s')
+            fields.append(field)
+    return ''.join(parts), tuple(fields)
+
+
+def route(compiled, parts):
+    """ Fill in a compiled route's fields, quoting their values
+    """
+    fmt, fields = compiled
+    if not fields:
+        return fmt
+    return fmt % tuple(quote('%s' % parts[f]) for f in fields)
+
+
+class Memo(object):
+    """
+    Results of read API calls, valid for a single library version
+    Whether the library has changed is checked using a conditional request
+    at most once every interval seconds; if it has, every result is dropped
+
+    Results are kept in a cache.Cache, under keys beginning with prefix.
+    Each is stored with the library version it was retrieved at, so a cache
+    shared by many processes can be used by all of them: results stored by
+    one are used by the others once they've checked the library version
+    """
+    def __init__(self, interval=60, cache=None, prefix='memo:'):
+        self.interval = interval
+        self.version = None
+        self.checked = 0
+        # a private cache is emptied when the library changes
+        self.private = cache is None
+        self.entries = MemoryCache() if cache is None else cache
+        self.prefix = prefix
+
+    def clear(self):
+        """ Drop all memoized results
+        """
+        self.version = None
+        if self.private:
+            self.entries.clear()
+
+    def lookup(self, zot, key):
+        """
+        Return a memoized (response, links, result) tuple for a key, or None
+        """
+        entry = self.entries.get(self.prefix + key)
+        if entry is None:
+            return None
+        now = time.time()
+        if self.version is None or now - self.checked >= self.interval:
+            changed, version = zot._count(
+                zot._path('/{t}/{u}/items/top'), version=self.version)
+            self.checked = now
+            if changed is not None:
+                self._changed(version)
+        if entry[0] != self.version:
+            return None
+        return entry[1:]
+
+    def _changed(self, version):
+        """ The library is now at version
+        """
+        if self.private:
+            self.entries.clear()
+        self.version = version
+
+    def store(self, zot, key, result):
+        """
+        Memoize a result, along with the response and links it came from
+        Results without a Last-Modified-Version header aren't stored
+        """
+        version = zot.request.headers.get('Last-Modified-Version')
+        if version is None:
+            return
+        version = int(version)
+        if version != self.version:
+            self._changed(version)
+            self.checked = time.time()
+        self.entries.set(
+            self.prefix + key,
+            (version, zot.request, zot.links, copy.deepcopy(result)))
+
+
 def retrieve(func):
     """
     Decorator for Zotero read API methods; calls _retrieve_data() and passes
     the result to the correct processor, based on a lookup
+    If memoization is enabled, results are returned from the memo for as
+    long as the library version is unchanged
     """
     def wrapped_f(self, *args, **kwargs):
         """
@@ -117,35 +254,30 @@ def retrieve(func):
         """
         if kwargs:
             self.add_parameters(**kwargs)
-        retrieved = self._retrieve_data(func(self, *args))
-        # we now always have links in the header response
-        self.links = self._extract_links()
-        # determine content and format, based on url params
-        content = self.content.search(
-            self.request.url) and \
-            self.content.search(
-                self.request.url).group(0) or 'bib'
-       # JSON by default
-        formats = {
-            'application/atom+xml': 'atom',
-            'application/json': 'json',
-            'text/plain': 'plain',
-            }
-        fmt = formats.get(self.request.headers['Content-Type'], 'json')
-        # clear all query parameters
-        self.url_params = None
-        # Or process atom if it's atom-formatted
-        if fmt == 'atom':
-            parsed = feedparser.parse(retrieved)
-            # select the correct processor
-            processor = self.processors.get(content)
-            # process the content correctly with a custom rule
-            return processor(parsed)
-        if self.tag_data:
-            self.tag_data = False
-            return self._tags_data(retrieved)
-        # No need to do anything
-        return retrieved
+        query = func(self, *args)
+        # set by _build_query(), but not by follow()
+        content = self.query_content
+        self.query_content = None
+        memo = self.memo
+        if memo is not None and func.__name__ not in NOT_MEMOIZED:
+            # the query contains the method's arguments and URL parameters
+            key = '%s:%s' % (func.__name__, query)
+            hit = memo.lookup(self, key)
+            if self.metrics is not None:
+                self.metrics.cache('memo', hit=hit is not None)
+            if hit is not None:
+                self.url_params = None
+                self.tag_data = False
+                self.request, self.links, result = hit
+                return copy.deepcopy(result)
+        else:
+            memo = None
+        result = self._process(self._retrieve_data(query), content)
+        if memo is not None:
+            memo.store(self, key, result)
+        if self.resolver is not None:
+            self.resolver.observe(result)
+        return result
     return wrapped_f
 
 
@@ -156,8 +288,29 @@ class Zotero(object):
     http://www.zotero.org/support/dev/server_api
     """
     def __init__(self, library_id=None, library_type=None, api_key=None,
-                 preserve_json_order=False):
+                 preserve_json_order=False, metrics=None, session=None,
+                 memoize=None, resolver=None, transport=None,
+                 encodings=None, cache=None):
         """ Store Zotero credentials
+        Optionally accepts a metrics.Metrics instance, which will record
+        request timings, sizes, parse times, cache use and retries, and a
+        requests.Session, whose connection pool may be shared with other
+        Zotero instances
+        Requests are sent using transport, a transport.Transport instance
+        (by default, a transport.RequestsTransport using session)
+        encodings is a list of content codings to ask the server to
+        compress responses with, most preferred first (by default, every
+        coding which the transport can decode: see Transport.encodings()).
+        Pass an empty list to ask for uncompressed responses
+        Templates, schema, item counts and memoized results are kept in
+        cache, a cache.Cache instance which may be shared with other Zotero
+        instances and processes (by default, a private cache.MemoryCache)
+        If memoize is a number of seconds, the results of read API calls
+        are memoized until the library version changes, which is checked
+        at most once per memoize seconds
+        If a conflicts.Resolver is passed, writes which fail because the
+        object has been modified since it was retrieved are merged and
+        retried
         """
         self.endpoint = 'https://api.zotero.org'
         if library_id and library_type:
@@ -171,13 +324,29 @@ class Zotero(object):
         if api_key:
             self.api_key = api_key
         self.preserve_json_order = preserve_json_order
+        self.metrics = metrics
+        self.transport = transport or RequestsTransport(session)
+        self.accept_encoding = accept_encoding(
+            encodings, self.transport.encodings())
+        self.cache = MemoryCache() if cache is None else cache
+        prefix = '{t}/{u}:'.format(t=self.library_type, u=self.library_id)
+        self.memo = Memo(
+            memoize, cache, 'memo:' + prefix) if memoize is not None else None
+        self.count_key = 'counts:' + prefix
+        self.resolver = resolver
         self.url_params = None
+        self.url_content = None
+        self.query_content = None
+        # URL parameters -> encoded query string
+        self.encoded = {}
+        # path template -> compiled route, for this library
+        self.routes = {}
+        self.routes_for = None
         self.tag_data = False
         self.request = None
         # these aren't valid item fields, so never send them to the server
         self.temp_keys = set(['key', 'etag', 'group_id', 'updated'])
         # determine which processor to use for the parsed content
-        self.fmt = re.compile(r'(?<=format=)\w+')
         self.content = re.compile(r'(?<=content=)\w+')
         self.processors = {
             'bib': self._bib_processor,
@@ -197,7 +366,8 @@ class Zotero(object):
             'json': self._json_processor,
         }
         self.links = None
-        self.templates = {}
+        # templates and schema aren't specific to a library
+        self.templates = Namespace(self.cache, 'templates:')
         self.file_content_types = [
             'application/msword',
             'application/pdf',
@@ -219,6 +389,7 @@ class Zotero(object):
             "User-Agent": "Pyzotero/%s" % __version__,
             "Authorization": "Bearer %s" % self.api_key,
             "Zotero-API-Version": "%s" % __api_version__,
+            "Accept-Encoding": self.accept_encoding,
             }
 
     def _cache(self, template, key):
@@ -227,20 +398,23 @@ class Zotero(object):
         accepts a dict and key name, adds the retrieval time, and adds both
         to self.templates as a new dict using the specified key
         """
+        import pytz
         # cache template and retrieval time for subsequent calls
         thetime = datetime.datetime.utcnow().replace(
             tzinfo=pytz.timezone('GMT'))
+        if self.metrics is not None:
+            self.metrics.cache('templates', hit=False)
         self.templates[key] = {
             'tmplt': template,
             'updated': thetime}
         return copy.deepcopy(template)
 
     @cleanwrap
-    def _cleanup(self, to_clean):
-        """ Remove keys we added for internal use
+    def _cleanup(self, to_clean, allow=()):
+        """ Remove keys we added for internal use, other than those allowed
         """
         return dict([[k, v] for k, v in list(to_clean.items())
-                    if k not in self.temp_keys])
+                    if k in allow or k not in self.temp_keys])
 
     def _retrieve_data(self, request=None):
         """
@@ -249,21 +423,83 @@ class Zotero(object):
         Returns a JSON document
         """
         full_url = '%s%s' % (self.endpoint, request)
-        self.request = requests.get(
-            url=full_url,
+        self.request = self._request(
+            'GET',
+            full_url,
             headers=self.default_headers())
-        try:
-            self.request.raise_for_status()
-        except requests.exceptions.HTTPError:
-            error_handler(self.request)
         content_type = self.request.headers['Content-Type'].lower()
         if content_type == 'application/json':
-            return self.request.json()
+            start = time.time()
+            decoded = self.request.json()
+            if self.metrics is not None:
+                self.metrics.parse(self.request.url, time.time() - start)
+            return decoded
         elif content_type in self.file_content_types:
             return self.request.content
         else:
             return self.request.text
 
+    def _process(self, retrieved, content=None):
+        """
+        Pass data returned by _retrieve_data() to the correct processor,
+        based on the response's content type and the request's content
+        parameter, which is found in the request's URL if it isn't passed
+        """
+        # we now always have links in the header response
+        self.links = self._extract_links()
+        if content is None:
+            found = self.content.search(self.request.url)
+            content = found.group(0) if found else 'bib'
+        # JSON by default
+        fmt = FORMATS.get(self.request.headers['Content-Type'], 'json')
+        # clear all query parameters
+        self.url_params = None
+        # Or process atom if it's atom-formatted
+        if fmt == 'atom':
+            start = time.time()
+            parsed = load_feedparser().parse(retrieved)
+            # select the correct processor
+            processor = self.processors.get(content)
+            # process the content correctly with a custom rule
+            processed = processor(parsed)
+            if self.metrics is not None:
+                self.metrics.parse(self.request.url, time.time() - start)
+            return processed
+        if self.tag_data:
+            self.tag_data = False
+            return self._tags_data(retrieved)
+        # No need to do anything
+        return retrieved
+
+    def _request(self, method, url, **kwargs):
+        """
+        Send an HTTP request, recording it if metrics are enabled
+        Error responses are passed to error_handler(), and 429 responses
+        are retried
+        Returns the response
+        """
+        kwargs.setdefault('timeout', timeout)
+        start = time.time()
+        req = self.transport.send(method, url, **kwargs)
+        if self.metrics is not None:
+            self.metrics.request(
+                method,
+                req.url,
+                req.status_code,
+                time.time() - start,
+                sent=len(req.request.body or b''),
+                received=len(req.content),
+                wire=wire_bytes(req),
+                encoding=req.headers.get('Content-Encoding', 'identity'))
+        if self.memo is not None and method not in ('GET', 'HEAD'):
+            # writes, and failed writes, mean the library has changed
+            self.memo.clear()
+        if req.status_code >= 400:
+            req = error_handler(
+                req, self.metrics,
+                resend=lambda: self.transport.send(method, url, **kwargs))
+        return req
+
     def _extract_links(self):
         """
         Extract self, first, next, last links from a request response
@@ -291,6 +527,7 @@ class Zotero(object):
         As per the API docs, a template less than 1 hour old is
         assumed to be fresh, and will immediately return False if found
         """
+        import pytz
         # If the template is more than an hour old, try a 304
         if abs(datetime.datetime.utcnow().replace(tzinfo=pytz.timezone('GMT'))
                 - self.templates[template]['updated']).seconds > 3600:
@@ -303,14 +540,14 @@ class Zotero(object):
                     payload['updated'].strftime("%a, %d %b %Y %H:%M:%S %Z")}
             headers.update(self.default_headers())
             # perform the request, and check whether the response returns 304
-            req = requests.get(query, headers=headers)
-            try:
-                req.raise_for_status()
-            except requests.exceptions.HTTPError:
-                error_handler(req)
-            return req.status_code == 304
-        # Still plenty of life left in't
-        return False
+            req = self._request('GET', query, headers=headers)
+            fresh = req.status_code == 304
+        else:
+            # Still plenty of life left in't
+            fresh = False
+        if self.metrics is not None and not fresh:
+            self.metrics.cache('templates', hit=True)
+        return fresh
 
     def add_parameters(self, **params):
         """
@@ -325,18 +562,50 @@ class Zotero(object):
         if params.get('content'):
             params['format'] = 'atom'
         # TODO: rewrite format=atom, content=json request
-
-        self.url_params = urlencode(params)
-
-    def _build_query(self, query_string, no_params=False):
+        self.url_content = params.get('content') or 'bib'
+        # the same parameters are usually passed again and again
+        try:
+            key = tuple(params.items())
+            encoded = self.encoded.get(key)
+        except TypeError:
+            # unhashable values
+            key = encoded = None
+        if encoded is None:
+            encoded = urlencode(params)
+            if key is not None and len(self.encoded) < 1024:
+                self.encoded[key] = encoded
+        self.url_params = encoded
+
+    def _path(self, template, **parts):
+        """
+        Return an endpoint path, using a route compiled from a template
+        such as '/{t}/{u}/items/{i}', with any fields other than {t} and
+        {u} filled in using parts. Routes are compiled once per library
+        """
+        library = (self.library_type, self.library_id)
+        if library != self.routes_for:
+            self.routes = {}
+            self.routes_for = library
+        compiled = self.routes.get(template)
+        if compiled is None:
+            if len(self.routes) >= 1024:
+                self.routes = {}
+            compiled = self.routes[template] = compile_route(
+                template, *library)
+        return route(compiled, parts)
+
+    def _url(self, template, **parts):
+        """ Return an endpoint URL. See _path()
+        """
+        return self.endpoint + self._path(template, **parts)
+
+    def _build_query(self, query_string, no_params=False, **parts):
         """
         Set request parameters. Will always add the user ID if it hasn't
         been specifically set by an API method
         """
         try:
-            query = quote(query_string.format(
-                u=self.library_id,
-                t=self.library_type))
+            query = self._path(query_string, **parts)
         except KeyError as err:
             raise ze.ParamNotPassed(
                 'There\'s a request parameter missing: %s' % err)
@@ -345,6 +614,7 @@ class Zotero(object):
             if not self.url_params:
                 self.add_parameters()
             query = '%s?%s' % (query, self.url_params)
+            self.query_content = self.url_content
         return query
 
     # The following methods are Zotero Read API calls
@@ -357,40 +627,113 @@ class Zotero(object):
     def num_collectionitems(self, collection):
         """ Return the total number of items in the specified collection
         """
-        query = '/{t}/{u}/collections/{c}/items'.format(
-            u=self.library_id,
-            t=self.library_type,
-            c=collection.upper())
-        return self._totals(query)
+        return self._totals(
+            '/{t}/{u}/collections/{c}/items', c=collection.upper())
 
     def num_tagitems(self, tag):
         """ Return the total number of items for the specified tag
         """
-        query = '/{t}/{u}/tags/{ta}/items'.format(
-            u=self.library_id,
-            t=self.library_type,
-            ta=tag)
-        return self._totals(query)
+        return self._totals('/{t}/{u}/tags/{ta}/items', ta=tag)
 
-    def _totals(self, query):
+    def _totals(self, query, **parts):
         """ General method for returning total counts
+        Any URL parameters which have been set, and the content type they
+        request, are left untouched
         """
-        self.add_parameters(limit=1)
-        query = self._build_query(query)
-        data = self._retrieve_data(query)
-        self.url_params = None
+        saved = (self.url_params, self.url_content, self.query_content)
+        try:
+            self.add_parameters(limit=1)
+            query = self._build_query(query, **parts)
+            self._retrieve_data(query)
+        finally:
+            self.url_params, self.url_content, self.query_content = saved
         # extract the 'total items' figure
         return int(self.request.headers['Total-Results'])
 
+    def _count(self, path, params=None, version=None):
+        """
+        Return the Total-Results count and library version for an items
+        path, using a HEAD request. If a library version is passed and the
+        library hasn't changed since then, the count is None
+        """
+        query = dict(params or {}, limit=1, format='json')
+        headers = self.default_headers()
+        if version:
+            headers['If-Modified-Since-Version'] = '%s' % version
+        req = self._request(
+            'HEAD',
+            '%s%s?%s' % (self.endpoint, path, urlencode(query)),
+            headers=headers)
+        latest = int(req.headers.get('Last-Modified-Version', version or 0))
+        if req.status_code == 304:
+            return None, latest
+        return int(req.headers['Total-Results']), latest
+
+    def counts(self, collections=(), tags=(), max_workers=8, max_age=0):
+        """
+        Return item counts for the library, and for many collections and
+        tags at once:
+        {'top': n, 'collections': {key: n, ...}, 'tags': {tag: n, ...}}
+
+        Counts are cached, keyed by library version. Each call first checks
+        whether the library has changed using a single conditional request,
+        and if it hasn't (or if the last check is less than max_age seconds
+        old), cached counts are returned. Counts which aren't cached are
+        retrieved using concurrent HEAD requests
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        prefix = self._path('/{t}/{u}')
+        probes = {('top', None): (prefix + '/items/top', None)}
+        for coll in collections:
+            probes[('collections', coll)] = (
+                '%s/collections/%s/items' % (prefix, coll.upper()), None)
+        for tag in tags:
+            probes[('tags', tag)] = (prefix + '/items', {'tag': tag})
+        # item counts, and the library version they were retrieved at
+        cached = copy.deepcopy(self.cache.get(self.count_key)) or {
+            'version': 0, 'checked': 0, 'counts': {}}
+        now = time.time()
+        if cached['version'] and now - cached['checked'] >= max_age:
+            # has anything changed since the cached counts were retrieved?
+            top, version = self._count(
+                prefix + '/items/top', version=cached['version'])
+            if top is not None:
+                cached['counts'] = {('top', None): top}
+                cached['version'] = version
+            cached['checked'] = now
+        missing = [k for k in probes if k not in cached['counts']]
+        if missing:
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                fetched = dict(zip(missing, pool.map(
+                    lambda k: self._count(*probes[k]), missing)))
+                latest = max(v for _, v in fetched.values())
+                if latest != cached['version']:
+                    # the library changed, so cached counts are stale too
+                    stale = [k for k in probes if k not in fetched]
+                    fetched.update(zip(stale, pool.map(
+                        lambda k: self._count(*probes[k]), stale)))
+                    cached['counts'] = {}
+            for key, (count, version) in fetched.items():
+                cached['counts'][key] = count
+            cached['version'] = max(v for _, v in fetched.values())
+            cached['checked'] = now
+        self.cache.set(self.count_key, cached)
+        counts = cached['counts']
+        return {
+            'top': counts[('top', None)],
+            'collections': dict(
+                (c, counts[('collections', c)]) for c in collections),
+            'tags': dict((t, counts[('tags', t)]) for t in tags),
+        }
+
     @retrieve
     def key_info(self, **kwargs):
         """
         Retrieve info about the permissions associated with the
         key associated to the given Zotero instance
         """
-        query_string = '/keys/{k}'.format(
-            k=self.api_key)
-        return self._build_query(query_string)
+        query_string = '/keys/{k}'
+        return self._build_query(query_string, k=self.api_key)
 
     @retrieve
     def items(self, **kwargs):
@@ -419,55 +762,110 @@ class Zotero(object):
         query_string = '/{t}/{u}/items/trash'
         return self._build_query(query_string)
 
+    @retrieve
+    def deleted(self, **kwargs):
+        """ Get keys of objects deleted since a library version
+        Requires the 'since' parameter
+        """
+        query_string = '/{t}/{u}/deleted'
+        return self._build_query(query_string)
+
     @retrieve
     def item(self, item, **kwargs):
         """ Get a specific item
         """
-        query_string = '/{t}/{u}/items/{i}'.format(
-            u=self.library_id,
-            t=self.library_type,
-            i=item.upper())
-        return self._build_query(query_string)
+        query_string = '/{t}/{u}/items/{i}'
+        return self._build_query(query_string, i=item.upper())
 
     @retrieve
     def file(self, item, **kwargs):
         """ Get the file from an specific item
         """
-        query_string = '/{t}/{u}/items/{i}/file'.format(
-            u=self.library_id,
-            t=self.library_type,
-            i=item.upper())
-        return self._build_query(query_string, no_params=True)
+        query_string = '/{t}/{u}/items/{i}/file'
+        return self._build_query(
+            query_string, no_params=True, i=item.upper())
 
     @retrieve
     def children(self, item, **kwargs):
         """ Get a specific item's child items
         """
-        query_string = '/{t}/{u}/items/{i}/children'.format(
-            u=self.library_id,
-            t=self.library_type,
-            i=item.upper())
-        return self._build_query(query_string)
+        query_string = '/{t}/{u}/items/{i}/children'
+        return self._build_query(query_string, i=item.upper())
+
+    def children_many(self, items, max_workers=8, **kwargs):
+        """
+        Return the child items of many items at once, as an OrderedDict
+        mapping each parent item's key to a list of its children, in the
+        order the items were passed
+        items is a list of item keys, or of items returned by a read call
+        (whose meta.numChildren is used). Any other keyword arguments are
+        passed as search parameters
+
+        The API can't filter items by parent, so items without children are
+        found using batched itemKey requests, and skipped; children of the
+        rest are retrieved using up to max_workers concurrent requests
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        parents = OrderedDict()
+        for item in items:
+            if isinstance(item, dict):
+                key = item.get('key') or item['data']['key']
+                parents[key.upper()] = item.get('meta', {}).get('numChildren')
+            else:
+                parents.setdefault(item.upper(), None)
+        unknown = [k for k, n in parents.items() if n is None]
+        url = self._url('/{t}/{u}/items')
+        for batch in batches(unknown, ','):
+            req = self._request(
+                'GET', url,
+                params={'itemKey': ','.join(batch), 'format': 'json',
+                        'limit': len(batch)},
+                headers=self.default_headers())
+            for found in req.json():
+                parents[found['key']] = found['meta'].get('numChildren', 0)
+
+        def fetch(key):
+            """ retrieve every page of an item's children """
+            children = []
+            url = self._url('/{t}/{u}/items/{i}/children', i=key)
+            params = dict(kwargs, format='json')
+            params.setdefault('limit', 100)
+            while url:
+                req = self._request(
+                    'GET', url, params=params,
+                    headers=self.default_headers())
+                children.extend(self._decode_json(req))
+                url = req.links.get('next', {}).get('url')
+                # the next link includes the parameters
+                params = None
+            return children
+        wanted = [k for k, n in parents.items() if n]
+        fetched = {}
+        if wanted:
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                fetched = dict(zip(wanted, pool.map(fetch, wanted)))
+        return OrderedDict((k, fetched.get(k, [])) for k in parents)
+
+    def _decode_json(self, req):
+        """ Decode a JSON response, preserving key order if requested
+        """
+        if self.preserve_json_order:
+            return json.loads(req.text, object_pairs_hook=OrderedDict)
+        return req.json()
 
     @retrieve
     def collection_items(self, collection, **kwargs):
         """ Get a specific collection's items
         """
-        query_string = '/{t}/{u}/collections/{c}/items'.format(
-            u=self.library_id,
-            t=self.library_type,
-            c=collection.upper())
-        return self._build_query(query_string)
+        query_string = '/{t}/{u}/collections/{c}/items'
+        return self._build_query(query_string, c=collection.upper())
 
     @retrieve
     def collection(self, collection, **kwargs):
         """ Get user collection
         """
-        query_string = '/{t}/{u}/collections/{c}'.format(
-            u=self.library_id,
-            t=self.library_type,
-            c=collection.upper())
-        return self._build_query(query_string)
+        query_string = '/{t}/{u}/collections/{c}'
+        return self._build_query(query_string, c=collection.upper())
 
     @retrieve
     def collections(self, **kwargs):
@@ -480,11 +878,8 @@ class Zotero(object):
     def collections_sub(self, collection, **kwargs):
         """ Get subcollections for a specific collection
         """
-        query_string = '/{t}/{u}/collections/{c}/collections'.format(
-            u=self.library_id,
-            t=self.library_type,
-            c=collection.upper())
-        return self._build_query(query_string)
+        query_string = '/{t}/{u}/collections/{c}/collections'
+        return self._build_query(query_string, c=collection.upper())
 
     @retrieve
     def groups(self, **kwargs):
@@ -505,12 +900,108 @@ class Zotero(object):
     def item_tags(self, item, **kwargs):
         """ Get tags for a specific item
         """
-        query_string = '/{t}/{u}/items/{i}/tags'.format(
-            u=self.library_id,
-            t=self.library_type,
-            i=item.upper())
+        query_string = '/{t}/{u}/items/{i}/tags'
         self.tag_data = True
-        return self._build_query(query_string)
+        return self._build_query(query_string, i=item.upper())
+
+    def item_keys(self, **kwargs):
+        """
+        Get a list of item keys, using format=keys
+        Unless a limit is passed, every matching key is returned at once
+        """
+        kwargs['format'] = 'keys'
+        return split_keys(self.items(**kwargs))
+
+    def item_versions(self, since=None, **kwargs):
+        """
+        Get a {key: version} dict of items, using format=versions
+        If since (a library version) is passed, only items modified since
+        then are included. Unless a limit is passed, every matching item is
+        returned at once
+        """
+        kwargs['format'] = 'versions'
+        if since is not None:
+            kwargs['since'] = since
+        return self.items(**kwargs)
+
+    def collection_versions(self, since=None, **kwargs):
+        """
+        Get a {key: version} dict of collections, using format=versions
+        If since (a library version) is passed, only collections modified
+        since then are included
+        """
+        kwargs['format'] = 'versions'
+        if since is not None:
+            kwargs['since'] = since
+        return self.collections(**kwargs)
+
+    def export(self, fmt, dest, compress=False, workers=4, limit=100,
+               **kwargs):
+        """
+        Export library items to a file, in an export format such as
+        'bibtex', 'ris' or 'csljson'
+        dest is a file path, or a file object opened in binary mode. If
+        compress is True, the output is gzip-compressed. Any other keyword
+        arguments are passed as search parameters
+
+        Pages of up to limit items are retrieved using up to workers
+        concurrent requests, and written in order as they arrive, so only
+        a few pages are held in memory at once
+        Returns the number of items exported: counted in the output for
+        csljson, bibtex, biblatex, ris and refer, and otherwise taken to be
+        the number of items requested for each page which isn't empty
+        """
+        import gzip
+        from collections import deque
+        from concurrent.futures import ThreadPoolExecutor
+        url = self._url('/{t}/{u}/items')
+
+        def fetch(start):
+            """ retrieve a page of exported items """
+            params = dict(kwargs, format=fmt, limit=limit, start=start)
+            return self._request(
+                'GET', url, params=params, headers=self.default_headers())
+        if hasattr(dest, 'write'):
+            out = gzip.GzipFile(fileobj=dest, mode='wb') if compress \
+                else dest
+        else:
+            out = gzip.open(dest, 'wb') if compress else open(dest, 'wb')
+        try:
+            page = fetch(0)
+            total = int(page.headers.get('Total-Results', 0))
+            starts = iter(range(limit, total, limit))
+            written = False
+            exported = 0
+            if fmt == 'csljson':
+                out.write(b'{"items": [')
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                # keep a few pages in flight, ahead of the one being written
+                window = deque(
+                    (start, pool.submit(fetch, start)) for _, start in
+                    zip(range(workers * 2), starts))
+                start = 0
+                while page is not None:
+                    written, count = export_page(fmt, page, out, written)
+                    if count is None:
+                        # no way to count this format's records
+                        count = min(limit, max(total - start, 0))
+                    exported += count
+                    page = None
+                    if window:
+                        start, future = window.popleft()
+                        page = future.result()
+                        for following in starts:
+                            window.append(
+                                (following, pool.submit(fetch, following)))
+                            break
+            if fmt == 'csljson':
+                out.write(b']}\n')
+            elif written:
+                out.write(b'\n')
+        finally:
+            if out is not dest:
+                out.close()
+        return exported
 
     def all_top(self, **kwargs):
         """ Retrieve all top-level items
@@ -697,17 +1188,11 @@ class Zotero(object):
                 for child in payload:
                     child['parentItem'] = parentid
             to_send = json.dumps(payload)
-            req = requests.post(
-                url=self.endpoint
-                + liblevel.format(
-                    t=self.library_type,
-                    u=self.library_id,),
+            req = self._request(
+                'POST',
+                self._url(liblevel),
                 data=to_send,
                 headers=headers)
-            try:
-                req.raise_for_status()
-            except requests.exceptions.HTTPError:
-                error_handler(req)
             data = req.json()
             return data
 
@@ -715,6 +1200,8 @@ class Zotero(object):
             """
             Step 1: get upload authorisation for a file
             """
+            import hashlib
+            import mimetypes
             mtypes = mimetypes.guess_type(attachment)
             digest = hashlib.md5()
             with open(attachment, 'rb') as att:
@@ -733,17 +1220,11 @@ class Zotero(object):
                 'contentType': mtypes[0] or 'application/octet-stream',
                 'charset': mtypes[1]
             }
-            auth_req = requests.post(
-                url=self.endpoint
-                + '/users/{u}/items/{i}/file'.format(
-                    u=self.library_id,
-                    i=reg_key),
+            auth_req = self._request(
+                'POST',
+                self._url('/users/{u}/items/{i}/file', i=reg_key),
                 data=data,
                 headers=auth_headers)
-            try:
-                auth_req.raise_for_status()
-            except requests.exceptions.HTTPError:
-                error_handler(auth_req)
             return auth_req.json()
 
         def uploadfile(authdata, reg_key):
@@ -754,23 +1235,17 @@ class Zotero(object):
             reg_key isn't used, but we need to pass it through to Step 3
             """
             upload_file = bytearray(authdata['prefix'].encode())
-            upload_file.extend(open(attach, 'r').read()),
+            with open(attach, 'rb') as att:
+                upload_file.extend(att.read())
             upload_file.extend(authdata['suffix'].encode())
-            # Requests chokes on bytearrays, so convert to str
-            upload_dict = {
-                'file': (
-                    os.path.basename(attach),
-                    str(upload_file))}
-            upload = requests.post(
-                url=authdata['url'],
-                files=upload_dict,
+            # Requests chokes on bytearrays, so convert to bytes
+            self._request(
+                'POST',
+                authdata['url'],
+                data=bytes(upload_file),
                 headers={
                     "Content-Type": authdata['contentType'],
                     'User-Agent': 'Pyzotero/%s' % __version__})
-            try:
-                upload.raise_for_status()
-            except requests.exceptions.HTTPError:
-                error_handler(upload)
             # now check the responses
             return register_upload(authdata, reg_key)
 
@@ -787,31 +1262,22 @@ class Zotero(object):
             reg_data = {
                 'upload': authdata.get('uploadKey')
             }
-            upload_reg = requests.post(
-                url=self.endpoint
-                + '/users/{u}/items/{i}/file'.format(
-                    u=self.library_id,
-                    i=reg_key),
+            self._request(
+                'POST',
+                self._url('/users/{u}/items/{i}/file', i=reg_key),
                 data=reg_data,
                 headers=dict(reg_headers))
-            try:
-                upload_reg.raise_for_status()
-            except requests.exceptions.HTTPError:
-                error_handler(upload_reg)
 
         # TODO: The flow needs to be a bit clearer
         created = create_prelim(payload, parentid)
-        registered_idx = [int(k) for k in created['success'].keys()]
-        if registered_idx:
-            # only upload and register authorised files
-            registered_keys = created['success'].values()
-            for r_idx, r_content in enumerate(registered_idx):
-                attach = payload[r_content]['filename']
-                authdata = get_auth(attach, registered_keys[r_idx])
-                # no need to keep going if the file exists
-                if authdata == {'exists: 1'}:
-                    continue
-                uploadfile(authdata, registered_keys[r_idx])
+        # only upload and register authorised files
+        for r_idx, reg_key in created['success'].items():
+            attach = payload[int(r_idx)]['filename']
+            authdata = get_auth(attach, reg_key)
+            # no need to keep going if the file exists
+            if authdata.get('exists'):
+                continue
+            uploadfile(authdata, reg_key)
         return created
 
     def add_tags(self, item, *tags):
@@ -953,42 +1419,64 @@ class Zotero(object):
         retrieved = self._retrieve_data(query_string)
         return self._cache(json.loads(retrieved), template_name)
 
-    def create_items(self, payload):
+    def create_items(self, payload, write_token=None, preserve_keys=False):
         """
         Create new Zotero items
         Accepts one argument, a list containing one or more item dicts
+        write_token is an optional 32-character token identifying this
+        write: if a request with the same token has already succeeded, the
+        API refuses it (raising PreConditionFailed), so a retried write
+        can't create the items twice. By default a random token is used
+        If preserve_keys is True, the items' 'key' values are kept, so that
+        they're created with those keys, rather than with keys assigned by
+        the API
         """
         if len(payload) > 50:
             raise ze.TooManyItems(
                 "You may only create up to 50 items per call")
         # TODO: strip extra data if it's an existing item
-        to_send = json.dumps([i for i in self._cleanup(*payload)])
+        allow = ('key',) if preserve_keys else ()
+        to_send = json.dumps([i for i in self._cleanup(*payload, allow=allow)])
         headers = {
-            'Zotero-Write-Token': token(),
+            'Zotero-Write-Token': write_token or token(),
             'Content-Type': 'application/json',
         }
         headers.update(self.default_headers())
-        req = requests.post(
-            url=self.endpoint
-            + '/{t}/{u}/items'.format(
-                t=self.library_type,
-                u=self.library_id),
+        req = self._request(
+            'POST',
+            self._url('/{t}/{u}/items'),
             data=to_send,
             headers=dict(headers))
-        try:
-            req.raise_for_status()
-        except requests.exceptions.HTTPError:
-            error_handler(req)
         return req.json()
 
-    def create_collection(self, payload):
+    def create_collection(self, payload, write_token=None):
         """
-        Create a new Zotero collection
+        Create up to 50 new Zotero collections
         Accepts one argument, a list of dicts containing the following keys:
 
         'name': the name of the collection
         'parentCollection': OPTIONAL, the parent collection to which you wish to add this
+        write_token is an optional 32-character write token (see
+        create_items())
+        Returns the API response as a JSON string; create_collections()
+        returns it decoded
         """
+        return self._create_collections(payload, write_token).text
+
+    def create_collections(self, payload, write_token=None):
+        """
+        Create up to 50 new Zotero collections. See create_collection()
+        Returns the API response: a dict of 'successful', 'success',
+        'unchanged' and 'failed' dicts, keyed by position in the payload
+        """
+        return self._create_collections(payload, write_token).json()
+
+    def _create_collections(self, payload, write_token):
+        """ Send a collection creation request, and return the response
+        """
+        if len(payload) > 50:
+            raise ze.TooManyItems(
+                "You may only create up to 50 collections per call")
         # no point in proceeding if there's no 'name' key
         for item in payload:
             if 'name' not in item:
@@ -998,21 +1486,15 @@ class Zotero(object):
             if not 'parentCollection' in item:
                 item['parentCollection'] = ''
         headers = {
-            'Zotero-Write-Token': token(),
+            'Zotero-Write-Token': write_token or token(),
+            'Content-Type': 'application/json',
         }
         headers.update(self.default_headers())
-        req = requests.post(
-            url=self.endpoint
-            + '/{t}/{u}/collections'.format(
-                t=self.library_type,
-                u=self.library_id),
+        return self._request(
+            'POST',
+            self._url('/{t}/{u}/collections'),
             headers=headers,
             data=json.dumps(payload))
-        try:
-            req.raise_for_status()
-        except requests.exceptions.HTTPError:
-            error_handler(req)
-        return req.text
 
     def update_collection(self, payload):
         """
@@ -1022,20 +1504,39 @@ class Zotero(object):
         """
         modified = payload['version']
         key = payload['key']
-        headers = {'If-Unmodified-Since-Version': modified}
+        headers = {
+            'If-Unmodified-Since-Version': '%s' % modified,
+            'Content-Type': 'application/json',
+        }
         headers.update(self.default_headers())
-        req = requests.put(
-            url=self.endpoint
-            + '/{t}/{u}/collections/{c}'.format(
-                t=self.library_type, u=self.library_id, c=key),
+        self._request(
+            'PUT',
+            self._url('/{t}/{u}/collections/{c}', c=key),
             headers=headers,
-            payload=json.dumps(payload))
-        try:
-            req.raise_for_status()
-        except requests.exceptions.HTTPError:
-            error_handler(req)
+            data=json.dumps(payload.get('data', payload)))
         return True
 
+    def update_collections(self, payload):
+        """
+        Update up to 50 existing collections in a single request
+        Accepts a list of collection dicts, or of collection data dicts.
+        Each must contain 'key' and 'version', and may contain only changed
+        fields
+        Returns the API response: a dict of 'successful', 'success',
+        'unchanged' and 'failed' dicts, keyed by position in the payload
+        """
+        if len(payload) > 50:
+            raise ze.TooManyItems(
+                "You may only update up to 50 collections per call")
+        headers = {'Content-Type': 'application/json'}
+        headers.update(self.default_headers())
+        req = self._request(
+            'POST',
+            self._url('/{t}/{u}/collections'),
+            data=json.dumps([c.get('data', c) for c in payload]),
+            headers=headers)
+        return req.json()
+
     def attachment_simple(self, files, parentid=None):
         """
         Add attachments using filenames as title
@@ -1078,21 +1579,76 @@ class Zotero(object):
         to_send = self.check_items([payload])[0]
         modified = payload['version']
         ident = payload['key']
-        headers = {'If-Unmodified-Since-Version': modified}
+
+        def write(state):
+            """ Send the item data, if it's unmodified since version """
+            version, data = state
+            headers = {'If-Unmodified-Since-Version': '%s' % version}
+            headers.update(self.default_headers())
+            req = self._request(
+                'PUT',
+                self._url('/{t}/{u}/items/{i}', i=ident),
+                headers=headers,
+                data=json.dumps(data))
+            if self.resolver is not None and \
+                    'Last-Modified-Version' in req.headers:
+                self.resolver.remember(
+                    ident, int(req.headers['Last-Modified-Version']), data)
+            return True
+
+        # the version we changed, which is the common ancestor for merges
+        base = self.resolver.base(ident, modified) \
+            if self.resolver is not None else None
+
+        def refresh(state):
+            """ Merge our changes into the item's current version """
+            theirs = self._current(ident)
+            merged = self.resolver.merge(base, to_send, theirs['data'])
+            return theirs['version'], merged
+
+        return self._resolving(write, (modified, to_send), refresh)
+
+    def _current(self, ident):
+        """ Retrieve the current version of an item, bypassing the memo
+        """
+        if self.memo is not None:
+            self.memo.clear()
+        return self.item(ident)
+
+    def _resolving(self, write, state, refresh):
+        """
+        Call write(state), using the conflict resolver to retry it if it
+        fails with a 412 response, and a resolver has been set
+        """
+        if self.resolver is None:
+            return write(state)
+        return self.resolver.run(write, state, refresh)
+
+    def update_items(self, payload):
+        """
+        Update up to 50 existing items in a single request
+        Accepts a list of item dicts, or of item data dicts. Each must
+        contain 'key' and 'version', and may contain only changed fields
+        Returns the API response: a dict of 'successful', 'success',
+        'unchanged' and 'failed' dicts, keyed by position in the payload
+        """
+        if len(payload) > 50:
+            raise ze.TooManyItems(
+                "You may only update up to 50 items per call")
+        to_send = []
+        for item in payload:
+            data = item.get('data', item)
+            to_send.append(dict(
+                (k, v) for k, v in data.items()
+                if k == 'key' or k not in self.temp_keys))
+        headers = {'Content-Type': 'application/json'}
         headers.update(self.default_headers())
-        req = requests.put(
-            url=self.endpoint
-            + '/{t}/{u}/items/{id}'.format(
-                t=self.library_type,
-                u=self.library_id,
-                id=ident),
-            headers=headers,
-            data=json.dumps(to_send))
-        try:
-            req.raise_for_status()
-        except requests.exceptions.HTTPError:
-            error_handler(req)
-        return True
+        req = self._request(
+            'POST',
+            self._url('/{t}/{u}/items'),
+            data=json.dumps(to_send),
+            headers=headers)
+        return req.json()
 
     def addto_collection(self, collection, payload):
         """
@@ -1102,24 +1658,36 @@ class Zotero(object):
         """
         ident = payload['key']
         modified = payload['version']
-        # add the collection data from the item
-        modified_collections = payload['data']['collections'] + list(collection)
-        headers = {'If-Unmodified-Since-Version': modified}
+
+        def added(collections):
+            """ add the collection to the item's collections """
+            return collections + [
+                c for c in [collection] if c not in collections]
+        return self._resolving(
+            lambda state: self._patch_collections(ident, *state),
+            (modified, added(payload['data']['collections'])),
+            lambda state: self._refresh_collections(ident, added))
+
+    def _patch_collections(self, ident, modified, collections):
+        """ Set an item's collections, if it's unmodified since version
+        """
+        headers = {'If-Unmodified-Since-Version': '%s' % modified}
         headers.update(self.default_headers())
-        req = requests.patch(
-            url=self.endpoint
-            + '/{t}/{u}/items/{i}'.format(
-                t=self.library_type,
-                u=self.library_id,
-                i=ident),
-            data=json.dumps({'collections': modified_collections}),
+        self._request(
+            'PATCH',
+            self._url('/{t}/{u}/items/{i}', i=ident),
+            data=json.dumps({'collections': collections}),
             headers=headers)
-        try:
-            req.raise_for_status()
-        except requests.exceptions.HTTPError:
-            error_handler(req)
         return True
 
+    def _refresh_collections(self, ident, change):
+        """
+        Return an item's current version, and its current collections
+        with a change applied
+        """
+        theirs = self._current(ident)
+        return theirs['version'], change(theirs['data']['collections'])
+
     def deletefrom_collection(self, collection, payload):
         """
         Delete an item from a collection
@@ -1128,24 +1696,14 @@ class Zotero(object):
         """
         ident = payload['key']
         modified = payload['version']
-        # strip the collection data from the item
-        modified_collections = [
-            c for c in payload['data']['collections'] if c != collection]
-        headers = {'If-Unmodified-Since-Version': modified}
-        headers.update(self.default_headers())
-        req = requests.patch(
-            url=self.endpoint
-            + '/{t}/{u}/items/{i}'.format(
-                t=self.library_type,
-                u=self.library_id,
-                i=ident),
-            data=json.dumps({'collections': modified_collections}),
-            headers=headers)
-        try:
-            req.raise_for_status()
-        except requests.exceptions.HTTPError:
-            error_handler(req)
-        return True
+
+        def removed(collections):
+            """ strip the collection from the item's collections """
+            return [c for c in collections if c != collection]
+        return self._resolving(
+            lambda state: self._patch_collections(ident, *state),
+            (modified, removed(payload['data']['collections'])),
+            lambda state: self._refresh_collections(ident, removed))
 
     def delete_item(self, payload):
         """
@@ -1154,34 +1712,31 @@ class Zotero(object):
             a dict containing item data
             OR a list of dicts containing item data
         """
-        params = None
         if isinstance(payload, list):
-            params = {'itemKey': ','.join([p['key'] for p in payload])}
-            modified = payload[0]['version']
-            url = self.endpoint + \
-            '/{t}/{u}/items'.format(
-                t=self.library_type,
-                u=self.library_id)
-        else:
-            ident = payload['key']
-            modified = payload['version']
-            url = self.endpoint + \
-            '/{t}/{u}/items/{c}'.format(
-                t=self.library_type,
-                u=self.library_id,
-                c=ident)
-        headers = {'If-Unmodified-Since-Version': modified}
-        headers.update(self.default_headers())
-        req = requests.delete(
-            url=url,
-            params=params,
-            headers=headers
-        )
-        try:
-            req.raise_for_status()
-        except requests.exceptions.HTTPError:
-            error_handler(req)
-        return True
+            self.delete_items(payload)
+            return True
+        ident = payload['key']
+        modified = payload['version']
+        url = self._url('/{t}/{u}/items/{i}', i=ident)
+
+        def write(version):
+            """ Delete, if unmodified since version """
+            headers = {'If-Unmodified-Since-Version': '%s' % version}
+            headers.update(self.default_headers())
+            self._request(
+                'DELETE',
+                url,
+                headers=headers
+            )
+            return True
+        if self.resolver is not None and self.resolver.delete == 'raise':
+            return write(modified)
+        return self._resolving(write, modified, self._library_version)
+
+    def _library_version(self, *args):
+        """ Return the current library version, using a HEAD request
+        """
+        return self._count(self._path('/{t}/{u}/items/top'))[1]
 
     def delete_collection(self, payload):
         """
@@ -1190,38 +1745,243 @@ class Zotero(object):
             a dict containing item data
             OR a list of dicts containing item data
         """
-        params = None
         if isinstance(payload, list):
-            params = {'collectionKey': ','.join([p['key'] for p in payload])}
-            modified = payload[0]['version']
-            url = self.endpoint + \
-            '/{t}/{u}/collections'.format(
-                t=self.library_type,
-                u=self.library_id)
-        else:
-            ident = payload['key']
-            modified = payload['version']
-            url = self.endpoint + \
-            '/{t}/{u}/collections/{c}'.format(
-                t=self.library_type,
-                u=self.library_id,
-                c=ident)
-        headers = {'If-Unmodified-Since-Version': modified}
+            self.delete_collections(payload)
+            return True
+        ident = payload['key']
+        modified = payload['version']
+        url = self._url('/{t}/{u}/collections/{c}', c=ident)
+        headers = {'If-Unmodified-Since-Version': '%s' % modified}
         headers.update(self.default_headers())
-        req = requests.delete(
-            url=url,
-            params=params,
+        self._request(
+            'DELETE',
+            url,
             headers=headers)
-
-        try:
-            req.raise_for_status()
-        except requests.exceptions.HTTPError:
-            error_handler(req)
         return True
 
+    def delete_items(self, payload, errors='raise', retries=3, version=None):
+        """
+        Delete any number of items, 50 at a time
+        Accepts a list of item dicts or item keys
+        Returns a list of per-batch results (see _delete_many)
+        """
+        return self._delete_many(
+            '/{t}/{u}/items', 'itemKey', ',',
+            [p['key'] if isinstance(p, dict) else p for p in payload],
+            errors, retries, version)
+
+    def delete_collections(self, payload, errors='raise', retries=3,
+                           version=None):
+        """
+        Delete any number of collections, 50 at a time
+        Accepts a list of collection dicts or collection keys
+        Returns a list of per-batch results (see _delete_many)
+        """
+        return self._delete_many(
+            '/{t}/{u}/collections', 'collectionKey', ',',
+            [p['key'] if isinstance(p, dict) else p for p in payload],
+            errors, retries, version)
+
+    def delete_tags(self, tags, errors='raise', retries=3, version=None):
+        """
+        Delete any number of tags from the library, 50 at a time
+        Accepts a list of tags
+        Returns a list of per-batch results (see _delete_many)
+        """
+        return self._delete_many(
+            '/{t}/{u}/tags', 'tag', ' || ', list(tags), errors, retries,
+            version)
+
+    def empty_trash(self, checkpoint=None, page=100, errors='raise',
+                    progress=None):
+        """
+        Permanently delete every item in the trash
+
+        Trashed item keys are retrieved a page at a time, and each page is
+        deleted before the next is retrieved, so memory use doesn't depend
+        on the size of the trash. If a checkpoint file path is passed,
+        progress is saved to it after every batch, and an interrupted run
+        resumes from it; it's removed when the trash is empty
+        If errors is 'skip', items which can't be deleted are recorded and
+        left in the trash; otherwise the first error is raised, once the
+        rest of its page has been deleted and saved. progress, if passed,
+        is called with the current state after every batch
+        Returns a dict: {'deleted': n, 'failed': [keys], 'version': v}
+        """
+        state = {'deleted': 0, 'failed': [], 'version': None}
+        if checkpoint and os.path.exists(checkpoint):
+            with open(checkpoint, 'r') as f:
+                state.update(json.load(f))
+
+        def save():
+            """ write the state to the checkpoint file """
+            if checkpoint:
+                temp = checkpoint + '.tmp'
+                with open(temp, 'w') as f:
+                    json.dump(state, f)
+                if os.path.exists(checkpoint):
+                    os.remove(checkpoint)
+                os.rename(temp, checkpoint)
+        failed = set(state['failed'])
+        start = len(failed)
+        while True:
+            # in order of addition, items which couldn't be deleted stay at
+            # the start of the trash, so skip past them
+            keys = split_keys(self.trash(
+                format='keys', limit=page, start=start,
+                sort='dateAdded', direction='asc'))
+            if not keys:
+                break
+            version = int(self.request.headers.get(
+                'Last-Modified-Version', 0)) or None
+            todo = [k for k in keys if k not in failed]
+            if not todo:
+                start += len(keys)
+                continue
+            error = None
+            for result in self.delete_items(
+                    todo, errors='skip', version=version):
+                if result['error'] is None:
+                    state['deleted'] += len(result['keys'])
+                    state['version'] = result['version']
+                elif errors == 'skip':
+                    state['failed'].extend(result['keys'])
+                    failed.update(result['keys'])
+                    start += len(result['keys'])
+                elif error is None:
+                    # later batches have been sent too, so record them
+                    # before raising
+                    error = result['error']
+                save()
+                if progress is not None:
+                    progress(state)
+            if error is not None:
+                raise error
+        if checkpoint and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        return state
+
+    def _delete_many(self, path, param, separator, values, errors, retries,
+                     version=None):
+        """
+        Delete objects in batches (see batches()), using a multi-object DELETE
+        request for each batch
+
+        The precondition for each batch is the library version, which is
+        retrieved once (unless it's passed), and then taken from each
+        response. Because every batch changes the library version, batches
+        are sent one at a time.
+        If another client modifies the library in the meantime (HTTP 412),
+        the library version is retrieved again, and the batch is retried,
+        up to retries times
+
+        Returns a list of dicts, one per batch, containing the batch's
+        'keys', the library 'version' after the batch, and the 'error'
+        raised by the batch, if any. If errors is 'raise', the first error
+        is raised; if it's 'skip', failed batches are recorded and skipped
+        """
+        url = self._url(path)
+        results = []
+        if not values:
+            return results
+        if version is None:
+            version = self._library_version()
+        for batch in batches(values, separator):
+            result = {'keys': batch, 'version': version, 'error': None}
+            for attempt in range(retries + 1):
+                headers = {'If-Unmodified-Since-Version': '%s' % version}
+                headers.update(self.default_headers())
+                try:
+                    req = self._request(
+                        'DELETE',
+                        url,
+                        params={param: separator.join(batch)},
+                        headers=headers)
+                except ze.PreConditionFailed as err:
+                    if attempt == retries:
+                        result['error'] = err
+                        break
+                    version = self._library_version()
+                    continue
+                except ze.PyZoteroError as err:
+                    result['error'] = err
+                    break
+                version = int(req.headers.get(
+                    'Last-Modified-Version', version))
+                result['version'] = version
+                break
+            if result['error'] is not None and errors != 'skip':
+                raise result['error']
+            results.append(result)
+        return results
+
+
+def export_page(fmt, page, out, separate):
+    """
+    Write a page of exported items to a binary file, separating it from
+    earlier pages if separate is True
+    Returns a (written, count) tuple: written is True if anything has been
+    written, including earlier pages, and count is the number of items on
+    this page, or None if they can't be counted in this format
+    """
+    if fmt == 'csljson':
+        items = page.json()['items']
+        body = ', '.join(json.dumps(i) for i in items).encode('utf-8')
+        separator = b', '
+        count = len(items)
+    else:
+        body = page.content.strip()
+        separator = b'\n\n'
+        count = len(RECORD_STARTS[fmt].findall(body)) \
+            if fmt in RECORD_STARTS else None
+    if not body:
+        return separate, 0
+    if separate:
+        out.write(separator)
+    out.write(body)
+    return True, count
+
+
+def split_keys(retrieved):
+    """ Split a format=keys response into a list of keys
+    """
+    return retrieved.split()
+
+
+def encoded_length(value):
+    """ Return the length of a string once encoded in a query string
+    """
+    return len(quote_plus(value.encode('utf-8'), safe=''))
+
+
+def batches(values, separator, size=50, length=4000):
+    """
+    Split a list of strings into lists of at most size strings, which
+    joined with separator are (if possible) at most length characters long
+    once percent-encoded, to keep URLs within server limits
+    """
+    sep = encoded_length(separator)
+    batch = []
+    joined = 0
+    for value in values:
+        value_length = encoded_length(value)
+        added = value_length + (sep if batch else 0)
+        if batch and (len(batch) == size or joined + added > length):
+            yield batch
+            batch = []
+            added = value_length
+            joined = 0
+        batch.append(value)
+        joined += added
+    if batch:
+        yield batch
+
 
 class Backoff(object):
-    """ a simple backoff timer for HTTP 429 responses """
+    """
+    An increasing backoff timer for retrying a request after HTTP 429
+    responses. Each request which is retried uses its own timer
+    """
     def __init__(self, delay=1):
         self.wait = delay
 
@@ -1236,11 +1996,36 @@ class Backoff(object):
         self.wait = 1
 
 
-backoff = Backoff()
-
-
-def error_handler(req):
+def retry_after(req):
+    """
+    Return the number of seconds a response's Retry-After or Backoff header
+    asks us to wait, or None if it has neither
+    """
+    for header in ('Retry-After', 'Backoff'):
+        value = req.headers.get(header)
+        if not value:
+            continue
+        try:
+            return max(float(value), 0)
+        except ValueError:
+            pass
+        # Retry-After may be an HTTP date
+        from email.utils import parsedate_tz, mktime_tz
+        parsed = parsedate_tz(value)
+        if parsed is not None:
+            return max(mktime_tz(parsed) - time.time(), 0)
+    return None
+
+
+def error_handler(req, metrics=None, resend=None, backoff=None):
     """ Error handler for HTTP requests
+    429 responses are retried after the delay the server asks for in a
+    Retry-After or Backoff header, or else an increasing delay, and the
+    successful response is returned. Optionally accepts a metrics.Metrics
+    instance, to record retries, and resend, a callable which sends the
+    request again and returns the new response (by default, req.request is
+    sent again using requests). backoff is the request's Backoff timer,
+    which is created for its first retry
     """
     error_codes = {
         400: ze.UnsupportedParams,
@@ -1268,19 +2053,40 @@ def error_handler(req):
         # check to see whether its 429
         if req.status_code == 429:
             # call our back-off function
+            if backoff is None:
+                backoff = Backoff()
             delay = backoff.delay
             if delay > 32:
-                # we've waited a total of 62 seconds (2 + 4 … + 32), so give up
-                backoff.reset()
+                # we've retried 5 times (waiting 2 + 4 … + 32 seconds, unless
+                # the server asked for other delays), so give up
                 raise ze.TooManyRetries("Continuing to receive HTTP 429 \
-responses after 62 seconds. You are being rate-limited, try again later")
+responses after 5 retries. You are being rate-limited, try again later")
+            requested = retry_after(req)
+            if requested is not None:
+                delay = requested
+            if metrics is not None:
+                metrics.retry(req.url, req.status_code, delay)
             time.sleep(delay)
-            sess = requests.Session()
-            new_req = sess.send(req.request)
-            try:
-                new_req.raise_for_status()
-            except requests.exceptions.HTTPError:
-                error_handler(new_req)
+            start = time.time()
+            if resend is None:
+                import requests
+                new_req = requests.Session().send(req.request, timeout=timeout)
+            else:
+                new_req = resend()
+            if metrics is not None:
+                metrics.request(
+                    new_req.request.method,
+                    new_req.url,
+                    new_req.status_code,
+                    time.time() - start,
+                    sent=len(new_req.request.body or b''),
+                    received=len(new_req.content),
+                    wire=wire_bytes(new_req),
+                    encoding=new_req.headers.get(
+                        'Content-Encoding', 'identity'))
+            if new_req.status_code >= 400:
+                return error_handler(new_req, metrics, resend, backoff)
+            return new_req
         else:
             raise error_codes.get(req.status_code)(err_msg(req))
     else:
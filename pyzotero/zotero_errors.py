@@ -140,3 +140,10 @@ class TooManyRetries(PyZoteroError):
     Raise after the backoff period for new requests exceeds 32s
     """
     pass
+
+
+class UnrecordedRequest(PyZoteroError):
+    """
+    Raised when a replaying transport has no recorded response for a request
+    """
+    pass
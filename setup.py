@@ -51,10 +51,18 @@ setup(
         'Operating System :: OS Independent',
         'Topic :: Software Development :: Libraries :: Python Modules',
     ],
-    packages=find_packages(),
-    install_requires=['feedparser >= 5.1.0', 'pytz', 'requests', 'six'],
+    packages=find_packages(
+        exclude=['bench', 'bench.*', 'test', 'test.*']),
+    install_requires=[
+        'feedparser >= 5.1.0',
+        'pytz',
+        'requests',
+        'six',
+        'futures; python_version < "3.2"'],
     extras_require={
-        'ordereddict': ['ordereddict==1.1']
+        'ordereddict': ['ordereddict==1.1'],
+        'http2': ['httpx[http2]'],
+        'redis': ['redis']
     },
     long_description="""\
 A Python wrapper for the Zotero Server v3 API
@@ -0,0 +1,180 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for buffered writes with Pyzotero
+
+This file is part of Pyzotero.
+
+Pyzotero is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pyzotero is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Pyzotero. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import json
+import unittest
+import httpretty
+from httpretty import HTTPretty
+from pyzotero.pyzotero import buffer as bu
+from pyzotero.pyzotero import zotero as z
+
+
+class WriteBufferTests(unittest.TestCase):
+    """ Tests for WriteBuffer
+    """
+    cwd = os.path.dirname(os.path.realpath(__file__))
+
+    def get_doc(self, doc_name, cwd=cwd):
+        """ return the requested test document """
+        with open(os.path.join(cwd, 'api_responses', '%s' % doc_name), 'r') as f:
+            return f.read()
+
+    def setUp(self):
+        """ Load items, and a Zotero instance
+        """
+        self.items_doc = self.get_doc('items_doc.json')
+        self.items = json.loads(self.items_doc)
+        self.zot = z.Zotero('myuserID', 'user', 'myuserkey')
+        self.url = 'https://api.zotero.org/users/myuserID/items'
+        # payloads received by the write endpoint
+        self.sent = []
+        HTTPretty.enable()
+
+    def tearDown(self):
+        """ Tear stuff down
+        """
+        HTTPretty.disable()
+        HTTPretty.reset()
+
+    def written(self, version=2, failed=None):
+        """ Return a callback which records a write request's payload, and
+            responds to it
+        """
+        def respond(request, uri, headers):
+            payload = json.loads(request.body.decode('utf-8'))
+            self.sent.append(payload)
+            resp = {'success': {}, 'successful': {}, 'unchanged': {},
+                    'failed': {}}
+            for idx, obj in enumerate(payload):
+                pos = '%s' % idx
+                if failed and obj['key'] in failed:
+                    resp['failed'][pos] = {
+                        'key': obj['key'], 'code': failed[obj['key']],
+                        'message': 'Failed'}
+                    continue
+                resp['success'][pos] = obj['key']
+                resp['successful'][pos] = {
+                    'key': obj['key'], 'version': version}
+            return (200, headers, json.dumps(resp))
+        return respond
+
+    def testCoalescedBatches(self):
+        """ Many mutations should be sent as one request per 50 items,
+            containing only changed fields
+        """
+        HTTPretty.register_uri(
+            HTTPretty.POST, self.url,
+            content_type='application/json',
+            body=self.written())
+        buf = bu.WriteBuffer(self.zot, max_items=15)
+        for item in self.items:
+            buf.add_tags(item, 'one', 'two')
+            buf.add_tags(item, 'two', 'three')
+            buf.addto_collection('abcd2345', item)
+            buf.update(item, extra='Edited')
+        # the first 15 items are written as soon as they're pending
+        self.assertEqual(1, len(self.sent))
+        self.assertEqual(5, len(buf))
+        buf.flush()
+        self.assertEqual(2, len(self.sent))
+        self.assertEqual(0, len(buf))
+        sent = self.sent[-1]
+        self.assertEqual(5, len(sent))
+        self.assertEqual(
+            set(['key', 'version', 'tags', 'collections', 'extra']),
+            set(sent[0]))
+        self.assertEqual(
+            [t['tag'] for t in self.items[15]['data']['tags']] +
+            ['one', 'two', 'three'],
+            [t['tag'] for t in sent[0]['tags']])
+        self.assertEqual(
+            self.items[15]['data']['collections'] + ['ABCD2345'],
+            sent[0]['collections'])
+        # later mutations start from the written version
+        self.assertEqual(2, buf.written[self.items[0]['key']]['version'])
+        buf.remove_tags(self.items[0], 'one')
+        buf.flush()
+        self.assertEqual(
+            [{'key': self.items[0]['key'], 'version': 2,
+              'tags': [{'tag': 'two'}, {'tag': 'three'}]}],
+            self.sent[-1])
+
+    def testConflictsAreRetried(self):
+        """ Items modified on the server should be retrieved again, and
+            their mutations reapplied
+        """
+        item = self.items[0]
+        current = json.loads(json.dumps(item))
+        current['version'] = 5
+        current['data']['version'] = 5
+        current['data']['tags'] = [{'tag': 'theirs'}]
+        HTTPretty.register_uri(
+            HTTPretty.POST, self.url,
+            content_type='application/json',
+            responses=[
+                httpretty.Response(
+                    body=self.written(failed={item['key']: 412})),
+                httpretty.Response(body=self.written(version=6))])
+        HTTPretty.register_uri(
+            HTTPretty.GET, self.url,
+            content_type='application/json',
+            body=json.dumps([current]))
+        with bu.WriteBuffer(self.zot) as buf:
+            buf.add_tags(item, 'mine')
+        self.assertEqual(2, len(self.sent))
+        refetch = [r for r in HTTPretty.latest_requests if r.method == 'GET']
+        self.assertEqual([item['key']], refetch[0].querystring['itemKey'])
+        self.assertEqual(5, self.sent[-1][0]['version'])
+        self.assertEqual(
+            [{'tag': 'theirs'}, {'tag': 'mine'}], self.sent[-1][0]['tags'])
+        self.assertEqual(6, buf.written[item['key']]['version'])
+
+    def testUnresolvedConflicts(self):
+        """ Conflicts should raise once retries are exhausted, and other
+            failures should be recorded
+        """
+        HTTPretty.register_uri(
+            HTTPretty.POST, self.url,
+            content_type='application/json',
+            body=self.written(failed={
+                self.items[0]['key']: 412, self.items[1]['key']: 400}))
+        HTTPretty.register_uri(
+            HTTPretty.GET, self.url,
+            content_type='application/json',
+            body=json.dumps(self.items[:1]))
+        buf = bu.WriteBuffer(self.zot, retries=1)
+        buf.update(self.items[0], extra='Edited')
+        buf.update(self.items[1], extra='Edited')
+        with self.assertRaises(z.ze.PreConditionFailed) as raised:
+            buf.flush()
+        self.assertEqual([self.items[0]['key']], raised.exception.keys)
+        self.assertEqual([self.items[1]['key']], list(buf.failed))
+        # or recorded as failures
+        buf = bu.WriteBuffer(self.zot, retries=1, errors='skip')
+        buf.update(self.items[0], extra='Edited')
+        buf.flush()
+        self.assertEqual(412, buf.failed[self.items[0]['key']]['code'])
+        self.assertEqual(0, len(buf))
+
+
+if __name__ == "__main__":
+    unittest.main()
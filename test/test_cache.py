@@ -0,0 +1,120 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for Pyzotero's shared cache backends
+
+This file is part of Pyzotero.
+
+Pyzotero is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pyzotero is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Pyzotero. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from httpretty import HTTPretty
+from pyzotero.pyzotero import cache as ca
+from pyzotero.pyzotero import zotero as z
+
+
+class CacheTests(unittest.TestCase):
+    """ Tests for cache backends, and their use by Zotero instances
+    """
+    cwd = os.path.dirname(os.path.realpath(__file__))
+
+    def get_doc(self, doc_name, cwd=cwd):
+        """ return the requested test document """
+        with open(os.path.join(cwd, 'api_responses', '%s' % doc_name), 'r') as f:
+            return f.read()
+
+    def setUp(self):
+        """ Serve items and item types
+        """
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'cache.db')
+        base = 'https://api.zotero.org'
+        HTTPretty.enable()
+        HTTPretty.register_uri(
+            HTTPretty.GET,
+            base + '/itemTypes',
+            body=self.get_doc('item_types.json'))
+        HTTPretty.register_uri(
+            HTTPretty.GET,
+            base + '/users/myuserID/items/top',
+            content_type='application/json',
+            adding_headers={'Last-Modified-Version': '10'},
+            body=self.get_doc('items_doc.json'))
+        HTTPretty.register_uri(
+            HTTPretty.HEAD,
+            base + '/users/myuserID/items/top',
+            adding_headers={'Last-Modified-Version': '10', 'Total-Results': '2'},
+            body='')
+
+    def tearDown(self):
+        """ Tear stuff down
+        """
+        HTTPretty.disable()
+        HTTPretty.reset()
+        shutil.rmtree(self.tmp)
+
+    def testBackends(self):
+        """ Values should be stored, retrieved, expired and removed
+        """
+        for cache in (ca.MemoryCache(), ca.SQLiteCache(self.path)):
+            cache.set('a', {'tmplt': [1, 2]})
+            cache.set_many({'b': 'B', 'c': ('C',)})
+            self.assertEqual({'tmplt': [1, 2]}, cache.get('a'))
+            self.assertEqual(
+                {'b': 'B', 'c': ('C',)}, cache.get_many(['b', 'c', 'd']))
+            self.assertIsNone(cache.get('d'))
+            cache.delete('a')
+            self.assertIsNone(cache.get('a'))
+            cache.ttl = -1
+            cache.set('e', 'E')
+            self.assertIsNone(cache.get('e'))
+            cache.clear()
+            self.assertEqual({}, cache.get_many(['b', 'c']))
+        view = ca.Namespace(ca.MemoryCache(), 'templates:')
+        view['item_types'] = 'types'
+        self.assertEqual('types', view['item_types'])
+        self.assertIn('item_types', view)
+        self.assertEqual('default', view.get('missing', 'default'))
+        with self.assertRaises(KeyError):
+            view['missing']
+
+    def testSharedBetweenInstances(self):
+        """ Templates and memoized results retrieved by one Zotero instance
+            should be reused by others sharing its cache
+        """
+        first = z.Zotero(
+            'myuserID', 'user', 'myuserkey', memoize=60,
+            cache=ca.SQLiteCache(self.path))
+        types = first.item_types()
+        items = first.top(limit=1)
+        self.assertEqual(2, len(HTTPretty.latest_requests))
+        # another process, opening the same database
+        second = z.Zotero(
+            'myuserID', 'user', 'myuserkey', memoize=60,
+            cache=ca.SQLiteCache(self.path))
+        self.assertEqual(types, second.item_types())
+        self.assertEqual(items, second.top(limit=1))
+        # only a version check, to see whether the results are current
+        self.assertEqual(3, len(HTTPretty.latest_requests))
+        self.assertEqual('HEAD', HTTPretty.last_request.method)
+        self.assertEqual(
+            '10', second.request.headers['Last-Modified-Version'])
+
+
+if __name__ == "__main__":
+    unittest.main()
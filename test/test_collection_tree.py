@@ -0,0 +1,234 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for collection tree operations with Pyzotero
+
+This file is part of Pyzotero.
+
+Pyzotero is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pyzotero is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Pyzotero. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import re
+import json
+import unittest
+from httpretty import HTTPretty
+from pyzotero.pyzotero import collection_tree as ct
+from pyzotero.pyzotero import zotero as z
+
+
+class CollectionTreeTests(unittest.TestCase):
+    """ Tests for moving and copying collection trees, against a fake
+        library
+    """
+    def setUp(self):
+        """ Serve a library of a tree of collections, with items in some of
+            them: ROOT0000 has 60 subcollections, each with one of its own
+        """
+        self.version = 1
+        self.collections = {}
+        self.items = {}
+        self.writes = []
+        # objects which are modified again before every write
+        self.conflicting = set()
+        # if set, each page of collections is rate-limited once, and its
+        # start recorded here
+        self.limited = None
+        self.collection('ROOT0000', 'Root', False)
+        self.collection('OTHER000', 'Other', False)
+        for n in range(60):
+            self.collection('SUB%05d' % n, 'Sub %s' % n, 'ROOT0000')
+            self.collection('LEAF%04d' % n, 'Leaf %s' % n, 'SUB%05d' % n)
+        for n in range(80):
+            self.items['ITEM%04d' % n] = {
+                'key': 'ITEM%04d' % n, 'version': 1,
+                'data': {'key': 'ITEM%04d' % n, 'version': 1,
+                         'itemType': 'book', 'title': 'Book %s' % n,
+                         'collections': ['LEAF%04d' % (n % 60)]}}
+        self.items['ITEM0000']['data']['collections'].append('ROOT0000')
+        self.zot = z.Zotero('myuserID', 'user', 'myuserkey')
+        base = 'https://api.zotero.org/users/myuserID'
+        HTTPretty.enable()
+        for method in (HTTPretty.GET, HTTPretty.POST):
+            HTTPretty.register_uri(
+                method, base + '/collections', body=self.respond_collections)
+            HTTPretty.register_uri(
+                method, base + '/items', body=self.respond_items)
+        HTTPretty.register_uri(
+            HTTPretty.GET, re.compile(r'.*/collections/\w+/items'),
+            body=self.respond_keys)
+
+    def tearDown(self):
+        """ Tear stuff down
+        """
+        HTTPretty.disable()
+        HTTPretty.reset()
+
+    def collection(self, key, name, parent):
+        """ Add a collection to the library """
+        self.collections[key] = {
+            'key': key, 'version': self.version,
+            'data': {'key': key, 'version': self.version, 'name': name,
+                     'parentCollection': parent, 'relations': {}}}
+
+    def write(self, request, store, create):
+        """ Create or update a batch of objects """
+        payload = json.loads(request.body.decode('utf-8'))
+        self.writes.append((request.path.split('?')[0], payload))
+        self.version += 1
+        resp = {'successful': {}, 'failed': {}}
+        for pos, obj in enumerate(payload):
+            if 'key' not in obj:
+                key = 'NEW%05d' % len(self.collections)
+                create(key, obj['name'], obj['parentCollection'])
+            elif store[obj['key']]['version'] != obj['version'] or \
+                    obj['key'] in self.conflicting:
+                resp['failed']['%s' % pos] = {
+                    'key': obj['key'], 'code': 412, 'message': 'Changed'}
+                continue
+            else:
+                key = obj['key']
+                store[key]['data'].update(obj)
+            store[key]['version'] = self.version
+            store[key]['data']['version'] = self.version
+            resp['successful']['%s' % pos] = store[key]
+        return json.dumps(resp)
+
+    def respond_collections(self, request, uri, headers):
+        """ Serve pages of collections, or create and update them """
+        headers['Content-Type'] = 'application/json'
+        if request.method == 'POST':
+            return (200, headers, self.write(
+                request, self.collections, self.collection))
+        start = int(request.querystring['start'][0])
+        limit = int(request.querystring['limit'][0])
+        if self.limited is not None and start not in self.limited:
+            self.limited.add(start)
+            return (429, headers, '')
+        headers['Total-Results'] = '%s' % len(self.collections)
+        return (200, headers, json.dumps(
+            [self.collections[k]
+             for k in sorted(self.collections)[start:start + limit]]))
+
+    def respond_items(self, request, uri, headers):
+        """ Retrieve items by key, or update them """
+        headers['Content-Type'] = 'application/json'
+        if request.method == 'POST':
+            return (200, headers, self.write(request, self.items, None))
+        keys = request.querystring['itemKey'][0].split(',')
+        return (200, headers, json.dumps(
+            [self.items[k] for k in keys if k in self.items]))
+
+    def respond_keys(self, request, uri, headers):
+        """ Serve the keys of a collection's items """
+        collection = request.path.split('/')[-2]
+        return (200, headers, '\n'.join(
+            k for k in sorted(self.items)
+            if collection in self.items[k]['data']['collections']))
+
+    def testFetchTree(self):
+        """ Every page of collections should be retrieved
+        """
+        graph = ct.fetch_tree(self.zot)
+        self.assertEqual(122, len(graph.collections))
+        self.assertEqual(2, len(HTTPretty.latest_requests))
+        levels = ct.levels(graph, 'root0000')
+        self.assertEqual([1, 60, 60], [len(level) for level in levels])
+
+    def testFetchTreeRetried(self):
+        """ Concurrent page requests which are each rate-limited once should
+            all be retried after the first delay
+        """
+        self.limited = set()
+        slept = []
+        sleep = z.time.sleep
+        z.time.sleep = slept.append
+        try:
+            found = ct.fetch_collections(self.zot, workers=8, limit=15)
+        finally:
+            z.time.sleep = sleep
+        self.assertEqual(
+            sorted(self.collections), sorted(c['key'] for c in found))
+        self.assertEqual([2] * 9, slept)
+
+    def testMove(self):
+        """ Moving a subtree should change only its root's parent, in one
+            request, and a collection can't be moved below itself
+        """
+        graph = ct.fetch_tree(self.zot)
+        self.assertTrue(ct.move_collection(
+            self.zot, 'ROOT0000', parent='OTHER000', graph=graph))
+        self.assertEqual(
+            [('/users/myuserID/collections',
+              [{'key': 'ROOT0000', 'version': 1,
+                'parentCollection': 'OTHER000'}])], self.writes)
+        self.assertEqual(
+            'OTHER000',
+            self.collections['ROOT0000']['data']['parentCollection'])
+        self.assertEqual(
+            ['ROOT0000', 'OTHER000'], graph.ancestors('LEAF0007')[1:])
+        with self.assertRaises(z.ze.UnsupportedParams):
+            ct.move_collection(
+                self.zot, 'OTHER000', parent='LEAF0007', graph=graph)
+        # moving it back uses the version the graph has been updated with
+        ct.move_collection(self.zot, 'ROOT0000', graph=graph)
+        self.assertFalse(
+            self.collections['ROOT0000']['data']['parentCollection'])
+
+    def testCopy(self):
+        """ Copies should be created a level at a time, and items added to
+            them with batched item updates
+        """
+        result = ct.copy_collection(
+            self.zot, 'ROOT0000', parent='OTHER000', name='Copy')
+        self.assertEqual({}, result['failed'])
+        self.assertEqual(121, len(result['collections']))
+        self.assertEqual(80, result['items'])
+        self.assertEqual(243, len(self.collections))
+        created = [
+            p for path, p in self.writes if path.endswith('/collections')]
+        self.assertEqual([1, 50, 10, 50, 10], [len(p) for p in created])
+        self.assertEqual(
+            {'name': 'Copy', 'parentCollection': 'OTHER000'}, created[0][0])
+        updates = [p for path, p in self.writes if path.endswith('/items')]
+        self.assertEqual([50, 30], [len(p) for p in updates])
+        copies = result['collections']
+        leaf = self.collections[copies['LEAF0007']]['data']
+        self.assertEqual('Leaf 7', leaf['name'])
+        self.assertEqual(copies['SUB00007'], leaf['parentCollection'])
+        self.assertEqual(
+            ['LEAF0000', 'ROOT0000', copies['ROOT0000'], copies['LEAF0000']],
+            self.items['ITEM0000']['data']['collections'])
+        self.assertEqual(
+            ['LEAF0007', copies['LEAF0007']],
+            self.items['ITEM0067']['data']['collections'])
+
+    def testCopyConflicts(self):
+        """ Items which keep conflicting should be recorded as failures,
+            and the rest added to the copies
+        """
+        self.conflicting.add('ITEM0007')
+        result = ct.copy_collection(self.zot, 'SUB00007', retries=1)
+        self.assertEqual(['ITEM0007'], list(result['failed']))
+        self.assertEqual(412, result['failed']['ITEM0007']['code'])
+        self.assertEqual(1, result['items'])
+        result = ct.copy_collection(self.zot, 'ROOT0000', retries=1)
+        self.assertEqual(['ITEM0007'], list(result['failed']))
+        self.assertEqual(79, result['items'])
+        self.assertIn(
+            result['collections']['LEAF0007'],
+            self.items['ITEM0067']['data']['collections'])
+
+
+if __name__ == "__main__":
+    unittest.main()
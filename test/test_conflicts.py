@@ -0,0 +1,167 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for write conflict resolution with Pyzotero
+
+This file is part of Pyzotero.
+
+Pyzotero is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pyzotero is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Pyzotero. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import json
+import unittest
+import httpretty
+from httpretty import HTTPretty
+from pyzotero.pyzotero import conflicts as co
+from pyzotero.pyzotero import zotero as z
+
+
+class ResolverTests(unittest.TestCase):
+    """ Tests for conflict resolution
+    """
+    cwd = os.path.dirname(os.path.realpath(__file__))
+
+    def get_doc(self, doc_name, cwd=cwd):
+        """ return the requested test document """
+        with open(os.path.join(cwd, 'api_responses', '%s' % doc_name), 'r') as f:
+            return f.read()
+
+    def setUp(self):
+        """ Load an item, and the version another writer has saved
+        """
+        self.item_doc = self.get_doc('item_doc.json')
+        self.item = json.loads(self.item_doc)
+        self.key = self.item['key']
+        self.url = 'https://api.zotero.org/users/myuserID/items/%s' % self.key
+        theirs = json.loads(self.item_doc)
+        theirs['version'] = theirs['data']['version'] = 99
+        theirs['data']['title'] = 'Their title'
+        theirs['data']['tags'] = [{'tag': 'theirs'}]
+        self.theirs = theirs
+        HTTPretty.enable()
+
+    def tearDown(self):
+        """ Tear stuff down
+        """
+        HTTPretty.disable()
+        HTTPretty.reset()
+
+    def testMerge(self):
+        """ Fields changed by one side keep that change, and fields changed
+            by both are resolved by policy, or merged as sets
+        """
+        base = {'title': 'a', 'date': '2000', 'extra': '',
+                'tags': [{'tag': 'x'}, {'tag': 'y'}],
+                'collections': ['ONE']}
+        ours = dict(base, title='b', extra='ours',
+                    tags=[{'tag': 'x'}, {'tag': 'mine'}],
+                    collections=['ONE', 'TWO'])
+        theirs = dict(base, date='2001', extra='theirs',
+                      tags=[{'tag': 'x'}, {'tag': 'y'}, {'tag': 'theirs'}],
+                      collections=[])
+        merged = co.Resolver().merge(base, ours, theirs)
+        self.assertEqual('b', merged['title'])
+        self.assertEqual('2001', merged['date'])
+        self.assertEqual('ours', merged['extra'])
+        self.assertEqual(
+            [{'tag': 'x'}, {'tag': 'theirs'}, {'tag': 'mine'}],
+            merged['tags'])
+        self.assertEqual(['TWO'], merged['collections'])
+        resolver = co.Resolver(policies={
+            'extra': lambda field, b, o, t: o + t})
+        self.assertEqual(
+            'ourstheirs', resolver.merge(base, ours, theirs)['extra'])
+        self.assertEqual(
+            'theirs',
+            co.Resolver(policy='theirs').merge(base, ours, theirs)['extra'])
+        with self.assertRaises(z.ze.PreConditionFailed):
+            co.Resolver(policy='raise').merge(base, ours, theirs)
+
+    def testUpdateItemConflict(self):
+        """ A 412 response should be resolved by merging our changes into
+            the current version, and retrying
+        """
+        zot = z.Zotero(
+            'myuserID', 'user', 'myuserkey',
+            resolver=co.Resolver(delay=0))
+        HTTPretty.register_uri(
+            HTTPretty.GET,
+            self.url,
+            responses=[
+                httpretty.Response(
+                    body=self.item_doc, content_type='application/json'),
+                httpretty.Response(
+                    body=json.dumps(self.theirs),
+                    content_type='application/json')])
+        HTTPretty.register_uri(
+            HTTPretty.GET,
+            'https://api.zotero.org/itemFields',
+            content_type='application/json',
+            body=json.dumps(
+                [{'field': f} for f in self.item['data']]))
+        HTTPretty.register_uri(
+            HTTPretty.PUT,
+            self.url,
+            responses=[
+                httpretty.Response(body='', status=412),
+                httpretty.Response(
+                    body='', status=204,
+                    adding_headers={'Last-Modified-Version': '100'})])
+        ours = zot.item(self.key)
+        ours['data']['extra'] = 'Our change'
+        ours['data']['tags'].append({'tag': 'mine'})
+        self.assertTrue(zot.update_item(ours))
+        self.assertEqual(
+            '99',
+            HTTPretty.last_request.headers['If-Unmodified-Since-Version'])
+        sent = json.loads(HTTPretty.last_request.body.decode('utf-8'))
+        self.assertEqual('Their title', sent['title'])
+        self.assertEqual('Our change', sent['extra'])
+        self.assertEqual(
+            [{'tag': 'theirs'}, {'tag': 'mine'}], sent['tags'])
+        self.assertEqual(100, zot.resolver.seen[self.key][0])
+
+    def testDeleteConflict(self):
+        """ Deletes should be retried with the current library version,
+            unless the delete policy is 'raise'
+        """
+        zot = z.Zotero(
+            'myuserID', 'user', 'myuserkey',
+            resolver=co.Resolver(delay=0))
+        HTTPretty.register_uri(
+            HTTPretty.HEAD,
+            'https://api.zotero.org/users/myuserID/items/top',
+            adding_headers={
+                'Last-Modified-Version': '120', 'Total-Results': '1'},
+            body='')
+        HTTPretty.register_uri(
+            HTTPretty.DELETE,
+            self.url,
+            responses=[
+                httpretty.Response(body='', status=412),
+                httpretty.Response(body='', status=204)])
+        self.assertTrue(zot.delete_item(self.item))
+        self.assertEqual(
+            '120',
+            HTTPretty.last_request.headers['If-Unmodified-Since-Version'])
+        HTTPretty.register_uri(
+            HTTPretty.DELETE, self.url, body='', status=412)
+        zot.resolver.delete = 'raise'
+        with self.assertRaises(z.ze.PreConditionFailed):
+            zot.delete_item(self.item)
+
+
+if __name__ == "__main__":
+    unittest.main()
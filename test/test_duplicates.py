@@ -0,0 +1,169 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for duplicate detection with Pyzotero
+
+This file is part of Pyzotero.
+
+Pyzotero is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pyzotero is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Pyzotero. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import copy
+import json
+import unittest
+from httpretty import HTTPretty
+from pyzotero.pyzotero import duplicates as du
+from pyzotero.pyzotero import zotero as z
+
+
+def item(key, title, date='', creator=None, added='2011-01-01', **fields):
+    """ Return a minimal item dict """
+    data = dict(
+        key=key, version=1, itemType='journalArticle', title=title,
+        date=date, creators=[{'lastName': creator}] if creator else [],
+        dateAdded=added, tags=[], collections=[], relations={}, **fields)
+    return {'key': key, 'version': 1, 'meta': {'numChildren': 0},
+            'data': data}
+
+
+class DuplicateTests(unittest.TestCase):
+    """ Tests for DuplicateFinder
+    """
+    cwd = os.path.dirname(os.path.realpath(__file__))
+
+    def get_doc(self, doc_name, cwd=cwd):
+        """ return the requested test document """
+        with open(os.path.join(cwd, 'api_responses', '%s' % doc_name), 'r') as f:
+            return f.read()
+
+    def setUp(self):
+        """ The items fixture, with some duplicates added
+        """
+        self.items = json.loads(self.get_doc('items_doc.json'))
+        self.items.extend([
+            item('DUPA0001', 'The Structure of Scientific Revolutions',
+                 '1962', 'Kuhn', added='2012-01-01'),
+            item('DUPA0002', 'The structure of scientific revolutions.',
+                 'March 1962', 'Kuhn', added='2010-01-01'),
+            item('DUPA0003', 'Structure of Scientific Revolution',
+                 '1962', 'Kuhn', added='2013-01-01', url='http://example.com'),
+            # a different edition
+            item('DUPA0004', 'The Structure of Scientific Revolutions',
+                 '1970', 'Kuhn'),
+            item('DUPB0001', 'A short title', DOI='10.1000/XYZ123'),
+            item('DUPB0002', 'Completely different',
+                 extra='DOI: https://doi.org/10.1000/xyz123'),
+            item('DUPC0001', 'Thinking about duplicates',
+                 DOI='10.1000/one'),
+            item('DUPC0002', 'Thinking about duplicates',
+                 DOI='10.1000/two'),
+        ])
+        self.finder = du.DuplicateFinder(iter(self.items))
+
+    def testNormalisation(self):
+        """ Identifiers should be normalised, so that equal ones match
+        """
+        self.assertEqual(
+            '10.1000/xyz123',
+            du.normalise_doi('https://doi.org/10.1000/XYZ123.'))
+        self.assertEqual(
+            ('9780198526636', '9780262510875'),
+            du.normalise_isbns('0-19-852663-6 978-0-262-51087-5 0198526636'))
+
+    def testClusters(self):
+        """ Duplicates should be clustered with the oldest item first, in
+            one process or several
+        """
+        expected = [
+            ['DUPA0002', 'DUPA0001', 'DUPA0003'],
+            ['DUPB0001', 'DUPB0002']]
+        self.assertEqual(expected, self.finder.clusters())
+        self.assertEqual(expected, self.finder.clusters(processes=2, chunk=1))
+        self.finder.remove('DUPB0002')
+        self.assertEqual(expected[:1], self.finder.clusters())
+        # notes and attachments are never duplicates
+        note = item('NOTE0001', '')
+        note['data']['itemType'] = 'note'
+        self.finder.add(note)
+        self.assertNotIn('NOTE0001', self.finder)
+
+    def testMerge(self):
+        """ Duplicates should be merged into the oldest item of a cluster,
+            with their children, and deleted
+        """
+        base = 'https://api.zotero.org/users/myuserID/items'
+        items = dict((i['key'], copy.deepcopy(i)) for i in self.items)
+        items['DUPA0001']['meta']['numChildren'] = 1
+        items['DUPA0001']['data']['tags'] = [{'tag': 'physics'}]
+        items['DUPA0001']['data']['collections'] = ['COLL0001']
+        child = item('CHILD001', '')
+        child['data'].update(itemType='note', parentItem='DUPA0001')
+        sent = []
+        deleted = []
+
+        def listing(request, uri, headers):
+            """ answer itemKey requests, and record writes """
+            headers['Content-Type'] = 'application/json'
+            if request.method == 'POST':
+                payload = json.loads(request.body.decode('utf-8'))
+                sent.extend(payload)
+                return (200, headers, json.dumps({
+                    'successful': dict(
+                        ('%s' % pos, {'key': p['key'], 'version': 2})
+                        for pos, p in enumerate(payload)),
+                    'failed': {}}))
+            if request.method == 'DELETE':
+                deleted.extend(request.querystring['itemKey'][0].split(','))
+                return (204, headers, '')
+            keys = request.querystring['itemKey'][0].split(',')
+            return (200, headers, json.dumps(
+                [items[k] for k in keys if k in items]))
+
+        HTTPretty.enable()
+        try:
+            for method in (HTTPretty.GET, HTTPretty.POST, HTTPretty.DELETE):
+                HTTPretty.register_uri(method, base, body=listing)
+            HTTPretty.register_uri(
+                HTTPretty.HEAD, base + '/top',
+                adding_headers={
+                    'Total-Results': '1', 'Last-Modified-Version': '2'},
+                body='')
+            HTTPretty.register_uri(
+                HTTPretty.GET, base + '/DUPA0001/children',
+                content_type='application/json', body=json.dumps([child]))
+            zot = z.Zotero('myuserID', 'user', 'myuserkey')
+            clusters = self.finder.clusters()[:1]
+            result = self.finder.merge(zot, clusters)
+        finally:
+            HTTPretty.disable()
+            HTTPretty.reset()
+        self.assertEqual(['DUPA0002'], result['merged'])
+        self.assertEqual(['DUPA0001', 'DUPA0003'], result['deleted'])
+        self.assertEqual(['DUPA0001', 'DUPA0003'], deleted)
+        written = dict((p['key'], p) for p in sent)
+        master = written['DUPA0002']
+        self.assertEqual([{'tag': 'physics'}], master['tags'])
+        self.assertEqual(['COLL0001'], master['collections'])
+        self.assertEqual('http://example.com', master['url'])
+        self.assertEqual(
+            ['http://zotero.org/users/myuserID/items/DUPA0001',
+             'http://zotero.org/users/myuserID/items/DUPA0003'],
+            master['relations']['dc:replaces'])
+        self.assertEqual('DUPA0002', written['CHILD001']['parentItem'])
+        self.assertNotIn('DUPA0001', self.finder)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,154 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the Pyzotero library graph
+
+This file is part of Pyzotero.
+
+Pyzotero is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pyzotero is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Pyzotero. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import copy
+import json
+import unittest
+import httpretty
+from httpretty import HTTPretty
+from pyzotero.pyzotero import graph as g
+from pyzotero.pyzotero import zotero as z
+
+
+class LibraryGraphTests(unittest.TestCase):
+    """ Tests for the in-memory library graph
+    """
+    cwd = os.path.dirname(os.path.realpath(__file__))
+
+    def get_doc(self, doc_name, cwd=cwd):
+        """ return the requested test document """
+        with open(os.path.join(cwd, 'api_responses', '%s' % doc_name), 'r') as f:
+            return f.read()
+
+    def setUp(self):
+        """ Build a graph from the collections and items fixtures, plus a
+            child note
+        """
+        self.collections_doc = self.get_doc('collections_doc.json')
+        self.items_doc = self.get_doc('items_doc.json')
+        self.items = json.loads(self.items_doc)
+        self.note = {
+            'key': 'NOTE0001',
+            'version': 2,
+            'data': {
+                'key': 'NOTE0001',
+                'itemType': 'note',
+                'note': '<p>Elementary</p>',
+                'parentItem': 'Z8N84QAJ',
+                'tags': [{'tag': 'Fiction'}],
+                'collections': []}}
+        self.graph = g.LibraryGraph(
+            json.loads(self.collections_doc), self.items + [self.note])
+
+    def testCollectionTree(self):
+        """ Subcollections and ancestors should follow parentCollection
+        """
+        self.assertEqual(
+            ['TVPC4XK4'],
+            [c['key'] for c in self.graph.collections_sub('qm6t3khx')])
+        self.assertEqual(['QM6T3KHX'], self.graph.ancestors('TVPC4XK4'))
+        self.assertNotIn(
+            'TVPC4XK4', [c['key'] for c in self.graph.top_collections()])
+        # move the subcollection under another subcollection
+        moved = copy.deepcopy(self.graph.collections['TVPC4XK4'])
+        moved['data']['parentCollection'] = 'M7MNCCXU'
+        self.graph.update_collections(moved)
+        self.assertEqual([], self.graph.collections_sub('QM6T3KHX'))
+        self.assertEqual(
+            ['M7MNCCXU', 'N7W92H48'], self.graph.ancestors('TVPC4XK4'))
+        self.assertEqual(
+            set(['M7MNCCXU', 'TVPC4XK4']),
+            set(self.graph.descendants('N7W92H48')))
+
+    def testCyclicCollections(self):
+        """ Collections whose parents form a cycle shouldn't be followed
+            round it forever
+        """
+        cyclic = copy.deepcopy(self.graph.collections['QM6T3KHX'])
+        cyclic['data']['parentCollection'] = 'TVPC4XK4'
+        self.graph.update_collections(cyclic)
+        self.assertEqual(['QM6T3KHX'], self.graph.ancestors('TVPC4XK4'))
+        self.assertEqual(['TVPC4XK4'], self.graph.ancestors('QM6T3KHX'))
+        self.assertEqual(['TVPC4XK4'], self.graph.descendants('QM6T3KHX'))
+
+    def testChildrenTagsAndMembers(self):
+        """ Children, tag and collection lookups shouldn't need the API
+        """
+        self.assertEqual(
+            ['NOTE0001'],
+            [c['key'] for c in self.graph.children('z8n84qaj')])
+        self.assertEqual(
+            set(['Z8N84QAJ', 'NOTE0001']),
+            set(i['key'] for i in self.graph.tag_items('Fiction')))
+        self.assertEqual(
+            ['6MCAN2NC'],
+            [i['key'] for i in self.graph.collection_items('TVPC4XK4')])
+        self.assertEqual(
+            1, len(self.graph.collection_items('QM6T3KHX')))
+        self.assertEqual(20, self.graph.num_collectionitems('9KH9TNSJ'))
+        self.assertIn('Murder', self.graph.item_tags('PG5ZCTJT'))
+
+    def testIncrementalItemChanges(self):
+        """ Updating or removing items should update every index
+        """
+        note = copy.deepcopy(self.note)
+        note['data']['tags'] = [{'tag': 'Deduction'}]
+        note['data']['parentItem'] = 'PG5ZCTJT'
+        self.graph.update_items(note)
+        self.assertEqual([], self.graph.children('Z8N84QAJ'))
+        self.assertEqual(1, len(self.graph.children('PG5ZCTJT')))
+        self.assertEqual(1, self.graph.num_tagitems('Fiction'))
+        self.graph.remove_items(['NOTE0001'])
+        self.assertEqual([], self.graph.children('PG5ZCTJT'))
+        self.assertNotIn('Deduction', self.graph.tags())
+
+    def testUnknownCollection(self):
+        """ Unknown collections should raise ResourceNotFound
+        """
+        with self.assertRaises(z.ze.ResourceNotFound):
+            self.graph.collections_sub('NOPE1234')
+
+    @httpretty.activate
+    def testFromLibrary(self):
+        """ Build a graph using one collections and one items retrieval
+        """
+        zot = z.Zotero('myuserID', 'user', 'myuserkey')
+        HTTPretty.register_uri(
+            HTTPretty.GET,
+            'https://api.zotero.org/users/myuserID/collections',
+            content_type='application/json',
+            body=self.collections_doc)
+        HTTPretty.register_uri(
+            HTTPretty.GET,
+            'https://api.zotero.org/users/myuserID/items',
+            content_type='application/json',
+            adding_headers={'Last-Modified-Version': '1234'},
+            body=self.items_doc)
+        graph = g.LibraryGraph.from_library(zot)
+        self.assertEqual(15, len(graph.collections))
+        self.assertEqual(20, len(graph.items))
+        self.assertEqual(1234, graph.version)
+        self.assertEqual(2, len(HTTPretty.latest_requests))
+
+
+if __name__ == "__main__":
+    unittest.main()
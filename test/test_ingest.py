@@ -0,0 +1,160 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for idempotent ingestion with Pyzotero
+
+This file is part of Pyzotero.
+
+Pyzotero is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pyzotero is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Pyzotero. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+import unittest
+from httpretty import HTTPretty
+from pyzotero.pyzotero import ingest as ig
+from pyzotero.pyzotero import zotero as z
+
+
+class IngestTests(unittest.TestCase):
+    """ Tests for Ingester, against a fake library
+    """
+    def setUp(self):
+        """ Serve a library which stores the items written to it
+        """
+        self.library = {}
+        self.tokens = set()
+        self.writes = []
+        # items which are modified again before every update
+        self.conflicting = set()
+        self.version = 0
+        self.zot = z.Zotero('myuserID', 'user', 'myuserkey')
+        HTTPretty.enable()
+        for method in (HTTPretty.GET, HTTPretty.POST):
+            HTTPretty.register_uri(
+                method, 'https://api.zotero.org/users/myuserID/items',
+                body=self.respond)
+
+    def tearDown(self):
+        """ Tear stuff down
+        """
+        HTTPretty.disable()
+        HTTPretty.reset()
+
+    def respond(self, request, uri, headers):
+        """ Retrieve items by key, or create and update them """
+        headers['Content-Type'] = 'application/json'
+        if request.method == 'GET':
+            keys = request.querystring['itemKey'][0].split(',')
+            return (200, headers, json.dumps(
+                [self.library[k] for k in keys if k in self.library]))
+        token = request.headers.get('Zotero-Write-Token')
+        if token is not None:
+            if token in self.tokens:
+                return (412, headers, 'Write token already used')
+            self.tokens.add(token)
+        payload = json.loads(request.body.decode('utf-8'))
+        self.writes.append(payload)
+        self.version += 1
+        resp = {'successful': {}, 'failed': {}}
+        for pos, obj in enumerate(payload):
+            current = self.library.get(obj['key'])
+            if current and (current['version'] != obj.get('version') or
+                            obj['key'] in self.conflicting):
+                resp['failed']['%s' % pos] = {
+                    'key': obj['key'], 'code': 412, 'message': 'Exists'}
+                continue
+            data = dict(current['data'] if current else {}, **obj)
+            data['version'] = self.version
+            self.library[obj['key']] = {
+                'key': obj['key'], 'version': self.version, 'data': data}
+            resp['successful']['%s' % pos] = {
+                'key': obj['key'], 'version': self.version}
+        return (200, headers, json.dumps(resp))
+
+    def records(self, count=120):
+        """ A feed of records """
+        return [{'itemType': 'journalArticle', 'title': 'Paper %s' % n,
+                 'DOI': '10.1000/paper.%s' % n} for n in range(count)]
+
+    def testIngest(self):
+        """ New records should be created, unchanged records skipped, and
+            only changed fields of changed records written
+        """
+        ingester = ig.Ingester(self.zot)
+        result = ingester.ingest(iter(self.records()))
+        self.assertEqual(
+            {'created': 120, 'updated': 0, 'unchanged': 0, 'failed': {}},
+            result)
+        self.assertEqual(3, len(self.writes))
+        self.assertEqual(120, len(self.library))
+        key = ig.item_key('users/myuserID', 'doi:10.1000/paper.7')
+        self.assertEqual('Paper 7', self.library[key]['data']['title'])
+        # ingesting the same feed again doesn't write anything
+        result = ingester.ingest(self.records())
+        self.assertEqual(120, result['unchanged'])
+        self.assertEqual(3, len(self.writes))
+        # changed fields of changed records are written
+        records = self.records()
+        records[7]['title'] = 'Paper seven'
+        result = ingester.ingest(records)
+        self.assertEqual(1, result['updated'])
+        self.assertEqual(4, len(self.writes))
+        self.assertEqual(
+            [{'key': key, 'version': 1, 'title': 'Paper seven'}],
+            self.writes[-1])
+        self.assertEqual('Paper seven', self.library[key]['data']['title'])
+
+    def testInterruptedIngest(self):
+        """ Items created by an ingest whose index was lost should be found,
+            rather than created again
+        """
+        ig.Ingester(self.zot).ingest(self.records(60))
+        self.assertEqual(2, len(self.writes))
+        records = self.records(60)
+        records[0]['title'] = 'Paper zero'
+        # the same records, and a changed one, with an empty index
+        ingester = ig.Ingester(self.zot)
+        result = ingester.ingest(records)
+        self.assertEqual(60, result['created'])
+        self.assertEqual({}, result['failed'])
+        self.assertEqual(60, len(self.library))
+        key = ig.item_key('users/myuserID', 'doi:10.1000/paper.0')
+        self.assertEqual('Paper zero', self.library[key]['data']['title'])
+        self.assertEqual(60, ingester.ingest(records)['unchanged'])
+
+    def testConflicts(self):
+        """ Items which keep conflicting should be recorded as failures, and
+            the rest updated and indexed
+        """
+        ingester = ig.Ingester(self.zot, retries=1)
+        ingester.ingest(self.records(3))
+        records = self.records(3)
+        for record in records:
+            record['title'] += ' (revised)'
+        key = ig.item_key('users/myuserID', 'doi:10.1000/paper.0')
+        self.conflicting.add(key)
+        result = ingester.ingest(records)
+        self.assertEqual(2, result['updated'])
+        self.assertEqual(['doi:10.1000/paper.0'], list(result['failed']))
+        self.assertEqual(412, result['failed']['doi:10.1000/paper.0']['code'])
+        # the failed record is written again by the next ingest
+        self.conflicting.clear()
+        result = ingester.ingest(records)
+        self.assertEqual(
+            {'created': 0, 'updated': 1, 'unchanged': 2, 'failed': {}},
+            result)
+
+
+if __name__ == "__main__":
+    unittest.main()
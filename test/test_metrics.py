@@ -0,0 +1,232 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for Pyzotero request metrics
+
+This file is part of Pyzotero.
+
+Pyzotero is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pyzotero is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Pyzotero. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import io
+import os
+import gzip
+import unittest
+import httpretty
+from httpretty import HTTPretty
+from pyzotero.pyzotero import metrics as m
+from pyzotero.pyzotero import zotero as z
+
+
+class MetricsTests(unittest.TestCase):
+    """ Tests for the metrics registry, and its use by Zotero instances
+    """
+    cwd = os.path.dirname(os.path.realpath(__file__))
+
+    def get_doc(self, doc_name, cwd=cwd):
+        """ return the requested test document """
+        with open(os.path.join(cwd, 'api_responses', '%s' % doc_name), 'r') as f:
+            return f.read()
+
+    def setUp(self):
+        """ Set stuff up
+        """
+        self.items_doc = self.get_doc('items_doc.json')
+        self.metrics = m.Metrics()
+        self.events = []
+        self.metrics.subscribe(lambda ev, fields: self.events.append(ev))
+
+    def testEndpointLabels(self):
+        """ Library IDs, keys and tags shouldn't create new label values
+        """
+        self.assertEqual(
+            '/{t}/{u}/items/{key}/children',
+            m.endpoint(
+                'https://api.zotero.org/users/123/items/ABCD2345/children?limit=5'))
+        self.assertEqual(
+            '/{t}/{u}/tags/{tag}/items',
+            m.endpoint('https://api.zotero.org/groups/9/tags/hi%20there/items'))
+        self.assertEqual(
+            '/keys/{k}', m.endpoint('https://api.zotero.org/keys/s3cr3t'))
+        self.assertEqual(
+            's3.amazonaws.com', m.endpoint('https://s3.amazonaws.com/zotero'))
+
+    def testExport(self):
+        """ Recorded values should be exported as a dict and as Prometheus text
+        """
+        self.metrics.request(
+            'GET', 'https://api.zotero.org/users/1/items', 200, 0.2,
+            received=1000)
+        self.metrics.request(
+            'GET', 'https://api.zotero.org/users/2/items', 200, 0.02,
+            received=500)
+        self.metrics.retry('https://api.zotero.org/users/1/items', 429, 2)
+        exported = self.metrics.to_dict()
+        latency = exported['request_duration_seconds'][0]
+        self.assertEqual('/{t}/{u}/items', latency['labels']['endpoint'])
+        self.assertEqual(2, latency['value']['count'])
+        self.assertEqual(1, latency['value']['buckets']['0.025'])
+        self.assertEqual(2, latency['value']['buckets']['+Inf'])
+        self.assertEqual(1500, exported['response_bytes_total'][0]['value'])
+        text = self.metrics.prometheus()
+        self.assertIn(
+            'pyzotero_request_duration_seconds_bucket'
+            '{endpoint="/{t}/{u}/items",method="GET",le="0.25"} 2', text)
+        self.assertIn('pyzotero_retries_total{status="429"} 1', text)
+        self.assertIn('pyzotero_backoff_seconds_total 2', text)
+        self.assertEqual(['request', 'request', 'retry'], self.events)
+
+    @httpretty.activate
+    def testZoteroRecordsRequests(self):
+        """ Read calls should record the request, and the time spent parsing
+        """
+        zot = z.Zotero('myuserID', 'user', 'myuserkey', metrics=self.metrics)
+        HTTPretty.register_uri(
+            HTTPretty.GET,
+            'https://api.zotero.org/users/myuserID/items',
+            content_type='application/json',
+            body=self.items_doc)
+        zot.items()
+        exported = self.metrics.to_dict()
+        requests = exported['requests_total']
+        self.assertEqual(1, len(requests))
+        self.assertEqual('200', '%s' % requests[0]['labels']['status'])
+        self.assertEqual(
+            len(self.items_doc.encode('utf-8')),
+            exported['response_bytes_total'][0]['value'])
+        self.assertEqual(
+            1, exported['parse_duration_seconds'][0]['value']['count'])
+
+    @httpretty.activate
+    def testRetriesAreRecorded(self):
+        """ 429 responses should be retried, and the successful response used
+        """
+        zot = z.Zotero('myuserID', 'user', 'myuserkey', metrics=self.metrics)
+        HTTPretty.register_uri(
+            HTTPretty.GET,
+            'https://api.zotero.org/users/myuserID/items',
+            responses=[
+                HTTPretty.Response(body='', status=429),
+                HTTPretty.Response(
+                    body=self.items_doc,
+                    status=200,
+                    content_type='application/json')])
+        slept = []
+        sleep = z.time.sleep
+        z.time.sleep = slept.append
+        try:
+            items = zot.items()
+        finally:
+            z.time.sleep = sleep
+        self.assertEqual(u'NM66T6EF', items[0]['key'])
+        self.assertEqual([2], slept)
+        text = self.metrics.prometheus()
+        self.assertIn('pyzotero_retries_total{status="429"} 1', text)
+        self.assertIn('pyzotero_backoff_seconds_total 2', text)
+
+    @httpretty.activate
+    def testRetryAfterIsHonoured(self):
+        """ A 429 response's Retry-After header should set the delay
+        """
+        zot = z.Zotero('myuserID', 'user', 'myuserkey', metrics=self.metrics)
+        HTTPretty.register_uri(
+            HTTPretty.GET,
+            'https://api.zotero.org/users/myuserID/items',
+            responses=[
+                HTTPretty.Response(
+                    body='', status=429, adding_headers={'Retry-After': '7'}),
+                HTTPretty.Response(body='', status=429),
+                HTTPretty.Response(
+                    body=self.items_doc,
+                    status=200,
+                    content_type='application/json')])
+        slept = []
+        sleep = z.time.sleep
+        z.time.sleep = slept.append
+        try:
+            zot.items()
+        finally:
+            z.time.sleep = sleep
+        self.assertEqual([7, 4], slept)
+
+    @httpretty.activate
+    def testConcurrentRetries(self):
+        """ Concurrent requests which are each rate-limited once should each
+            be retried after the first delay, and succeed
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        zot = z.Zotero('myuserID', 'user', 'myuserkey', metrics=self.metrics)
+        keys = ['COLL%04d' % n for n in range(8)]
+        for key in keys:
+            HTTPretty.register_uri(
+                HTTPretty.GET,
+                'https://api.zotero.org/users/myuserID/collections/%s/items'
+                % key,
+                responses=[
+                    HTTPretty.Response(body='', status=429),
+                    HTTPretty.Response(
+                        body=self.items_doc,
+                        status=200,
+                        content_type='application/json')])
+        slept = []
+        sleep = z.time.sleep
+        z.time.sleep = slept.append
+        try:
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                found = list(pool.map(zot.collection_items, keys))
+        finally:
+            z.time.sleep = sleep
+        self.assertEqual(
+            [u'NM66T6EF'] * 8, [items[0]['key'] for items in found])
+        self.assertEqual([2] * 8, slept)
+        self.assertIn(
+            'pyzotero_retries_total{status="429"} 8', self.metrics.prometheus())
+
+    @httpretty.activate
+    def testCompressedResponses(self):
+        """ Compression should be negotiated, and compressed responses
+            recorded by their decoded and wire sizes
+        """
+        body = self.items_doc.encode('utf-8')
+        out = io.BytesIO()
+        with gzip.GzipFile(fileobj=out, mode='wb') as f:
+            f.write(body)
+        compressed = out.getvalue()
+        HTTPretty.register_uri(
+            HTTPretty.GET,
+            'https://api.zotero.org/users/myuserID/items',
+            content_type='application/json',
+            adding_headers={'Content-Encoding': 'gzip'},
+            body=compressed)
+        zot = z.Zotero('myuserID', 'user', 'myuserkey', metrics=self.metrics)
+        self.assertEqual(u'NM66T6EF', zot.items()[0]['key'])
+        self.assertEqual(
+            z.accept_encoding(),
+            HTTPretty.last_request.headers['Accept-Encoding'])
+        exported = self.metrics.to_dict()
+        self.assertEqual(
+            len(body), exported['response_bytes_total'][0]['value'])
+        wire = exported['response_wire_bytes_total'][0]
+        self.assertEqual('gzip', wire['labels']['encoding'])
+        self.assertEqual(len(compressed), wire['value'])
+        zot = z.Zotero('myuserID', 'user', 'myuserkey', encodings=[])
+        zot.items()
+        self.assertEqual(
+            'identity', HTTPretty.last_request.headers['Accept-Encoding'])
+        with self.assertRaises(z.ze.UnsupportedParams):
+            z.Zotero('myuserID', 'user', 'myuserkey', encodings=['lzma'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,177 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for reading multiple libraries with Pyzotero
+
+This file is part of Pyzotero.
+
+Pyzotero is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pyzotero is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Pyzotero. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import json
+import unittest
+from httpretty import HTTPretty
+from pyzotero.pyzotero import multi as mu
+from pyzotero.pyzotero import zotero as z
+
+
+class MultiLibraryTests(unittest.TestCase):
+    """ Tests for MultiLibrary
+    """
+    cwd = os.path.dirname(os.path.realpath(__file__))
+
+    def get_doc(self, doc_name, cwd=cwd):
+        """ return the requested test document """
+        with open(os.path.join(cwd, 'api_responses', '%s' % doc_name), 'r') as f:
+            return f.read()
+
+    def setUp(self):
+        """ Register a key which can read its own library and one group
+        """
+        self.items_doc = self.get_doc('items_doc.json')
+        self.groups_doc = self.get_doc('groups_doc.json')
+        self.group_id = json.loads(self.groups_doc)[0]['id']
+        HTTPretty.enable()
+        self.register()
+
+    def register(self, group_status=200):
+        """ Register API responses, optionally failing the group library
+        """
+        HTTPretty.reset()
+        HTTPretty.register_uri(
+            HTTPretty.GET,
+            'https://api.zotero.org/keys/myuserkey',
+            content_type='application/json',
+            body=json.dumps({
+                'key': 'myuserkey',
+                'userID': 436,
+                'username': 'urschrei',
+                'access': {
+                    'user': {'library': True},
+                    'groups': {
+                        '%s' % self.group_id: {'library': True}}}}))
+        HTTPretty.register_uri(
+            HTTPretty.GET,
+            'https://api.zotero.org/users/436/groups',
+            content_type='application/json',
+            body=self.groups_doc)
+        for prefix, status in (
+                ('users/436', 200),
+                ('groups/%s' % self.group_id, group_status)):
+            HTTPretty.register_uri(
+                HTTPretty.GET,
+                'https://api.zotero.org/%s/items' % prefix,
+                content_type='application/json',
+                body=self.items_doc,
+                status=status)
+            HTTPretty.register_uri(
+                HTTPretty.GET,
+                'https://api.zotero.org/%s/items/top' % prefix,
+                content_type='application/json',
+                adding_headers={'Total-Results': '20'},
+                body=self.items_doc)
+
+    def tearDown(self):
+        """ Tear stuff down
+        """
+        HTTPretty.disable()
+        HTTPretty.reset()
+
+    def testDiscoverLibraries(self):
+        """ Readable libraries should be found using key_info() and groups()
+        """
+        multi = mu.MultiLibrary('myuserkey')
+        self.assertEqual(
+            [('user', 436), ('group', self.group_id)],
+            [(l['type'], l['id']) for l in multi.libraries])
+        self.assertEqual('smart_cities', multi.libraries[1]['name'])
+
+    def testSharedTransport(self):
+        """ Every library should share one transport, whose connection pool
+            is large enough for every worker
+        """
+        multi = mu.MultiLibrary('myuserkey', max_workers=4)
+        user = multi.client({'type': 'user', 'id': 436})
+        group = multi.client({'type': 'group', 'id': self.group_id})
+        self.assertIs(user.transport, group.transport)
+        self.assertEqual(4, user.transport.pool_size)
+
+    def testItemsAreMergedAndTagged(self):
+        """ Items from every library should be streamed with their library
+        """
+        multi = mu.MultiLibrary('myuserkey', max_workers=2)
+        results = list(multi.items(limit=20))
+        self.assertEqual(40, len(results))
+        self.assertEqual(
+            set(['user', 'group']),
+            set(library['type'] for library, _ in results))
+        self.assertTrue(all(item['key'] for _, item in results))
+        self.assertEqual(
+            {('user', 436): 20, ('group', self.group_id): 20},
+            multi.num_items())
+
+    def testErrors(self):
+        """ A failing library should raise, or be skipped and recorded
+        """
+        self.register(group_status=403)
+        multi = mu.MultiLibrary('myuserkey')
+        with self.assertRaises(z.ze.UserNotAuthorised):
+            list(multi.items())
+        results = list(multi.items(errors='skip'))
+        self.assertEqual(20, len(results))
+        self.assertEqual(self.group_id, multi.errors[0][0]['id'])
+
+    def libraries(self, count=20, failing=None):
+        """ Serve count user libraries, optionally failing one of them """
+        for n in range(count):
+            HTTPretty.register_uri(
+                HTTPretty.GET,
+                'https://api.zotero.org/users/%s/items' % n,
+                content_type='application/json',
+                body=self.items_doc,
+                status=403 if n == failing else 200)
+        return [{'type': 'user', 'id': '%s' % n, 'name': ''}
+                for n in range(count)]
+
+    def item_requests(self):
+        """ The number of item requests made """
+        return len([r for r in HTTPretty.latest_requests
+                    if r.path.split('?')[0].endswith('/items')])
+
+    def testEarlyClose(self):
+        """ Closing the generator should cancel libraries which haven't
+            been read, rather than reading them all
+        """
+        multi = mu.MultiLibrary(
+            'myuserkey', libraries=self.libraries(), max_workers=2)
+        results = multi.map('items')
+        library, page = next(results)
+        self.assertEqual(20, len(page))
+        results.close()
+        self.assertLess(self.item_requests(), 20)
+
+    def testErrorStopsReads(self):
+        """ Raising an error should cancel libraries which haven't been read
+        """
+        multi = mu.MultiLibrary(
+            'myuserkey', libraries=self.libraries(failing=0),
+            max_workers=2)
+        with self.assertRaises(z.ze.UserNotAuthorised):
+            list(multi.items())
+        self.assertLess(self.item_requests(), 20)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,148 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for bulk rendering of bibliography entries with Pyzotero
+
+This file is part of Pyzotero.
+
+Pyzotero is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pyzotero is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Pyzotero. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import json
+import unittest
+from httpretty import HTTPretty
+from pyzotero.pyzotero import render as rn
+from pyzotero.pyzotero import zotero as z
+
+
+class RendererTests(unittest.TestCase):
+    """ Tests for Renderer
+    """
+    cwd = os.path.dirname(os.path.realpath(__file__))
+
+    def get_doc(self, doc_name, cwd=cwd):
+        """ return the requested test document """
+        with open(os.path.join(cwd, 'api_responses', '%s' % doc_name), 'r') as f:
+            return f.read()
+
+    def setUp(self):
+        """ Serve versions and rendered entries for the test items
+        """
+        self.items = json.loads(self.get_doc('items_doc.json'))
+        self.keys = [i['key'] for i in self.items]
+        self.versions = dict((i['key'], i['version']) for i in self.items)
+        self.zot = z.Zotero('myuserID', 'user', 'myuserkey')
+        self.url = 'https://api.zotero.org/users/myuserID/items'
+        self.since = {}
+        self.deleted = []
+        HTTPretty.enable()
+        HTTPretty.register_uri(
+            HTTPretty.GET, self.url, body=self.respond)
+        HTTPretty.register_uri(
+            HTTPretty.GET,
+            'https://api.zotero.org/users/myuserID/deleted',
+            body=self.respond_deleted)
+
+    def tearDown(self):
+        """ Tear stuff down
+        """
+        HTTPretty.disable()
+        HTTPretty.reset()
+
+    def respond(self, request, uri, headers):
+        """ Answer versions and include=bib requests
+        """
+        params = request.querystring
+        headers['Content-Type'] = 'application/json'
+        headers['Last-Modified-Version'] = '%s' % max(
+            self.versions.values())
+        if params['format'] == ['versions']:
+            if 'since' in params:
+                return (200, headers, json.dumps(self.since))
+            return (200, headers, json.dumps(self.versions))
+        keys = params['itemKey'][0].split(',')
+        return (200, headers, json.dumps([
+            {'key': k, 'version': self.versions[k],
+             'bib': '<div>%s %s %s</div>' % (
+                 k, self.versions[k], params['style'][0])}
+            for k in keys if k in self.versions]))
+
+    def respond_deleted(self, request, uri, headers):
+        """ Answer deleted object requests
+        """
+        headers['Content-Type'] = 'application/json'
+        return (200, headers, json.dumps({
+            'collections': [], 'searches': [], 'items': self.deleted,
+            'tags': [], 'settings': []}))
+
+    def requests(self, fmt):
+        """ Return the item requests made for a format
+        """
+        return [r for r in HTTPretty.latest_requests
+                if r.path.startswith('/users/myuserID/items')
+                and r.querystring['format'] == [fmt]]
+
+    def testRender(self):
+        """ Entries should be rendered in order, and cached until their
+            items change
+        """
+        renderer = rn.Renderer(self.zot, style='apa')
+        wanted = self.keys[::-1] + ['MISSING1']
+        rendered = renderer.render(wanted)
+        self.assertEqual(
+            ['<div>%s 1 apa</div>' % k for k in self.keys[::-1]] + [None],
+            rendered)
+        self.assertEqual(1, len(self.requests('json')))
+        self.assertEqual(
+            sorted(self.keys),
+            sorted(self.requests('json')[0].querystring['itemKey'][0]
+                   .split(',')))
+        self.assertEqual(['bib'], self.requests('json')[0].querystring['include'])
+        # a warm cache costs requests for changed versions and deletions
+        self.assertEqual(rendered, renderer.render(wanted))
+        self.assertEqual(1, len(self.requests('json')))
+        self.assertEqual(2, len(self.requests('versions')))
+        self.assertEqual(
+            ['1'], self.requests('versions')[-1].querystring['since'])
+        # changed items are rendered again
+        self.versions[self.keys[0]] = 2
+        self.since = {self.keys[0]: 2}
+        self.assertEqual(
+            '<div>%s 2 apa</div>' % self.keys[0],
+            renderer.render(self.keys)[0])
+        self.assertEqual(
+            [self.keys[0]],
+            self.requests('json')[-1].querystring['itemKey'])
+
+    def testDeletedItems(self):
+        """ Items deleted between refreshes should be dropped, with their
+            cached entries
+        """
+        renderer = rn.Renderer(self.zot)
+        renderer.render(self.keys)
+        gone = self.keys[0]
+        entry = renderer._cache_key(gone, self.versions[gone])
+        self.assertIsNotNone(renderer.cache.get(entry))
+        del self.versions[gone]
+        self.deleted = [gone]
+        rendered = renderer.render(self.keys)
+        self.assertIsNone(rendered[0])
+        self.assertNotIn(gone, renderer.versions)
+        self.assertIsNone(renderer.cache.get(entry))
+        self.assertEqual(['1'], HTTPretty.last_request.querystring['since'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the Pyzotero local search index
+
+This file is part of Pyzotero.
+
+Pyzotero is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pyzotero is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Pyzotero. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import json
+import unittest
+from pyzotero.pyzotero import search as s
+
+
+class SearchIndexTests(unittest.TestCase):
+    """ Tests for the local search index
+    """
+    cwd = os.path.dirname(os.path.realpath(__file__))
+
+    def setUp(self):
+        """ Index the items fixture
+        """
+        with open(os.path.join(
+                self.cwd, 'api_responses', 'items_doc.json'), 'r') as f:
+            self.items = json.loads(f.read())
+        self.index = s.SearchIndex(self.items)
+
+    def testTitleSearchIsRanked(self):
+        """ Items with query terms in their titles should rank first
+        """
+        results = self.index.search('sherlock holmes')
+        keys = [r['key'] for r in results]
+        self.assertEqual(len(self.items), len(self.index))
+        self.assertIn('6MCAN2NC', keys)
+        # the shortest exact title match should win
+        self.assertEqual('6MCAN2NC', keys[0])
+        self.assertNotIn('GIFZST3I', keys)
+
+    def testPrefixAndAccents(self):
+        """ The last word is a prefix, and accents are ignored
+        """
+        results = self.index.search(u'Biostätis')
+        self.assertEqual(['9AIAUW49'], [r['key'] for r in results])
+        self.assertEqual(
+            [], self.index.search(u'Biostätis', prefix=False))
+
+    def testQmodeEverythingSearchesTags(self):
+        """ Tags are only searched with qmode=everything
+        """
+        self.assertEqual([], self.index.search('apoptosis immunology'))
+        results = self.index.search(
+            'apoptosis immunology', qmode='everything')
+        self.assertEqual(['AGTZDBRQ'], [r['key'] for r in results])
+
+    def testFilters(self):
+        """ itemType and tag filters use the API's syntax
+        """
+        books = self.index.search('sherlock', itemType='book')
+        self.assertTrue(books)
+        self.assertTrue(all(b['data']['itemType'] == 'book' for b in books))
+        not_books = self.index.search('sherlock', itemType='-book')
+        self.assertFalse(set(r['key'] for r in books) &
+                         set(r['key'] for r in not_books))
+        tagged = self.index.search(tag='T-Lymphocytes || Murder')
+        self.assertEqual(
+            set(['2SS8NXZI', 'AGTZDBRQ', 'PG5ZCTJT']),
+            set(r['key'] for r in tagged))
+        both = self.index.search(tag=['T-Lymphocytes', 'therapy'])
+        self.assertEqual(['AGTZDBRQ'], [r['key'] for r in both])
+
+    def testIncrementalUpdate(self):
+        """ Updated items replace their old postings, removed items vanish
+        """
+        item = [i for i in self.items if i['key'] == '9AIAUW49'][0]
+        item['data']['title'] = 'Quantitative methods'
+        self.index.update(item)
+        self.assertEqual([], self.index.search('biostatistics'))
+        self.assertEqual(
+            ['9AIAUW49'], [r['key'] for r in self.index.search('quantit')])
+        self.index.remove('9AIAUW49')
+        self.assertEqual([], self.index.search('quantitative'))
+        self.assertNotIn('quantitative', self.index.postings)
+
+    def testBadQmode(self):
+        """ An unknown qmode should raise the same error as the API
+        """
+        with self.assertRaises(s.ze.UnsupportedParams):
+            self.index.search('holmes', qmode='fulltext')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,232 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for tag analytics and bulk tag changes with Pyzotero
+
+This file is part of Pyzotero.
+
+Pyzotero is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pyzotero is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Pyzotero. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import json
+import unittest
+from httpretty import HTTPretty
+from pyzotero.pyzotero import tagging as tg
+from pyzotero.pyzotero import zotero as z
+
+
+class TaggingTests(unittest.TestCase):
+    """ Tests for TagIndex, and bulk tag retrieval
+    """
+    cwd = os.path.dirname(os.path.realpath(__file__))
+
+    def get_doc(self, doc_name, cwd=cwd):
+        """ return the requested test document """
+        with open(os.path.join(cwd, 'api_responses', '%s' % doc_name), 'r') as f:
+            return f.read()
+
+    def setUp(self):
+        """ Index the items fixture
+        """
+        self.items = json.loads(self.get_doc('items_doc.json'))
+        self.index = tg.TagIndex(self.items)
+        self.base = 'https://api.zotero.org/users/myuserID'
+        self.zot = z.Zotero('myuserID', 'user', 'myuserkey')
+        # payloads received by the write endpoint
+        self.sent = []
+        HTTPretty.enable()
+
+    def tearDown(self):
+        """ Tear stuff down
+        """
+        HTTPretty.disable()
+        HTTPretty.reset()
+
+    def written(self, request, uri, headers):
+        """ Record a write request's payload, and respond to it """
+        payload = json.loads(request.body.decode('utf-8'))
+        self.sent.append(payload)
+        headers['Content-Type'] = 'application/json'
+        return (200, headers, json.dumps({
+            'successful': dict(
+                ('%s' % pos, {'key': p['key'], 'version': 100})
+                for pos, p in enumerate(payload)),
+            'failed': {}}))
+
+    def testAnalytics(self):
+        """ Tags should be counted, and similar tags grouped
+        """
+        counts = self.index.counts()
+        self.assertEqual(2, counts['T-Lymphocytes'])
+        self.assertEqual(2, counts['Congresses'])
+        self.assertEqual(['AGTZDBRQ', 'X42A7DEE'],
+                         self.index.items_with('Congresses'))
+        self.assertEqual({}, self.index.counts(tag_type=0))
+        self.index.update(dict(self.items[0], data=dict(
+            self.items[0]['data'], tags=[{'tag': 'congresses '}])))
+        self.assertEqual(
+            [['Congresses', 'congresses ']], self.index.similar())
+
+    def testApply(self):
+        """ Renames and merges should rewrite each affected item once, and
+            deletions should use multi-tag deletes
+        """
+        HTTPretty.register_uri(
+            HTTPretty.POST, self.base + '/items', body=self.written)
+        HTTPretty.register_uri(
+            HTTPretty.HEAD, self.base + '/items/top',
+            adding_headers={'Total-Results': '1',
+                            'Last-Modified-Version': '100'},
+            body='')
+        HTTPretty.register_uri(
+            HTTPretty.DELETE, self.base + '/tags',
+            adding_headers={'Last-Modified-Version': '101'},
+            status=204, body='')
+        states = []
+        state = self.index.apply(
+            self.zot,
+            renames={'T-Lymphocytes': 'T cells', 'immunology': 'Immunology',
+                     'therapy': 'Immunology', 'Missing': 'Other'},
+            deletes=['Fiction', 'Murder'],
+            progress=lambda s: states.append(dict(s)))
+        self.assertEqual(
+            {'items': 2, 'written': 2, 'tags': 2, 'deleted': 2,
+             'failed': {}}, state)
+        self.assertEqual(2, len(states))
+        self.assertEqual(1, len(self.sent))
+        written = dict((p['key'], p) for p in self.sent[0])
+        self.assertEqual(['tags'], sorted(
+            k for k in written['AGTZDBRQ'] if k not in ('key', 'version')))
+        self.assertEqual(
+            ['Apoptosis', 'Congresses', 'HIV infections',
+             'Lymphocyte transformation', 'Pathophysiology', 'T cells',
+             'Immunology'],
+            [t['tag'] for t in written['AGTZDBRQ']['tags']])
+        self.assertEqual(1, written['AGTZDBRQ']['tags'][-1]['type'])
+        deleted = [r for r in HTTPretty.latest_requests
+                   if r.method == 'DELETE'][0]
+        self.assertEqual(['Fiction || Murder'], deleted.querystring['tag'])
+        self.assertEqual(
+            ['2SS8NXZI', 'AGTZDBRQ'], self.index.items_with('T cells'))
+        self.assertNotIn('T-Lymphocytes', self.index)
+        self.assertNotIn('Fiction', self.index)
+        self.assertEqual(100, self.index.items['AGTZDBRQ']['version'])
+
+    def testPersistentConflict(self):
+        """ Items which keep conflicting should be recorded as failures,
+            and the rest of the changes applied
+        """
+        def conflicting(request, uri, headers):
+            """ AGTZDBRQ is modified again before every write """
+            payload = json.loads(request.body.decode('utf-8'))
+            self.sent.append(payload)
+            headers['Content-Type'] = 'application/json'
+            resp = {'successful': {}, 'failed': {}}
+            for pos, p in enumerate(payload):
+                if p['key'] == 'AGTZDBRQ':
+                    resp['failed']['%s' % pos] = {
+                        'key': p['key'], 'code': 412, 'message': 'Changed'}
+                else:
+                    resp['successful']['%s' % pos] = {
+                        'key': p['key'], 'version': 100}
+            return (200, headers, json.dumps(resp))
+
+        def current(request, uri, headers):
+            """ serve items by key """
+            keys = request.querystring['itemKey'][0].split(',')
+            headers['Content-Type'] = 'application/json'
+            return (200, headers, json.dumps(
+                [i for i in self.items if i['key'] in keys]))
+        HTTPretty.register_uri(
+            HTTPretty.POST, self.base + '/items', body=conflicting)
+        HTTPretty.register_uri(
+            HTTPretty.GET, self.base + '/items', body=current)
+        HTTPretty.register_uri(
+            HTTPretty.HEAD, self.base + '/items/top',
+            adding_headers={'Total-Results': '1',
+                            'Last-Modified-Version': '100'},
+            body='')
+        HTTPretty.register_uri(
+            HTTPretty.DELETE, self.base + '/tags',
+            adding_headers={'Last-Modified-Version': '101'},
+            status=204, body='')
+        state = self.index.apply(
+            self.zot, renames={'T-Lymphocytes': 'T cells'},
+            deletes=['Fiction'], retries=1)
+        self.assertEqual(1, state['written'])
+        self.assertEqual(1, state['deleted'])
+        self.assertEqual(['AGTZDBRQ'], list(state['failed']))
+        self.assertEqual(412, state['failed']['AGTZDBRQ']['code'])
+        self.assertEqual(2, len(self.sent))
+        self.assertEqual(['2SS8NXZI'], self.index.items_with('T cells'))
+        self.assertEqual(
+            ['AGTZDBRQ'], self.index.items_with('T-Lymphocytes'))
+        self.assertNotIn('Fiction', self.index)
+
+    def testFetchTags(self):
+        """ Every page of tags should be retrieved, with metadata
+        """
+        def respond(request, uri, headers):
+            """ serve 250 tags, a page at a time """
+            start = int(request.querystring['start'][0])
+            limit = int(request.querystring['limit'][0])
+            headers['Content-Type'] = 'application/json'
+            headers['Total-Results'] = '250'
+            return (200, headers, json.dumps([
+                {'tag': 'tag%03d' % n, 'meta': {'type': n % 2, 'numItems': n}}
+                for n in range(start, min(start + limit, 250))]))
+
+        HTTPretty.register_uri(
+            HTTPretty.GET, self.base + '/tags', body=respond)
+        tags = tg.fetch_tags(self.zot)
+        self.assertEqual(250, len(tags))
+        self.assertEqual(
+            {'tag': 'tag249', 'type': 1, 'numItems': 249}, tags[-1])
+        self.assertEqual(3, len(HTTPretty.latest_requests))
+
+    def testFetchTagsRetried(self):
+        """ Concurrent page requests which are each rate-limited once should
+            all be retried after the first delay
+        """
+        limited = set()
+
+        def respond(request, uri, headers):
+            """ serve 80 tags, rate-limiting each page's first request """
+            start = int(request.querystring['start'][0])
+            if start not in limited:
+                limited.add(start)
+                return (429, headers, '')
+            headers['Content-Type'] = 'application/json'
+            headers['Total-Results'] = '80'
+            return (200, headers, json.dumps([
+                {'tag': 'tag%03d' % n, 'meta': {'type': 0, 'numItems': 1}}
+                for n in range(start, min(start + 10, 80))]))
+
+        HTTPretty.register_uri(
+            HTTPretty.GET, self.base + '/tags', body=respond)
+        slept = []
+        sleep = z.time.sleep
+        z.time.sleep = slept.append
+        try:
+            tags = tg.fetch_tags(self.zot, workers=8, limit=10)
+        finally:
+            z.time.sleep = sleep
+        self.assertEqual(
+            ['tag%03d' % n for n in range(80)], [t['tag'] for t in tags])
+        self.assertEqual([2] * 8, slept)
+
+
+if __name__ == "__main__":
+    unittest.main()
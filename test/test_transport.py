@@ -0,0 +1,209 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for Pyzotero's pluggable HTTP transports
+
+This file is part of Pyzotero.
+
+Pyzotero is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pyzotero is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Pyzotero. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from httpretty import HTTPretty
+from pyzotero.pyzotero import transport as tr
+from pyzotero.pyzotero import zotero as z
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+class TransportTests(unittest.TestCase):
+    """ Tests for transports
+    """
+    cwd = os.path.dirname(os.path.realpath(__file__))
+
+    def get_doc(self, doc_name, cwd=cwd):
+        """ return the requested test document """
+        with open(os.path.join(cwd, 'api_responses', '%s' % doc_name), 'r') as f:
+            return f.read()
+
+    def setUp(self):
+        """ Serve a page of items
+        """
+        self.items_doc = self.get_doc('items_doc.json')
+        self.tmp = tempfile.mkdtemp()
+        self.cassette = os.path.join(self.tmp, 'cassette.json')
+        HTTPretty.enable()
+        HTTPretty.register_uri(
+            HTTPretty.GET,
+            'https://api.zotero.org/users/myuserID/items',
+            content_type='application/json',
+            adding_headers={
+                'Total-Results': '2',
+                'Link': '<https://api.zotero.org/users/myuserID/items?'
+                        'limit=1&start=1>; rel="next"'},
+            body=self.items_doc)
+
+    def tearDown(self):
+        """ Tear stuff down
+        """
+        HTTPretty.disable()
+        HTTPretty.reset()
+        shutil.rmtree(self.tmp)
+
+    def testRecordReplay(self):
+        """ Recorded responses should be replayed without a server, in order,
+            and unrecorded requests should raise an error
+        """
+        recorder = tr.RecordReplayTransport(self.cassette)
+        self.assertEqual('record', recorder.mode)
+        zot = z.Zotero('myuserID', 'user', 'myuserkey', transport=recorder)
+        recorded = zot.items(limit=1)
+        recorder.close()
+        HTTPretty.disable()
+        replayer = tr.RecordReplayTransport(self.cassette)
+        self.assertEqual('replay', replayer.mode)
+        zot = z.Zotero('myuserID', 'user', 'myuserkey', transport=replayer)
+        self.assertEqual(recorded, zot.items(limit=1))
+        self.assertEqual('2', zot.request.headers['total-results'])
+        self.assertEqual(
+            '/users/myuserID/items?limit=1&start=1', zot.links['next'])
+        # each recorded response is only replayed once
+        with self.assertRaises(z.ze.UnrecordedRequest):
+            zot.items(limit=1)
+        with self.assertRaises(z.ze.UnrecordedRequest):
+            zot.items(limit=2)
+
+    def testCustomTransport(self):
+        """ Every request should be sent using the transport, and its error
+            responses handled
+        """
+        sent = []
+
+        class Static(tr.Transport):
+            def send(self, method, url, params=None, data=None,
+                     headers=None, timeout=None):
+                sent.append((method, url, params))
+                status = 404 if 'MISSING' in url else 200
+                return tr.Response(
+                    status, {'Content-Type': 'application/json'},
+                    json.dumps({'key': 'ABC', 'version': 1}).encode('utf-8'),
+                    url, tr.Request(method, url, headers, data))
+
+        zot = z.Zotero('myuserID', 'user', 'myuserkey', transport=Static())
+        self.assertEqual('ABC', zot.item('ABC')['key'])
+        self.assertEqual('GET', sent[0][0])
+        with self.assertRaises(z.ze.ResourceNotFound):
+            zot.item('missing')
+
+    @unittest.skipIf(httpx, "httpx is installed")
+    def testHTTP2TransportNeedsHttpx(self):
+        """ A missing httpx should be reported when the transport is created
+        """
+        with self.assertRaises(ImportError):
+            tr.HTTP2Transport()
+
+    def testHTTP2TransportWrapsResponses(self):
+        """ Responses from an httpx-like client should be wrapped
+        """
+        body = self.items_doc.encode('utf-8')
+
+        class Sent(object):
+            def __init__(self, url, content):
+                self.url = url
+                self.content = content
+
+        class Received(object):
+            def __init__(self, url, content):
+                self.status_code = 200
+                self.headers = {'Content-Type': 'application/json'}
+                self.content = body
+                self.url = url
+                self.request = Sent(url, content)
+                self.num_bytes_downloaded = 123
+
+        class Client(object):
+            def request(self, method, url, params=None, headers=None,
+                        timeout=None, data=None, content=None):
+                return Received('%s?format=json' % url, content)
+
+        transport = tr.HTTP2Transport(client=Client())
+        zot = z.Zotero('myuserID', 'user', 'myuserkey', transport=transport)
+        self.assertEqual(
+            [i['key'] for i in json.loads(self.items_doc)],
+            [i['key'] for i in zot.items()])
+        self.assertEqual(123, tr.wire_bytes(zot.request))
+        self.assertEqual('GET', zot.request.request.method)
+
+    @unittest.skipUnless(httpx, "httpx isn't installed")
+    def testHTTP2Transport(self):
+        """ Responses from httpx should be wrapped
+        """
+        def handler(request):
+            return httpx.Response(
+                200, headers={'Content-Type': 'application/json'},
+                content=self.items_doc.encode('utf-8'))
+
+        HTTPretty.disable()
+        transport = tr.HTTP2Transport(
+            client=httpx.Client(transport=httpx.MockTransport(handler)))
+        zot = z.Zotero('myuserID', 'user', 'myuserkey', transport=transport)
+        self.assertEqual(
+            [i['key'] for i in json.loads(self.items_doc)],
+            [i['key'] for i in zot.items()])
+        self.assertIn('format=json', zot.request.url)
+
+    def testEncodingsNeedUrllib3Support(self):
+        """ zstd shouldn't be advertised unless urllib3 decodes it, even if
+            zstandard is installed
+        """
+        importable, decodes = tr.importable, tr.urllib3_decodes
+        # as with urllib3 1.x, which decodes br, but not zstd
+        tr.importable = lambda module: True
+        tr.urllib3_decodes = lambda coding: coding != 'zstd'
+        tr._available = None
+        try:
+            self.assertEqual(
+                ['br', 'gzip', 'deflate'], tr.available_encodings())
+        finally:
+            tr.importable, tr.urllib3_decodes = importable, decodes
+            tr._available = None
+        self.assertIn('gzip', tr.available_encodings())
+
+    def testTransportEncodings(self):
+        """ The codings asked for should be those the transport decodes
+        """
+        class Gzip(tr.Transport):
+            def encodings(self):
+                return ['gzip']
+
+        zot = z.Zotero('myuserID', 'user', 'myuserkey', transport=Gzip())
+        self.assertEqual('gzip', zot.accept_encoding)
+        with self.assertRaises(z.ze.UnsupportedParams):
+            z.Zotero(
+                'myuserID', 'user', 'myuserkey', transport=Gzip(),
+                encodings=['deflate'])
+        # replayed cassettes defer to the transport they record with
+        self.assertEqual(['gzip'], tr.RecordReplayTransport(
+            self.cassette, transport=Gzip()).encodings())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -21,8 +21,16 @@ You should have received a copy of the GNU General Public License
 along with Pyzotero. If not, see <http://www.gnu.org/licenses/>.
 """
 
+import io
 import os
+import re
+import sys
+import gzip
+import json
+import shutil
+import tempfile
 import unittest
+import subprocess
 import httpretty
 from httpretty import HTTPretty
 from pyzotero.pyzotero import zotero as z
@@ -94,6 +102,30 @@ class ZoteroTests(unittest.TestCase):
             parse_qs('start=7&limit=0&format=json'),
             parse_qs(zot.url_params))
 
+    @httpretty.activate
+    def testCompiledRoutes(self):
+        """ Routes should be compiled once per library, with their fields
+            quoted, and encoded parameters reused
+        """
+        zot = z.Zotero('myuserID', 'user', 'myuserkey')
+        self.assertEqual(
+            '/users/myuserID/tags/hi%20there/items',
+            zot._path('/{t}/{u}/tags/{ta}/items', ta='hi there'))
+        self.assertEqual(
+            'https://api.zotero.org/users/myuserID/items/ABC',
+            zot._url('/{t}/{u}/items/{i}', i='ABC'))
+        self.assertEqual(2, len(zot.routes))
+        zot.add_parameters(limit=5)
+        first = zot.url_params
+        zot.add_parameters(limit=5)
+        self.assertIs(first, zot.url_params)
+        zot.library_id = 'otherID'
+        self.assertEqual(
+            '/users/otherID/items/ABC', zot._path('/{t}/{u}/items/{i}', i='ABC'))
+        self.assertEqual(1, len(zot.routes))
+        with self.assertRaises(z.ze.ParamNotPassed):
+            zot._build_query('/{t}/{u}/items/{i}')
+
     # @httpretty.activate
     # def testBuildQuery(self):
     #     """ Check that spaces etc. are being correctly URL-encoded and added
@@ -167,6 +199,31 @@ class ZoteroTests(unittest.TestCase):
         response = zot.items()
         self.assertEqual(u'JIFWQ4AN', response[:8])
 
+    def testKeysAndVersions(self):
+        """ Keys should be returned as a list, and versions as a dict
+        """
+        zot = z.Zotero('myuserid', 'user', 'myuserkey')
+        HTTPretty.register_uri(
+            HTTPretty.GET,
+            'https://api.zotero.org/users/myuserid/items',
+            content_type='text/plain',
+            body=self.keys_response)
+        keys = zot.item_keys(itemType='book')
+        self.assertEqual('JIFWQ4AN', keys[0])
+        self.assertEqual(len(self.keys_response.split()), len(keys))
+        self.assertEqual(['keys'], HTTPretty.last_request.querystring['format'])
+        self.assertEqual(['book'], HTTPretty.last_request.querystring['itemType'])
+        HTTPretty.register_uri(
+            HTTPretty.GET,
+            'https://api.zotero.org/users/myuserid/collections',
+            content_type='application/json',
+            body='{"ABCD2345": 10, "BCDE3456": 12}')
+        self.assertEqual(
+            {'ABCD2345': 10, 'BCDE3456': 12}, zot.collection_versions(since=9))
+        self.assertEqual(
+            ['versions'], HTTPretty.last_request.querystring['format'])
+        self.assertEqual(['9'], HTTPretty.last_request.querystring['since'])
+
     @httpretty.activate
     def testParseChildItems(self):
         """ Try and parse child items """
@@ -387,6 +444,40 @@ class ZoteroTests(unittest.TestCase):
         with self.assertRaises(z.ze.ParamNotPassed):
             t = zot.create_collection(t)
 
+    @httpretty.activate
+    def testCollectionWrites(self):
+        """ Creation responses should be returned, and updated collections
+            should be sent
+        """
+        zot = z.Zotero('myuserID', 'user', 'myuserkey')
+        HTTPretty.register_uri(
+            HTTPretty.POST,
+            'https://api.zotero.org/users/myuserID/collections',
+            body=self.creation_doc,
+            content_type='application/json')
+        resp = zot.create_collection([{'name': 'LoC'}])
+        self.assertEqual('ABC123', json.loads(resp)['success']['0'])
+        resp = zot.create_collections([{'name': 'LoC'}])
+        self.assertEqual('ABC123', resp['success']['0'])
+        self.assertEqual(
+            [{'name': 'LoC', 'parentCollection': ''}],
+            json.loads(HTTPretty.last_request.body.decode('utf-8')))
+        HTTPretty.register_uri(
+            HTTPretty.PUT,
+            'https://api.zotero.org/users/myuserID/collections/KIMI8BSG',
+            status=204, body='')
+        collection = json.loads(self.collection_doc)
+        collection['data']['name'] = 'Library of Congress'
+        self.assertTrue(zot.update_collection(collection))
+        self.assertEqual(
+            'Library of Congress',
+            json.loads(HTTPretty.last_request.body.decode('utf-8'))['name'])
+        self.assertEqual(
+            '%s' % collection['version'],
+            HTTPretty.last_request.headers['If-Unmodified-Since-Version'])
+        with self.assertRaises(z.ze.TooManyItems):
+            zot.create_collection([{'name': 'c'}] * 51)
+
     # @httpretty.activate
     # def testUpdateItem(self):
     #     """ Test that we can update an item
@@ -451,10 +542,522 @@ class ZoteroTests(unittest.TestCase):
     #     with self.assertEqual(z.backoff.delay, 8):
     #         zot.items()
 
+    @httpretty.activate
+    def testTotalsKeepsParams(self):
+        """ Counting items shouldn't clear parameters set for the next call
+        """
+        zot = z.Zotero('myuserID', 'user', 'myuserkey')
+        HTTPretty.register_uri(
+            HTTPretty.GET,
+            'https://api.zotero.org/users/myuserID/items/top',
+            content_type='application/json',
+            adding_headers={'Total-Results': '20'},
+            body=self.items_doc)
+        zot.add_parameters(start=5)
+        self.assertEqual(20, zot.num_items())
+        self.assertEqual(
+            parse_qs('start=5&format=json'), parse_qs(zot.url_params))
+
+    @httpretty.activate
+    def testTotalsKeepsContent(self):
+        """ Counting items shouldn't change how the next call's content is
+            processed
+        """
+        zot = z.Zotero('myuserID', 'user', 'myuserkey')
+        HTTPretty.register_uri(
+            HTTPretty.GET,
+            'https://api.zotero.org/users/myuserID/items/top',
+            content_type='application/json',
+            adding_headers={'Total-Results': '20'},
+            body=self.items_doc)
+        HTTPretty.register_uri(
+            HTTPretty.GET,
+            'https://api.zotero.org/users/myuserID/items',
+            content_type='application/atom+xml',
+            body='''<?xml version="1.0"?>
+<feed xmlns="http://www.w3.org/2005/Atom">
+<title>Items</title>
+<entry><title>One</title><id>http://zotero.org/users/myuserID/items/ABC</id>
+<content type="application/json">{"id": "ABC", "title": "One"}</content>
+</entry>
+</feed>''')
+        zot.add_parameters(content='csljson')
+        self.assertEqual(20, zot.num_items())
+        self.assertEqual([{'id': 'ABC', 'title': 'One'}], zot.items())
+        self.assertEqual(
+            ['csljson'], HTTPretty.last_request.querystring['content'])
+
+    @httpretty.activate
+    def testBulkCounts(self):
+        """ Counts should be retrieved concurrently, then served from the
+            cache while the library version is unchanged
+        """
+        zot = z.Zotero('myuserID', 'user', 'myuserkey')
+        base = 'https://api.zotero.org/users/myuserID'
+        for path, total in (
+                ('/items/top', '20'),
+                ('/collections/ABCD2345/items', '7'),
+                ('/items', '3')):
+            HTTPretty.register_uri(
+                HTTPretty.HEAD,
+                base + path,
+                adding_headers={
+                    'Total-Results': total, 'Last-Modified-Version': '10'},
+                body='')
+        counts = zot.counts(collections=['abcd2345'], tags=['hi there'])
+        self.assertEqual(20, counts['top'])
+        self.assertEqual({'abcd2345': 7}, counts['collections'])
+        self.assertEqual({'hi there': 3}, counts['tags'])
+        self.assertEqual(3, len(HTTPretty.latest_requests))
+        tag_request = [r for r in HTTPretty.latest_requests
+                       if r.path.startswith('/users/myuserID/items?')][0]
+        self.assertEqual(['hi there'], tag_request.querystring['tag'])
+        self.assertEqual(['1'], tag_request.querystring['limit'])
+        # an unchanged library costs a single conditional request
+        HTTPretty.register_uri(
+            HTTPretty.HEAD,
+            base + '/items/top',
+            adding_headers={'Last-Modified-Version': '10'},
+            body='',
+            status=304)
+        self.assertEqual(
+            counts, zot.counts(collections=['abcd2345'], tags=['hi there']))
+        self.assertEqual(4, len(HTTPretty.latest_requests))
+        self.assertEqual(
+            '10',
+            HTTPretty.last_request.headers['If-Modified-Since-Version'])
+        # and no requests at all within max_age
+        zot.counts(collections=['abcd2345'], max_age=60)
+        self.assertEqual(4, len(HTTPretty.latest_requests))
+
+    @httpretty.activate
+    def testBulkCountsRetried(self):
+        """ Concurrent count requests which are each rate-limited once
+            should all be retried after the first delay
+        """
+        zot = z.Zotero('myuserID', 'user', 'myuserkey')
+        base = 'https://api.zotero.org/users/myuserID'
+        keys = ['COLL%04d' % n for n in range(8)]
+        paths = ['/collections/%s/items' % k for k in keys] + ['/items/top']
+        for n, path in enumerate(paths):
+            HTTPretty.register_uri(
+                HTTPretty.HEAD,
+                base + path,
+                responses=[
+                    HTTPretty.Response(body='', status=429),
+                    HTTPretty.Response(
+                        body='', adding_headers={
+                            'Total-Results': '%s' % n,
+                            'Last-Modified-Version': '10'})])
+        slept = []
+        sleep = z.time.sleep
+        z.time.sleep = slept.append
+        try:
+            counts = zot.counts(collections=keys, max_workers=8)
+        finally:
+            z.time.sleep = sleep
+        self.assertEqual(8, counts['top'])
+        self.assertEqual(
+            dict((k, n) for n, k in enumerate(keys)), counts['collections'])
+        self.assertEqual([2] * 9, slept)
+
+    def testMemoizedReads(self):
+        """ Memoized reads should cost one version check per interval, and
+            be dropped when the library changes
+        """
+        zot = z.Zotero('myuserID', 'user', 'myuserkey', memoize=0)
+        base = 'https://api.zotero.org/users/myuserID'
+        HTTPretty.register_uri(
+            HTTPretty.GET,
+            base + '/items/top',
+            content_type='application/json',
+            adding_headers={'Last-Modified-Version': '10'},
+            body=self.items_doc)
+        HTTPretty.register_uri(
+            HTTPretty.HEAD,
+            base + '/items/top',
+            adding_headers={'Last-Modified-Version': '10'},
+            body='',
+            status=304)
+        first = zot.top(limit=1)
+        first[0]['data']['title'] = 'Changed by the caller'
+        self.assertEqual(1, len(HTTPretty.latest_requests))
+        second = zot.top(limit=1)
+        self.assertNotEqual('Changed by the caller', second[0]['data']['title'])
+        self.assertEqual(2, len(HTTPretty.latest_requests))
+        self.assertEqual('HEAD', HTTPretty.last_request.method)
+        self.assertEqual(
+            '10', HTTPretty.last_request.headers['If-Modified-Since-Version'])
+        # different parameters are memoized separately
+        zot.top(limit=2)
+        self.assertEqual('GET', HTTPretty.last_request.method)
+        # no version checks at all within the interval
+        zot.memo.interval = 60
+        zot.top(limit=1)
+        zot.top(limit=2)
+        self.assertEqual(3, len(HTTPretty.latest_requests))
+        # a library change drops every memoized result
+        zot.memo.interval = 0
+        HTTPretty.register_uri(
+            HTTPretty.GET,
+            base + '/items/top',
+            content_type='application/json',
+            adding_headers={'Last-Modified-Version': '11'},
+            body=self.items_doc)
+        HTTPretty.register_uri(
+            HTTPretty.HEAD,
+            base + '/items/top',
+            adding_headers={'Last-Modified-Version': '11', 'Total-Results': '1'},
+            body='')
+        zot.top(limit=1)
+        self.assertEqual(5, len(HTTPretty.latest_requests))
+        self.assertEqual('GET', HTTPretty.last_request.method)
+        self.assertEqual(11, zot.memo.version)
+
+    def testBatches(self):
+        """ Batches should be limited by size and joined length
+        """
+        self.assertEqual(
+            [50, 50, 20],
+            [len(b) for b in z.batches(['ABCD2345'] * 120, ',')])
+        self.assertEqual(
+            [['aaaa', 'bbbb'], ['cccc']],
+            list(z.batches(['aaaa', 'bbbb', 'cccc'], ' || ', length=16)))
+
+    def testBatchesMeasureEncodedLength(self):
+        """ Batches should be limited by their percent-encoded length
+        """
+        tags = [u'\u00e9t\u00e9 %s' % n for n in range(50)]
+        batched = list(z.batches(tags, u' || ', length=200))
+        self.assertEqual(50, sum(len(b) for b in batched))
+        for batch in batched:
+            encoded = urlencode({'tag': u' || '.join(batch).encode('utf-8')})
+            self.assertLessEqual(len(encoded) - len('tag='), 200)
+        self.assertEqual(
+            [50], [len(b) for b in z.batches(tags, ' || ', length=4000)])
+
+    def testBulkDeletes(self):
+        """ Deletes should be sent in batches, using the library version
+            from each response, and retried if the library has changed
+        """
+        zot = z.Zotero('myuserID', 'user', 'myuserkey')
+        base = 'https://api.zotero.org/users/myuserID'
+        HTTPretty.register_uri(
+            HTTPretty.HEAD,
+            base + '/items/top',
+            adding_headers={
+                'Total-Results': '1', 'Last-Modified-Version': '10'},
+            body='')
+        HTTPretty.register_uri(
+            HTTPretty.DELETE,
+            base + '/items',
+            responses=[
+                httpretty.Response(
+                    body='', status=204,
+                    adding_headers={'Last-Modified-Version': '11'}),
+                httpretty.Response(body='', status=412),
+                httpretty.Response(
+                    body='', status=204,
+                    adding_headers={'Last-Modified-Version': '12'})])
+        keys = ['K%07d' % i for i in range(60)]
+        results = zot.delete_items(keys)
+        self.assertEqual([50, 10], [len(r['keys']) for r in results])
+        self.assertEqual([11, 12], [r['version'] for r in results])
+        deletes = [r for r in HTTPretty.latest_requests
+                   if r.method == 'DELETE']
+        self.assertEqual(
+            ['10', '11', '10'],
+            [r.headers['If-Unmodified-Since-Version'] for r in deletes])
+        self.assertEqual(
+            keys[50:], deletes[-1].querystring['itemKey'][0].split(','))
+        HTTPretty.register_uri(
+            HTTPretty.DELETE, base + '/tags', body='', status=403)
+        with self.assertRaises(z.ze.UserNotAuthorised):
+            zot.delete_tags(['one', 'two'])
+        results = zot.delete_tags(['one', 'two'], errors='skip')
+        self.assertTrue(
+            isinstance(results[0]['error'], z.ze.UserNotAuthorised))
+        self.assertEqual(
+            ['one || two'], HTTPretty.last_request.querystring['tag'])
+
+    def testEmptyTrash(self):
+        """ The trash should be deleted a page at a time, resuming from a
+            checkpoint after an error
+        """
+        zot = z.Zotero('myuserID', 'user', 'myuserkey')
+        base = 'https://api.zotero.org/users/myuserID'
+        tmp = tempfile.mkdtemp()
+        checkpoint = os.path.join(tmp, 'trash.json')
+
+        def page(*keys):
+            return httpretty.Response(
+                body=''.join('%s\n' % k for k in keys),
+                content_type='text/plain',
+                adding_headers={'Last-Modified-Version': '20'})
+        try:
+            HTTPretty.register_uri(
+                HTTPretty.GET,
+                base + '/items/trash',
+                responses=[
+                    page('AAAA2222', 'BBBB2222'),
+                    page('CCCC2222'),
+                    page('CCCC2222'),
+                    page()])
+            HTTPretty.register_uri(
+                HTTPretty.DELETE,
+                base + '/items',
+                responses=[
+                    httpretty.Response(
+                        body='', status=204,
+                        adding_headers={'Last-Modified-Version': '21'}),
+                    httpretty.Response(body='', status=403),
+                    httpretty.Response(
+                        body='', status=204,
+                        adding_headers={'Last-Modified-Version': '22'})])
+            with self.assertRaises(z.ze.UserNotAuthorised):
+                zot.empty_trash(checkpoint, page=2)
+            with open(checkpoint) as f:
+                self.assertEqual(2, json.load(f)['deleted'])
+            listing = [r for r in HTTPretty.latest_requests
+                       if r.method == 'GET'][0]
+            self.assertEqual(['keys'], listing.querystring['format'])
+            self.assertEqual(['2'], listing.querystring['limit'])
+            state = zot.empty_trash(checkpoint, page=2)
+            self.assertEqual(3, state['deleted'])
+            self.assertEqual(22, state['version'])
+            self.assertFalse(os.path.exists(checkpoint))
+            deletes = [r for r in HTTPretty.latest_requests
+                       if r.method == 'DELETE']
+            # the library version comes from the listing, not a HEAD request
+            self.assertEqual(
+                ['20', '20', '20'],
+                [r.headers['If-Unmodified-Since-Version'] for r in deletes])
+        finally:
+            shutil.rmtree(tmp)
+
+    @httpretty.activate
+    def testEmptyTrashRecordsLaterBatches(self):
+        """ Batches deleted after a failing batch should be recorded in the
+            checkpoint before the error is raised
+        """
+        zot = z.Zotero('myuserID', 'user', 'myuserkey')
+        base = 'https://api.zotero.org/users/myuserID'
+        tmp = tempfile.mkdtemp()
+        checkpoint = os.path.join(tmp, 'trash.json')
+        try:
+            HTTPretty.register_uri(
+                HTTPretty.GET,
+                base + '/items/trash',
+                body=''.join('ITEM%04d\n' % n for n in range(60)),
+                content_type='text/plain',
+                adding_headers={'Last-Modified-Version': '20'})
+            HTTPretty.register_uri(
+                HTTPretty.DELETE,
+                base + '/items',
+                responses=[
+                    httpretty.Response(body='', status=403),
+                    httpretty.Response(
+                        body='', status=204,
+                        adding_headers={'Last-Modified-Version': '21'})])
+            with self.assertRaises(z.ze.UserNotAuthorised):
+                zot.empty_trash(checkpoint)
+            with open(checkpoint) as f:
+                state = json.load(f)
+            self.assertEqual(10, state['deleted'])
+            self.assertEqual(21, state['version'])
+        finally:
+            shutil.rmtree(tmp)
+
+    def testChildrenMany(self):
+        """ Children should be retrieved for items which have them, following
+            next links, and returned in the order the items were passed
+        """
+        items = json.loads(self.items_doc)
+        base = 'https://api.zotero.org/users/myuserID/items'
+
+        def listing(request, uri, headers):
+            """ answer itemKey requests """
+            keys = request.querystring['itemKey'][0].split(',')
+            headers['Content-Type'] = 'application/json'
+            return (200, headers, json.dumps(
+                [i for i in items if i['key'] in keys]))
+
+        def children(request, uri, headers):
+            """ answer children requests, with two pages for NM66T6EF """
+            parent = urlparse(uri).path.split('/')[-2]
+            start = int(request.querystring.get('start', ['0'])[0])
+            headers['Content-Type'] = 'application/json'
+            if parent == 'NM66T6EF' and not start:
+                headers['Link'] = '<%s/NM66T6EF/children?start=1>; ' \
+                    'rel="next"' % base
+            return (200, headers, json.dumps(
+                [{'key': '%s-%s' % (parent, start)}]))
+
+        HTTPretty.register_uri(HTTPretty.GET, base, body=listing)
+        HTTPretty.register_uri(
+            HTTPretty.GET, re.compile(r'.*/items/\w+/children'), body=children)
+        zot = z.Zotero('myuserID', 'user', 'myuserkey')
+        wanted = ['z6te2umt', 'Z8N84QAJ', 'NM66T6EF', 'MISSING1']
+        found = zot.children_many(wanted, limit=1)
+        self.assertEqual(
+            ['Z6TE2UMT', 'Z8N84QAJ', 'NM66T6EF', 'MISSING1'], list(found))
+        self.assertEqual([{'key': 'Z6TE2UMT-0'}], found['Z6TE2UMT'])
+        self.assertEqual(
+            ['NM66T6EF-0', 'NM66T6EF-1'],
+            [c['key'] for c in found['NM66T6EF']])
+        self.assertEqual([], found['Z8N84QAJ'])
+        self.assertEqual([], found['MISSING1'])
+        # one itemKey request, and children only for items which have them
+        self.assertEqual(4, len(HTTPretty.latest_requests))
+        # items which were retrieved already don't need an itemKey request
+        found = zot.children_many(items[:3])
+        self.assertEqual(['NM66T6EF', 'PQKBRC33', 'Z8N84QAJ'], list(found))
+        self.assertEqual(7, len(HTTPretty.latest_requests))
+
+    @httpretty.activate
+    def testChildrenManyRetried(self):
+        """ Concurrent children requests which are each rate-limited once
+            should all be retried after the first delay
+        """
+        base = 'https://api.zotero.org/users/myuserID/items'
+        keys = ['ITEM%04d' % n for n in range(8)]
+        for key in keys:
+            HTTPretty.register_uri(
+                HTTPretty.GET,
+                '%s/%s/children' % (base, key),
+                responses=[
+                    HTTPretty.Response(body='', status=429),
+                    HTTPretty.Response(
+                        body=json.dumps([{'key': '%s-0' % key}]),
+                        status=200,
+                        content_type='application/json')])
+        zot = z.Zotero('myuserID', 'user', 'myuserkey')
+        slept = []
+        sleep = z.time.sleep
+        z.time.sleep = slept.append
+        try:
+            found = zot.children_many(
+                [{'key': k, 'meta': {'numChildren': 1}} for k in keys])
+        finally:
+            z.time.sleep = sleep
+        self.assertEqual(
+            [[{'key': '%s-0' % k}] for k in keys], list(found.values()))
+        self.assertEqual([2] * 8, slept)
+
+    def testExport(self):
+        """ Pages should be exported in order, optionally compressed
+        """
+        zot = z.Zotero('exporter', 'user', 'myuserkey')
+
+        def respond(request, uri, headers):
+            start = int(request.querystring['start'][0])
+            limit = int(request.querystring['limit'][0])
+            keys = range(start, min(start + limit, 25))
+            headers['Total-Results'] = '25'
+            if request.querystring['format'] == ['csljson']:
+                headers['Content-Type'] = 'application/json'
+                body = json.dumps({'items': [{'id': k} for k in keys]})
+            else:
+                headers['Content-Type'] = 'application/x-bibtex'
+                body = '\n'.join('@book{k%s}' % k for k in keys)
+            return (200, headers, body)
+        HTTPretty.register_uri(
+            HTTPretty.GET,
+            'https://api.zotero.org/users/exporter/items',
+            body=respond)
+        out = io.BytesIO()
+        self.assertEqual(25, zot.export('bibtex', out, workers=2, limit=4))
+        self.assertEqual(
+            ['@book{k%s}' % k for k in range(25)],
+            out.getvalue().decode('utf-8').split())
+        self.assertEqual(7, len(HTTPretty.latest_requests))
+        out = io.BytesIO()
+        zot.export('csljson', out, compress=True, limit=10, itemType='book')
+        exported = json.loads(
+            gzip.GzipFile(fileobj=io.BytesIO(out.getvalue())).read().decode(
+                'utf-8'))
+        self.assertEqual(list(range(25)), [i['id'] for i in exported['items']])
+        self.assertEqual(['book'], HTTPretty.last_request.querystring['itemType'])
+
+    @httpretty.activate
+    def testExportCountsWrittenItems(self):
+        """ The number of items written should be returned, even if items
+            are deleted during the export
+        """
+        zot = z.Zotero('exporter', 'user', 'myuserkey')
+
+        def respond(request, uri, headers):
+            # the first page's total is out of date by the last page
+            start = int(request.querystring['start'][0])
+            limit = int(request.querystring['limit'][0])
+            keys = range(start, min(start + limit, 22))
+            headers['Total-Results'] = '25'
+            if request.querystring['format'] == ['csljson']:
+                headers['Content-Type'] = 'application/json'
+                body = json.dumps({'items': [{'id': k} for k in keys]})
+            else:
+                headers['Content-Type'] = 'application/x-bibtex'
+                body = '\n'.join('@book{k%s,\n}' % k for k in keys)
+            return (200, headers, body)
+        HTTPretty.register_uri(
+            HTTPretty.GET,
+            'https://api.zotero.org/users/exporter/items',
+            body=respond)
+        self.assertEqual(22, zot.export('bibtex', io.BytesIO(), limit=10))
+        self.assertEqual(22, zot.export('csljson', io.BytesIO(), limit=10))
+        # records can't be counted in this format
+        self.assertEqual(25, zot.export('mods', io.BytesIO(), limit=10))
+
+    @httpretty.activate
+    def testExportRetried(self):
+        """ Concurrent page requests which are each rate-limited once should
+            all be retried after the first delay, and written in order
+        """
+        zot = z.Zotero('exporter', 'user', 'myuserkey')
+        limited = set()
+
+        def respond(request, uri, headers):
+            start = int(request.querystring['start'][0])
+            if start not in limited:
+                limited.add(start)
+                return (429, headers, '')
+            headers['Total-Results'] = '25'
+            headers['Content-Type'] = 'application/x-bibtex'
+            return (200, headers, '\n'.join(
+                '@book{k%s}' % k for k in range(start, min(start + 4, 25))))
+        HTTPretty.register_uri(
+            HTTPretty.GET,
+            'https://api.zotero.org/users/exporter/items',
+            body=respond)
+        out = io.BytesIO()
+        slept = []
+        sleep = z.time.sleep
+        z.time.sleep = slept.append
+        try:
+            self.assertEqual(25, zot.export('bibtex', out, workers=4, limit=4))
+        finally:
+            z.time.sleep = sleep
+        self.assertEqual(
+            ['@book{k%s}' % k for k in range(25)],
+            out.getvalue().decode('utf-8').split())
+        self.assertEqual([2] * 7, slept)
+
+    def testDeferredImports(self):
+        """ Importing the module shouldn't import requests, feedparser etc.
+        """
+        probe = (
+            'import sys; from pyzotero.pyzotero import zotero; '
+            'print(" ".join(m for m in ("requests", "feedparser", "pytz", '
+            '"mimetypes", "hashlib", "uuid") if m in sys.modules))')
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        out = subprocess.check_output([sys.executable, '-c', probe], env=env)
+        self.assertEqual(b'', out.strip())
+
     def tearDown(self):
         """ Tear stuff down
         """
         HTTPretty.disable()
+        HTTPretty.reset()
 
 
 if __name__ == "__main__":